@@ -146,6 +146,7 @@ export interface ServicesTable {
     mode: string | null;
     centrePointLon: string | null;
     centrePointLat: string | null;
+    fingerprint: string | null;
 }
 
 export interface ServiceJourneyPatternsTable {
@@ -258,6 +259,26 @@ export interface HighwayAuthorityAdminAreaTable {
     administrativeAreaCode: string;
 }
 
+export interface TxcIngestLedgerTable {
+    id: Generated<number>;
+    dataSource: "bods" | "tnds";
+    contentHash: string;
+    filePath: string;
+    ingestedAt: Generated<string>;
+}
+
+export interface ServiceFileFingerprintsTable {
+    id: Generated<number>;
+    operatorServiceId: number;
+    filePath: string;
+    fingerprint: string | null;
+}
+
+export interface TxcIdSequencesTable {
+    tableName: string;
+    nextId: number;
+}
+
 export interface Database {
     stops: StopsTable;
     stops_new?: StopsTable;
@@ -297,6 +318,13 @@ export interface Database {
     nptg_admin_areas_old?: NptgAdminAreasTable;
     roadworks: RoadworksTable;
     highway_authority_admin_areas: HighwayAuthorityAdminAreaTable;
+    txc_id_sequences: TxcIdSequencesTable;
+    txc_ingest_ledger: TxcIngestLedgerTable;
+    txc_ingest_ledger_new?: TxcIngestLedgerTable;
+    txc_ingest_ledger_old?: TxcIngestLedgerTable;
+    service_file_fingerprints: ServiceFileFingerprintsTable;
+    service_file_fingerprints_new?: ServiceFileFingerprintsTable;
+    service_file_fingerprints_old?: ServiceFileFingerprintsTable;
 }
 
 export type Tables =
@@ -20,6 +20,8 @@ export const setupTables = async (dbClient: Kysely<Database>) => {
         "vehicle_journeys",
         "tracks",
         "services",
+        "txc_ingest_ledger",
+        "service_file_fingerprints",
     ];
 
     await waitForDb(dbClient);
@@ -28,6 +30,9 @@ export const setupTables = async (dbClient: Kysely<Database>) => {
         await dbClient.schema.dropTable(`${table}_new`).ifExists().execute();
         await sql`CREATE TABLE ${sql.ref(`${table}_new`)} LIKE ${sql.ref(table)}`.execute(dbClient);
     }
+
+    // the txc uploader reserves ids for the _new tables from here, so start again from the empty tables
+    await dbClient.deleteFrom("txc_id_sequences").execute();
 };
 
 const getBodsDataAndUploadToS3 = async (bodsUrl: string, txcZippedBucketName: string, fileName: string) => {
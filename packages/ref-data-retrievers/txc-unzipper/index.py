@@ -1,10 +1,40 @@
-import urllib.parse
+import json
 import boto3
 import os
 import logging
-from zipfile import ZipFile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+from urllib.parse import unquote_plus
+from zipfile import ZipFile, ZipInfo
 
-file_dir = "/tmp/file.zip"
+from botocore.exceptions import ClientError
+
+from nested_archive import (
+    DEFAULT_NESTED_ZIP_MAX_BYTES,
+    DEFAULT_NESTED_ZIP_MAX_DEPTH,
+    NestedArchiveBudget,
+    open_nested_archive,
+)
+from s3_seekable_file import DEFAULT_READ_AHEAD_BYTES, S3SeekableFile
+
+DEFAULT_UPLOAD_CONCURRENCY = 8
+
+read_ahead_bytes = int(os.getenv("S3_READ_AHEAD_BYTES", DEFAULT_READ_AHEAD_BYTES))
+upload_concurrency = int(os.getenv("UPLOAD_CONCURRENCY", DEFAULT_UPLOAD_CONCURRENCY))
+nested_zip_max_depth = int(
+    os.getenv("NESTED_ZIP_MAX_DEPTH", DEFAULT_NESTED_ZIP_MAX_DEPTH)
+)
+nested_zip_max_bytes = int(
+    os.getenv("NESTED_ZIP_MAX_BYTES", DEFAULT_NESTED_ZIP_MAX_BYTES)
+)
+# the _new tables are rebuilt from every file on each run, so skipping unchanged
+# members is only safe where their rows are kept, and FORCE_REFRESH overrides it
+skip_unchanged_members = (
+    os.getenv("SKIP_UNCHANGED_MEMBERS", "false") == "true"
+    and os.getenv("FORCE_REFRESH", "false") != "true"
+)
 
 s3 = boto3.client("s3")
 cloudwatch = boto3.client("cloudwatch")
@@ -13,43 +43,270 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def main(event, context):
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = urllib.parse.unquote_plus(
-        event["Records"][0]["s3"]["object"]["key"], encoding="utf-8")
+# get_s3_objects and the record handling in main are kept identical to the
+# txc-uploader's, as each lambda is packaged on its own
+def get_s3_objects(record):
+    if record.get("eventSource") == "aws:sqs":
+        # SQS messages carry an S3 event notification, s3:TestEvent messages have no records
+        s3_records = json.loads(record["body"]).get("Records", [])
+    else:
+        s3_records = [record]
+
+    return [
+        (
+            s3_record["s3"]["bucket"]["name"],
+            unquote_plus(s3_record["s3"]["object"]["key"], encoding="utf-8"),
+        )
+        for s3_record in s3_records
+    ]
+
+
+def collect_members(
+    source,
+    infos: list,
+    bucket: str,
+    key_base: str,
+    budget: NestedArchiveBudget,
+    depth: int = 0,
+) -> tuple:
+    """
+    Lists the (archive, ZipInfo, bucket, key, content type) members to upload from
+    the ZipInfos of an archive, and the (archive, ZipInfo, key, key base, depth)
+    nested archives within the budget, which are expanded when a worker reaches them.
+    Their members are given the keys the invocation for the nested archive would
+    have used. Nested archives past the budget are uploaded to the zipped bucket as
+    before.
+    """
+    xml_bucket = os.getenv("BUCKET_NAME")
+    members = []
+    nested_archives = []
+
+    for info in infos:
+        filename = info.filename
+        member_key = key_base + "/" + filename
+        if filename.endswith(".xml"):
+            members.append((source, info, xml_bucket, member_key, "application/xml"))
+        elif filename.endswith(".zip"):
+            if budget.try_reserve(depth + 1, info.file_size):
+                nested_key_base = key_base + "/" + os.path.splitext(filename)[0]
+                nested_archives.append(
+                    (source, info, member_key, nested_key_base, depth + 1)
+                )
+            else:
+                members.append((source, info, bucket, member_key, "application/zip"))
 
+    return members, nested_archives
+
+
+def get_member_metadata(info: ZipInfo) -> dict:
+    # from the central directory, so members can be compared without decompressing them
+    return {"crc32": f"{info.CRC:08x}", "size": str(info.file_size)}
+
+
+def is_member_unchanged(bucket: str, key: str, metadata: dict) -> bool:
     try:
-        logger.info(f"Unzipping file {key}")
+        existing_metadata = s3.head_object(Bucket=bucket, Key=key)["Metadata"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ["404", "NoSuchKey", "NotFound"]:
+            return False
+        raise e
 
-        s3.download_file(bucket, key, file_dir)
-        zipfile = ZipFile(file_dir)
+    return all(existing_metadata.get(name) == value for name, value in metadata.items())
 
-        key_base = os.path.splitext(key)[0]
 
-        namelist = zipfile.namelist()
-        xml_files = list(filter(lambda x: x.endswith(".xml"), namelist))
-        zip_files = list(filter(lambda x: x.endswith(".zip"), namelist))
-        key_base = "bods" if key_base == "bodsCoach" else key_base
-        for filename in xml_files:
-            s3.upload_fileobj(
-                zipfile.open(filename),
-                os.getenv("BUCKET_NAME"),
-                key_base + "/" + filename,
-                ExtraArgs={
-                    "ContentType": "application/xml"
-                }
-            )
+def upload_members(
+    members: list, nested_archives: list, bucket: str, budget: NestedArchiveBudget
+) -> dict:
+    """
+    Uploads (archive, ZipInfo, bucket, key, content type) members with up to
+    upload_concurrency workers, expanding nested archives as workers reach them so
+    only the archives being read are held in memory. ZipFile.open handles share the
+    position of the archive they were opened from, so each worker reads through its
+    own copy of each archive and ZipFile, which also keeps each read ahead buffer on
+    one member at a time. The copies of an archive are closed once all of its
+    members are done. Failures are collected per member rather than stopping the
+    other uploads.
+
+    Each upload stores the CRC32 and size of the member as object metadata. With
+    skip_unchanged_members, a member whose object already has the same values is not
+    uploaded again, so the uploader is not invoked for it either.
+    """
+    worker_zipfiles = {}
+    worker_zipfiles_lock = threading.Lock()
+    archive_stats = {"requests": 0, "bytes_fetched": 0}
+
+    def get_worker_zipfile(source) -> ZipFile:
+        worker_key = (threading.get_ident(), id(source))
+        with worker_zipfiles_lock:
+            zipfile = worker_zipfiles.get(worker_key)
+
+        if zipfile is None:
+            zipfile = ZipFile(source.open_copy())
+            with worker_zipfiles_lock:
+                worker_zipfiles[worker_key] = zipfile
+
+        return zipfile
 
-        for filename in zip_files:
+    def close_worker_zipfiles(source):
+        with worker_zipfiles_lock:
+            worker_keys = [
+                worker_key
+                for worker_key in worker_zipfiles
+                if worker_key[1] == id(source)
+            ]
+            zipfiles = [worker_zipfiles.pop(worker_key) for worker_key in worker_keys]
+
+        for zipfile in zipfiles:
+            archive_stats["requests"] += zipfile.fp.requests
+            archive_stats["bytes_fetched"] += zipfile.fp.bytes_fetched
+
+    def upload_member(member) -> Optional[int]:
+        source, info, destination_bucket, destination_key, content_type = member
+        metadata = get_member_metadata(info)
+        if skip_unchanged_members and is_member_unchanged(
+            destination_bucket, destination_key, metadata
+        ):
+            return None
+
+        with get_worker_zipfile(source).open(info) as member_file:
             s3.upload_fileobj(
-                zipfile.open(filename),
-                bucket,
-                key_base + "/" + filename,
-                ExtraArgs={
-                    "ContentType": "application/zip"
-                }
+                member_file,
+                destination_bucket,
+                destination_key,
+                ExtraArgs={"ContentType": content_type, "Metadata": metadata},
             )
 
+        return info.file_size
+
+    def expand_nested_archive(nested_archive) -> tuple:
+        source, info, _, _, _ = nested_archive
+        nested_source = open_nested_archive(source, get_worker_zipfile(source), info)
+
+        return nested_source, get_worker_zipfile(nested_source).infolist()
+
+    start = time.perf_counter()
+    uploaded = {}
+    unchanged = set()
+    failures = {}
+    content_types = {}
+    pending_by_source = {}
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max(upload_concurrency, 1)) as executor:
+
+        def submit(function, task):
+            # an archive is kept, with the copies workers opened of it, until every
+            # task reading it is done
+            source = task[0]
+            pending = pending_by_source.setdefault(id(source), [source, 0])
+            pending[1] += 1
+            futures[executor.submit(function, task)] = (function, task)
+
+        def submit_archive(members: list, nested_archives: list):
+            for member in members:
+                content_types[member[3]] = member[4]
+                submit(upload_member, member)
+            for nested_archive in nested_archives:
+                content_types[nested_archive[2]] = "application/zip"
+                submit(expand_nested_archive, nested_archive)
+
+        submit_archive(members, nested_archives)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                function, task = futures.pop(future)
+                source = task[0]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    key = task[2] if function is expand_nested_archive else task[3]
+                    failures[key] = e
+                else:
+                    if function is expand_nested_archive:
+                        nested_source, infos = result
+                        _, _, key, nested_key_base, depth = task
+                        del content_types[key]
+                        submit_archive(
+                            *collect_members(
+                                nested_source,
+                                infos,
+                                bucket,
+                                nested_key_base,
+                                budget,
+                                depth,
+                            )
+                        )
+                        if id(nested_source) not in pending_by_source:
+                            close_worker_zipfiles(nested_source)
+                    elif result is None:
+                        unchanged.add(task[3])
+                    else:
+                        uploaded[task[3]] = result
+
+                pending = pending_by_source[id(source)]
+                pending[1] -= 1
+                if pending[1] == 0:
+                    close_worker_zipfiles(source)
+                    del pending_by_source[id(source)]
+
+    seconds = time.perf_counter() - start
+    uploaded_bytes = sum(uploaded.values())
+
+    return {
+        "uploaded": uploaded,
+        "unchanged": unchanged,
+        "failures": failures,
+        "content_types": content_types,
+        "stats": {
+            "members": len(uploaded),
+            "unchanged_members": len(unchanged),
+            "failed_members": len(failures),
+            "bytes": uploaded_bytes,
+            "seconds": seconds,
+            "members_per_second": len(uploaded) / seconds if seconds else 0,
+            "bytes_per_second": uploaded_bytes / seconds if seconds else 0,
+            "concurrency": upload_concurrency,
+            "archive_requests": archive_stats["requests"],
+            "archive_bytes_fetched": archive_stats["bytes_fetched"],
+        },
+    }
+
+
+def unzip_file(bucket, key):
+    try:
+        logger.info(f"Unzipping file {key}")
+
+        # members are streamed from ranged GETs of the archive rather than a copy in /tmp
+        archive = S3SeekableFile(s3, bucket, key, read_ahead_bytes)
+        zipfile = ZipFile(archive)
+
+        key_base = os.path.splitext(key)[0]
+        key_base = "bods" if key_base == "bodsCoach" else key_base
+
+        budget = NestedArchiveBudget(nested_zip_max_depth, nested_zip_max_bytes)
+        members, nested_archives = collect_members(
+            archive, zipfile.infolist(), bucket, key_base, budget
+        )
+
+        result = upload_members(members, nested_archives, bucket, budget)
+        logger.info(
+            f"Nested archives in {key}: {budget.expanded} expanded, {budget.deferred} uploaded to be unzipped separately"
+        )
+        logger.info(f"Uploaded members of {key}: {result['stats']}")
+
+        content_types = result["content_types"]
+        xml_files_copied = [
+            member_key
+            for member_key in result["uploaded"]
+            if content_types[member_key] == "application/xml"
+        ]
+        xml_files_unchanged = [
+            member_key
+            for member_key in result["unchanged"]
+            if content_types[member_key] == "application/xml"
+        ]
+
         cloudwatch.put_metric_data(
             MetricData = [
                 {
@@ -61,13 +318,60 @@ def main(event, context):
                         },
                     ],
                     "Unit": "None",
-                    "Value": len(xml_files)
+                    "Value": len(xml_files_copied)
+                },
+                {
+                    "MetricName": "TxcFilesUnchanged",
+                    "Dimensions": [
+                        {
+                            "Name": "By Data Source",
+                            "Value": key.split("/")[0]
+                        },
+                    ],
+                    "Unit": "None",
+                    "Value": len(xml_files_unchanged)
                 },
             ],
             Namespace="ReferenceDataService/Retrievers"
         )
+
+        logger.info(f"Archive read stats for {key}: {archive.get_stats()}")
+
+        for destination_key, error in result["failures"].items():
+            logger.error(f"Failed to upload {destination_key} from {key}: {error}")
+        if result["failures"]:
+            raise RuntimeError(
+                f"{len(result['failures'])} of {len(content_types)} members of {key} failed to upload"
+            )
     except Exception as e:
         logger.error(e)
         logger.error(
             "Error getting object {} from bucket {}.".format(key, bucket))
         raise e
+
+
+def main(event, context):
+    records = event.get("Records", [])
+    is_sqs_batch = any(record.get("eventSource") == "aws:sqs" for record in records)
+    batch_item_failures = []
+    errors = []
+
+    for record in records:
+        try:
+            for bucket, key in get_s3_objects(record):
+                unzip_file(bucket, key)
+        except Exception as e:
+            if record.get("eventSource") == "aws:sqs":
+                batch_item_failures.append({"itemIdentifier": record["messageId"]})
+            else:
+                errors.append(e)
+
+    logger.info(
+        f"Processed {len(records)} records, {len(batch_item_failures) + len(errors)} failed"
+    )
+
+    if is_sqs_batch:
+        return {"batchItemFailures": batch_item_failures}
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,196 @@
+import io
+import struct
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+DEFAULT_NESTED_ZIP_MAX_DEPTH = 2
+DEFAULT_NESTED_ZIP_MAX_BYTES = 512 * 1024 * 1024
+
+LOCAL_FILE_HEADER_SIZE = 30
+LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+class ArchiveSlice(io.RawIOBase):
+    """
+    A read only, seekable view of part of another file, used to open a nested archive
+    that was stored without compression straight from the bytes of the outer archive.
+    """
+
+    def __init__(self, file, offset: int, length: int):
+        super().__init__()
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    @property
+    def requests(self) -> int:
+        return getattr(self.file, "requests", 0)
+
+    @property
+    def bytes_fetched(self) -> int:
+        return getattr(self.file, "bytes_fetched", 0)
+
+    def open_copy(self) -> "ArchiveSlice":
+        return ArchiveSlice(self.file.open_copy(), self.offset, self.length)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.length + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+
+        self.position = position
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = max(self.length - self.position, 0)
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            return b""
+
+        self.file.seek(self.offset + self.position)
+        data = self.file.read(size)
+        self.position += len(data)
+
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[: len(data)] = data
+
+        return len(data)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+
+class InMemoryArchive(io.RawIOBase):
+    """
+    A nested archive that was compressed in the outer archive, decompressed into
+    memory so it can be seeked. Copies read the same immutable buffer from a position
+    of their own, so the archive is held in memory once however many workers read it.
+    """
+
+    requests = 0
+    bytes_fetched = 0
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self.data = data
+        self.position = 0
+
+    def open_copy(self) -> "InMemoryArchive":
+        return InMemoryArchive(self.data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = len(self.data) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+
+        self.position = position
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self.data)
+
+        data = self.data[self.position : self.position + size]
+        self.position += len(data)
+
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[: len(data)] = data
+
+        return len(data)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+
+def get_member_data_offset(file, info: ZipInfo) -> int:
+    file.seek(info.header_offset)
+    header = file.read(LOCAL_FILE_HEADER_SIZE)
+    if not header.startswith(LOCAL_FILE_HEADER_SIGNATURE):
+        raise ValueError(f"Bad local file header for {info.filename}")
+
+    filename_length, extra_length = struct.unpack("<HH", header[26:30])
+
+    return info.header_offset + LOCAL_FILE_HEADER_SIZE + filename_length + extra_length
+
+
+def open_nested_archive(source, zipfile: ZipFile, info: ZipInfo):
+    """
+    Opens a .zip member of source as an archive of its own, reading it through
+    zipfile, which may be open on a copy of source. A stored member is read in place
+    from source, a compressed one is decompressed into memory as ZipFile needs to
+    seek backwards through it.
+    """
+    if info.compress_type == ZIP_STORED and not info.flag_bits & 0x1:
+        offset = get_member_data_offset(zipfile.fp, info)
+        return ArchiveSlice(source, offset, info.file_size)
+
+    with zipfile.open(info) as member_file:
+        return InMemoryArchive(member_file.read())
+
+
+class NestedArchiveBudget:
+    """
+    How deep and how many bytes of nested archives are expanded in one invocation.
+    Archives past either limit are uploaded to the zipped bucket to be unzipped by
+    an invocation of their own, as they were before.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = DEFAULT_NESTED_ZIP_MAX_DEPTH,
+        max_bytes: int = DEFAULT_NESTED_ZIP_MAX_BYTES,
+    ):
+        self.max_depth = max_depth
+        self.remaining_bytes = max_bytes
+        self.expanded = 0
+        self.deferred = 0
+
+    def try_reserve(self, depth: int, size: int) -> bool:
+        if depth > self.max_depth or size > self.remaining_bytes:
+            self.deferred += 1
+            return False
+
+        self.remaining_bytes -= size
+        self.expanded += 1
+        return True
@@ -0,0 +1,142 @@
+import io
+from typing import Optional
+
+DEFAULT_READ_AHEAD_BYTES = 8 * 1024 * 1024
+
+
+class S3SeekableFile(io.RawIOBase):
+    """
+    A read only, seekable file object over an S3 object, so ZipFile can read the
+    central directory and stream members without the archive being downloaded first.
+    Reads are served from a buffer filled by ranged GETs of at least read_ahead_bytes,
+    so memory use stays constant and the small reads ZipFile makes cost no requests.
+    Every GET is made with the ETag of the object when it was opened, so an archive
+    replaced part way through fails rather than mixing two versions.
+    """
+
+    def __init__(
+        self,
+        s3,
+        bucket: str,
+        key: str,
+        read_ahead_bytes: int = DEFAULT_READ_AHEAD_BYTES,
+        head: Optional[dict] = None,
+    ):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.read_ahead_bytes = read_ahead_bytes
+
+        if head is None:
+            head = s3.head_object(Bucket=bucket, Key=key)
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"]
+
+        self.position = 0
+        self.buffer = b""
+        self.buffer_start = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def open_copy(self) -> "S3SeekableFile":
+        """
+        Opens the same version of the object with a position and buffer of its own,
+        for reading from another thread.
+        """
+        return S3SeekableFile(
+            self.s3,
+            self.bucket,
+            self.key,
+            self.read_ahead_bytes,
+            {"ContentLength": self.size, "ETag": self.etag},
+        )
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+
+        self.position = position
+        return self.position
+
+    def fetch(self, start: int, length: int):
+        end = min(start + length, self.size) - 1
+        response = self.s3.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={start}-{end}",
+            IfMatch=self.etag,
+        )
+        self.buffer = response["Body"].read()
+        self.buffer_start = start
+        self.requests += 1
+        self.bytes_fetched += len(self.buffer)
+
+    def read_from_buffer(self, size: int) -> bytes:
+        """
+        Returns up to size bytes from the current position, fetching read_ahead_bytes
+        when the position is outside the buffer.
+        """
+        if self.position >= self.size or size <= 0:
+            return b""
+
+        offset = self.position - self.buffer_start
+        if offset < 0 or offset >= len(self.buffer):
+            # reads near the end are for the central directory, which ZipFile reads
+            # backwards from the end record, so the buffer ends at the end of the file
+            start = min(self.position, max(self.size - self.read_ahead_bytes, 0))
+            self.fetch(start, self.read_ahead_bytes)
+            offset = self.position - start
+
+        data = self.buffer[offset : offset + size]
+        self.position += len(data)
+
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read_from_buffer(len(b))
+        b[: len(data)] = data
+
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self.position
+
+        chunks = []
+        while size > 0:
+            data = self.read_from_buffer(size)
+            if not data:
+                break
+            chunks.append(data)
+            size -= len(data)
+
+        return b"".join(chunks)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def get_stats(self) -> dict:
+        return {
+            "size": self.size,
+            "requests": self.requests,
+            "bytes_fetched": self.bytes_fetched,
+        }
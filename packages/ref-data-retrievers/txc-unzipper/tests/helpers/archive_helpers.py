@@ -0,0 +1,30 @@
+import io
+import random
+from zipfile import ZIP_DEFLATED, ZipFile
+
+zipped_bucket = "txc-zipped"
+xml_bucket = "txc-xml"
+
+
+def create_buckets(s3, *buckets):
+    for bucket in buckets:
+        s3.create_bucket(
+            Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+        )
+
+
+def random_bytes(size: int, seed: int = 0) -> bytes:
+    # incompressible, so archive sizes and offsets do not depend on the compression
+    return random.Random(seed).randbytes(size)
+
+
+def create_archive(members: dict, compress_type: int = ZIP_DEFLATED) -> bytes:
+    """
+    A zip archive of {filename: bytes} members, each written with compress_type.
+    """
+    archive = io.BytesIO()
+    with ZipFile(archive, "w") as zipfile:
+        for filename, data in members.items():
+            zipfile.writestr(filename, data, compress_type=compress_type)
+
+    return archive.getvalue()
@@ -0,0 +1,349 @@
+import gc
+import importlib
+import json
+import threading
+import weakref
+from collections import Counter
+from unittest.mock import MagicMock, patch
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+from botocore.exceptions import ClientError
+
+from s3_seekable_file import S3SeekableFile
+from tests.helpers.archive_helpers import (
+    create_archive,
+    create_buckets,
+    random_bytes,
+    xml_bucket,
+    zipped_bucket,
+)
+
+members = {f"member-{index}.xml": random_bytes(2048, index) for index in range(6)}
+
+
+def create_nested_archive(compress_type: int = ZIP_STORED) -> bytes:
+    deep_archive = create_archive({"d.xml": b"<d />"})
+    return create_archive(
+        {
+            "SE.zip": create_archive({"x.xml": b"<x />", "y.xml": b"<y />"}),
+            "MID.zip": create_archive(
+                {"m.xml": b"<m />", "deep.zip": deep_archive}, compress_type
+            ),
+        },
+        compress_type,
+    )
+
+
+@pytest.fixture(scope="function")
+def index(s3, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    monkeypatch.setenv("BUCKET_NAME", xml_bucket)
+    index = importlib.import_module("index")
+    monkeypatch.setattr(index, "s3", s3)
+    monkeypatch.setattr(index, "cloudwatch", MagicMock())
+    monkeypatch.setattr(index, "read_ahead_bytes", 1024)
+    monkeypatch.setattr(index, "upload_concurrency", 4)
+    monkeypatch.setattr(index, "skip_unchanged_members", False)
+    monkeypatch.setattr(index, "nested_zip_max_depth", 2)
+    monkeypatch.setattr(index, "nested_zip_max_bytes", 1024 * 1024)
+    create_buckets(s3, zipped_bucket, xml_bucket)
+    yield index
+
+
+def put_archive(s3, key: str, archive: bytes):
+    s3.put_object(Bucket=zipped_bucket, Key=key, Body=archive)
+
+
+def list_keys(s3, bucket: str) -> list:
+    return sorted(
+        content["Key"]
+        for content in s3.list_objects_v2(Bucket=bucket).get("Contents", [])
+    )
+
+
+def get_metric_values(index) -> dict:
+    return {
+        metric["MetricName"]: metric["Value"]
+        for metric in index.cloudwatch.put_metric_data.call_args.kwargs["MetricData"]
+    }
+
+
+def s3_record(key: str, bucket: str = zipped_bucket) -> dict:
+    return {
+        "eventSource": "aws:s3",
+        "s3": {"bucket": {"name": bucket}, "object": {"key": key}},
+    }
+
+
+def sqs_record(message_id: str, *keys: str) -> dict:
+    return {
+        "eventSource": "aws:sqs",
+        "messageId": message_id,
+        "body": json.dumps({"Records": [s3_record(key) for key in keys]}),
+    }
+
+
+class TestUploadMembers:
+    def test_members_are_uploaded_with_their_metadata(self, index, s3):
+        put_archive(s3, "tnds/SE.zip", create_archive(members))
+
+        index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        assert list_keys(s3, xml_bucket) == [f"tnds/SE/{name}" for name in members]
+        for name, data in members.items():
+            xml_object = s3.get_object(Bucket=xml_bucket, Key=f"tnds/SE/{name}")
+            assert xml_object["Body"].read() == data
+            assert xml_object["ContentType"] == "application/xml"
+            assert xml_object["Metadata"]["size"] == str(len(data))
+        assert get_metric_values(index) == {
+            "TxcFilesCopied": 6,
+            "TxcFilesUnchanged": 0,
+        }
+
+    def test_other_members_are_uploaded_when_one_fails(self, index, s3):
+        put_archive(s3, "tnds/SE.zip", create_archive(members))
+        upload_fileobj = s3.upload_fileobj
+
+        def fail_one_upload(file, bucket, key, **kwargs):
+            if key == "tnds/SE/member-2.xml":
+                raise Exception("upload failed")
+            return upload_fileobj(file, bucket, key, **kwargs)
+
+        with patch.object(s3, "upload_fileobj", side_effect=fail_one_upload):
+            with pytest.raises(RuntimeError, match="1 of 6 members"):
+                index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        assert list_keys(s3, xml_bucket) == [
+            f"tnds/SE/{name}" for name in members if name != "member-2.xml"
+        ]
+        assert get_metric_values(index)["TxcFilesCopied"] == 5
+
+    def test_each_worker_reads_from_its_own_archive(self, index, s3):
+        put_archive(s3, "tnds/SE.zip", create_archive(members, ZIP_STORED))
+        open_copy = S3SeekableFile.open_copy
+        upload_fileobj = s3.upload_fileobj
+        copies_by_thread = Counter()
+        upload_threads = set()
+
+        def record_copy(archive):
+            copies_by_thread[threading.get_ident()] += 1
+            return open_copy(archive)
+
+        def record_upload(*args, **kwargs):
+            upload_threads.add(threading.get_ident())
+            return upload_fileobj(*args, **kwargs)
+
+        with patch.object(
+            S3SeekableFile, "open_copy", autospec=True, side_effect=record_copy
+        ), patch.object(s3, "upload_fileobj", side_effect=record_upload), patch(
+            "index.ZipFile", wraps=index.ZipFile
+        ) as zipfile_patch:
+            index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        opened_archives = [call.args[0] for call in zipfile_patch.call_args_list]
+        assert threading.get_ident() not in upload_threads
+        assert set(copies_by_thread) == upload_threads
+        assert set(copies_by_thread.values()) == {1}
+        assert len(opened_archives) == len(upload_threads) + 1
+        assert len({id(archive) for archive in opened_archives}) == len(
+            opened_archives
+        )
+        assert len(list_keys(s3, xml_bucket)) == 6
+
+
+class TestNestedArchives:
+    expanded_keys = [
+        "tnds/MID/deep/d.xml",
+        "tnds/MID/m.xml",
+        "tnds/SE/x.xml",
+        "tnds/SE/y.xml",
+    ]
+
+    def unzip_deferred_archives(self, index, s3):
+        # what the invocations triggered by the zipped bucket would have done
+        unzipped = set()
+        while set(list_keys(s3, zipped_bucket)) - unzipped:
+            for key in sorted(set(list_keys(s3, zipped_bucket)) - unzipped):
+                unzipped.add(key)
+                index.unzip_file(zipped_bucket, key)
+
+    def test_nested_members_are_uploaded_to_the_same_keys(self, index, s3):
+        put_archive(s3, "tnds.zip", create_nested_archive())
+        index.unzip_file(zipped_bucket, "tnds.zip")
+        expanded_keys = list_keys(s3, xml_bucket)
+
+        for key in expanded_keys:
+            s3.delete_object(Bucket=xml_bucket, Key=key)
+        index.nested_zip_max_depth = 0
+        self.unzip_deferred_archives(index, s3)
+
+        assert expanded_keys == self.expanded_keys
+        assert list_keys(s3, xml_bucket) == self.expanded_keys
+        deep_object = s3.get_object(Bucket=xml_bucket, Key="tnds/MID/deep/d.xml")
+        assert deep_object["Body"].read() == b"<d />"
+
+    def test_archives_past_the_depth_are_deferred(self, index, s3):
+        index.nested_zip_max_depth = 1
+        put_archive(s3, "tnds.zip", create_nested_archive())
+
+        index.unzip_file(zipped_bucket, "tnds.zip")
+
+        assert list_keys(s3, zipped_bucket) == ["tnds.zip", "tnds/MID/deep.zip"]
+        assert list_keys(s3, xml_bucket) == [
+            "tnds/MID/m.xml",
+            "tnds/SE/x.xml",
+            "tnds/SE/y.xml",
+        ]
+
+        self.unzip_deferred_archives(index, s3)
+        assert list_keys(s3, xml_bucket) == self.expanded_keys
+
+    @pytest.mark.parametrize("compress_type", [ZIP_STORED, ZIP_DEFLATED])
+    def test_nested_archives_are_expanded_by_the_workers(
+        self, index, s3, compress_type
+    ):
+        put_archive(s3, "tnds.zip", create_nested_archive(compress_type))
+        open_nested_archive = index.open_nested_archive
+        expanded = []
+
+        def record_expansion(source, zipfile, info):
+            nested_source = open_nested_archive(source, zipfile, info)
+            expanded.append((threading.get_ident(), weakref.ref(nested_source)))
+            return nested_source
+
+        with patch("index.open_nested_archive", side_effect=record_expansion):
+            index.unzip_file(zipped_bucket, "tnds.zip")
+        gc.collect()
+
+        assert len(expanded) == 3
+        assert threading.get_ident() not in {thread for thread, _ in expanded}
+        assert [archive() for _, archive in expanded] == [None, None, None]
+        assert list_keys(s3, xml_bucket) == self.expanded_keys
+
+    def test_archives_past_the_bytes_are_deferred(self, index, s3):
+        put_archive(s3, "tnds.zip", create_nested_archive())
+        zipfile = index.ZipFile(index.S3SeekableFile(s3, zipped_bucket, "tnds.zip"))
+        index.nested_zip_max_bytes = zipfile.getinfo("SE.zip").file_size
+
+        index.unzip_file(zipped_bucket, "tnds.zip")
+
+        assert list_keys(s3, zipped_bucket) == ["tnds.zip", "tnds/MID.zip"]
+        assert list_keys(s3, xml_bucket) == ["tnds/SE/x.xml", "tnds/SE/y.xml"]
+
+        self.unzip_deferred_archives(index, s3)
+        assert list_keys(s3, xml_bucket) == self.expanded_keys
+
+
+class TestSkipUnchangedMembers:
+    def test_member_metadata_comes_from_the_central_directory(self, index, s3):
+        put_archive(s3, "tnds/SE.zip", create_archive({"x.xml": b"<x />"}))
+        zipfile = ZipFile(index.S3SeekableFile(s3, zipped_bucket, "tnds/SE.zip"))
+
+        metadata = index.get_member_metadata(zipfile.getinfo("x.xml"))
+
+        assert metadata == {"crc32": f"{zipfile.getinfo('x.xml').CRC:08x}", "size": "5"}
+
+    def test_missing_object_is_not_unchanged(self, index):
+        metadata = {"crc32": "0000abcd", "size": "5"}
+
+        assert not index.is_member_unchanged(xml_bucket, "tnds/SE/x.xml", metadata)
+
+    def test_object_metadata_is_compared(self, index, s3):
+        metadata = {"crc32": "0000abcd", "size": "5"}
+        s3.put_object(
+            Bucket=xml_bucket, Key="tnds/SE/x.xml", Body=b"<x />", Metadata=metadata
+        )
+
+        assert index.is_member_unchanged(xml_bucket, "tnds/SE/x.xml", metadata)
+        assert not index.is_member_unchanged(
+            xml_bucket, "tnds/SE/x.xml", {**metadata, "crc32": "0000abce"}
+        )
+
+    def test_other_head_errors_are_raised(self, index, s3):
+        error = ClientError({"Error": {"Code": "403"}}, "HeadObject")
+
+        with patch.object(s3, "head_object", side_effect=error):
+            with pytest.raises(ClientError):
+                index.is_member_unchanged(xml_bucket, "tnds/SE/x.xml", {})
+
+    def test_unchanged_members_are_not_uploaded_again(self, index, s3):
+        index.skip_unchanged_members = True
+        put_archive(s3, "tnds/SE.zip", create_archive(members))
+        index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        changed_members = {**members, "member-1.xml": b"<changed />"}
+        put_archive(s3, "tnds/SE.zip", create_archive(changed_members))
+        with patch.object(
+            s3, "upload_fileobj", wraps=s3.upload_fileobj
+        ) as upload_patch:
+            index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        assert [call.args[2] for call in upload_patch.call_args_list] == [
+            "tnds/SE/member-1.xml"
+        ]
+        changed_object = s3.get_object(Bucket=xml_bucket, Key="tnds/SE/member-1.xml")
+        assert changed_object["Body"].read() == b"<changed />"
+        assert get_metric_values(index) == {
+            "TxcFilesCopied": 1,
+            "TxcFilesUnchanged": 5,
+        }
+
+    def test_members_are_uploaded_without_skipping(self, index, s3):
+        put_archive(s3, "tnds/SE.zip", create_archive(members))
+        index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        with patch.object(
+            s3, "upload_fileobj", wraps=s3.upload_fileobj
+        ) as upload_patch:
+            index.unzip_file(zipped_bucket, "tnds/SE.zip")
+
+        assert upload_patch.call_count == 6
+        assert get_metric_values(index)["TxcFilesUnchanged"] == 0
+
+    @pytest.mark.parametrize(
+        "skip_unchanged, force_refresh, expected",
+        [
+            ("true", "false", True),
+            ("true", "true", False),
+            ("false", "false", False),
+        ],
+    )
+    def test_force_refresh_overrides_skipping(
+        self, index, monkeypatch, skip_unchanged, force_refresh, expected
+    ):
+        monkeypatch.setenv("SKIP_UNCHANGED_MEMBERS", skip_unchanged)
+        monkeypatch.setenv("FORCE_REFRESH", force_refresh)
+
+        assert importlib.reload(index).skip_unchanged_members is expected
+
+
+class TestHandler:
+    def test_sqs_wrapped_s3_events_are_unzipped(self, index, s3):
+        put_archive(s3, "tnds/SE.zip", create_archive(members))
+
+        response = index.main(
+            {"Records": [sqs_record("message-1", "tnds/SE.zip")]}, None
+        )
+
+        assert response == {"batchItemFailures": []}
+        assert list_keys(s3, xml_bucket) == [f"tnds/SE/{name}" for name in members]
+
+    def test_sqs_batch_reports_failed_messages(self, index):
+        with patch.object(
+            index, "unzip_file", side_effect=[None, Exception("failed"), None]
+        ) as unzip_patch:
+            response = index.main(
+                {
+                    "Records": [
+                        sqs_record("message-1", "tnds/SE.zip"),
+                        sqs_record("message-2", "tnds/WM.zip", "tnds/EA.zip"),
+                        sqs_record("message-3", "bods/a+b.zip"),
+                    ]
+                },
+                None,
+            )
+
+        assert response == {"batchItemFailures": [{"itemIdentifier": "message-2"}]}
+        keys = [call.args[1] for call in unzip_patch.call_args_list]
+        assert keys == ["tnds/SE.zip", "tnds/WM.zip", "bods/a b.zip"]
@@ -0,0 +1,99 @@
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+
+from nested_archive import (
+    ArchiveSlice,
+    InMemoryArchive,
+    NestedArchiveBudget,
+    open_nested_archive,
+)
+from s3_seekable_file import S3SeekableFile
+from tests.helpers.archive_helpers import (
+    create_archive,
+    create_buckets,
+    random_bytes,
+    zipped_bucket,
+)
+
+inner_members = {"SE/a.xml": random_bytes(2048, 1), "SE/b.xml": b"<b />" * 100}
+
+
+def open_inner_archive(s3, compress_type: int):
+    inner_archive = create_archive(inner_members)
+    outer_archive = create_archive(
+        {"readme.txt": b"readme", "SE.zip": inner_archive}, compress_type
+    )
+    create_buckets(s3, zipped_bucket)
+    s3.put_object(Bucket=zipped_bucket, Key="tnds/outer.zip", Body=outer_archive)
+
+    source = S3SeekableFile(s3, zipped_bucket, "tnds/outer.zip", 1024)
+    zipfile = ZipFile(source)
+
+    return source, open_nested_archive(source, zipfile, zipfile.getinfo("SE.zip"))
+
+
+class TestOpenNestedArchive:
+    def test_stored_archive_is_read_in_place(self, s3):
+        source, nested = open_inner_archive(s3, ZIP_STORED)
+
+        nested_zipfile = ZipFile(nested)
+
+        assert isinstance(nested, ArchiveSlice)
+        assert nested.file is source
+        assert {
+            name: nested_zipfile.read(name) for name in nested_zipfile.namelist()
+        } == inner_members
+        assert nested.requests == source.requests
+
+    def test_compressed_archive_is_decompressed_into_memory(self, s3):
+        source, nested = open_inner_archive(s3, ZIP_DEFLATED)
+        requests = source.requests
+
+        nested_zipfile = ZipFile(nested)
+
+        assert isinstance(nested, InMemoryArchive)
+        assert {
+            name: nested_zipfile.read(name) for name in nested_zipfile.namelist()
+        } == inner_members
+        assert source.requests == requests
+
+    def test_stored_archive_is_sliced_from_the_source_not_the_copy_read(self, s3):
+        source, _ = open_inner_archive(s3, ZIP_STORED)
+        zipfile = ZipFile(source.open_copy())
+
+        nested = open_nested_archive(source, zipfile, zipfile.getinfo("SE.zip"))
+
+        assert nested.file is source
+        assert ZipFile(nested.open_copy()).read("SE/b.xml") == inner_members["SE/b.xml"]
+
+    def test_copies_of_a_decompressed_archive_share_its_buffer(self, s3):
+        _, nested = open_inner_archive(s3, ZIP_DEFLATED)
+
+        copies = [nested.open_copy() for _ in range(3)]
+        copies[0].seek(10)
+
+        assert all(copy.data is nested.data for copy in copies)
+        assert [copy.tell() for copy in copies] == [10, 0, 0]
+
+    @pytest.mark.parametrize("compress_type", [ZIP_STORED, ZIP_DEFLATED])
+    def test_copies_read_the_same_members(self, s3, compress_type):
+        source, nested = open_inner_archive(s3, compress_type)
+
+        copy = nested.open_copy()
+
+        assert copy is not nested
+        assert ZipFile(copy).read("SE/a.xml") == inner_members["SE/a.xml"]
+
+
+
+class TestNestedArchiveBudget:
+    def test_archives_past_the_depth_or_bytes_are_deferred(self):
+        budget = NestedArchiveBudget(max_depth=2, max_bytes=100)
+
+        assert budget.try_reserve(1, 60)
+        assert not budget.try_reserve(3, 10)
+        assert not budget.try_reserve(2, 50)
+        assert budget.try_reserve(2, 40)
+
+        assert (budget.expanded, budget.deferred, budget.remaining_bytes) == (2, 2, 0)
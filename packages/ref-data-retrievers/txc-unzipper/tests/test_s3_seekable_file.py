@@ -0,0 +1,110 @@
+import io
+from zipfile import ZIP_STORED, ZipFile
+
+import pytest
+from botocore.exceptions import ClientError
+
+from s3_seekable_file import S3SeekableFile
+from tests.helpers.archive_helpers import (
+    create_archive,
+    create_buckets,
+    random_bytes,
+    zipped_bucket,
+)
+
+members = {f"member-{index}.xml": random_bytes(4096, index) for index in range(3)}
+
+
+def put_object(s3, key: str, body: bytes):
+    s3.put_object(Bucket=zipped_bucket, Key=key, Body=body)
+
+
+class TestS3SeekableFile:
+    def test_central_directory_is_read_with_one_request(self, s3):
+        create_buckets(s3, zipped_bucket)
+        put_object(s3, "tnds/archive.zip", create_archive(members, ZIP_STORED))
+        archive = S3SeekableFile(s3, zipped_bucket, "tnds/archive.zip", 1024)
+
+        zipfile = ZipFile(archive)
+
+        assert zipfile.namelist() == list(members)
+        assert archive.get_stats() == {
+            "size": archive.size,
+            "requests": 1,
+            "bytes_fetched": 1024,
+        }
+
+    def test_members_are_read_from_the_archive(self, s3):
+        create_buckets(s3, zipped_bucket)
+        put_object(s3, "tnds/archive.zip", create_archive(members))
+        archive = S3SeekableFile(s3, zipped_bucket, "tnds/archive.zip", 1024)
+
+        zipfile = ZipFile(archive)
+
+        assert {name: zipfile.read(name) for name in zipfile.namelist()} == members
+        assert archive.bytes_fetched < 2 * archive.size
+
+    def test_reads_crossing_the_buffer_boundary_are_joined(self, s3):
+        body = random_bytes(10000)
+        create_buckets(s3, zipped_bucket)
+        put_object(s3, "bods/object", body)
+        file = S3SeekableFile(s3, zipped_bucket, "bods/object", 1024)
+
+        assert file.read(10) == body[:10]
+        file.seek(1000)
+        assert file.read(100) == body[1000:1100]
+        assert file.requests == 2
+
+        file.seek(500)
+        assert file.read(3000) == body[500:3500]
+        assert file.tell() == 3500
+
+        file.seek(-10, io.SEEK_END)
+        assert file.read() == body[-10:]
+        assert file.read(1) == b""
+
+    def test_readinto_fills_the_buffer_given(self, s3):
+        body = random_bytes(3000)
+        create_buckets(s3, zipped_bucket)
+        put_object(s3, "bods/object", body)
+        file = S3SeekableFile(s3, zipped_bucket, "bods/object", 1024)
+        buffer = bytearray(100)
+        file.read(10)
+
+        file.seek(1000)
+
+        # a raw read returns what is left in the buffer rather than fetching again
+        assert file.readinto(buffer) == 24
+        assert file.requests == 1
+        assert bytes(buffer[:24]) == body[1000:1024]
+
+    def test_reads_fail_when_the_archive_is_replaced(self, s3):
+        create_buckets(s3, zipped_bucket)
+        put_object(s3, "tnds/archive.zip", create_archive(members))
+        archive = S3SeekableFile(s3, zipped_bucket, "tnds/archive.zip", 1024)
+        zipfile = ZipFile(archive)
+
+        put_object(s3, "tnds/archive.zip", create_archive({"other.xml": b"<other />"}))
+
+        with pytest.raises(ClientError) as error:
+            zipfile.read("member-0.xml")
+
+        assert error.value.response["Error"]["Code"] == "PreconditionFailed"
+
+    def test_copies_read_the_same_version_from_their_own_position(self, s3):
+        body = random_bytes(3000)
+        create_buckets(s3, zipped_bucket)
+        put_object(s3, "bods/object", body)
+        file = S3SeekableFile(s3, zipped_bucket, "bods/object", 1024)
+        file.seek(2000)
+
+        copy = file.open_copy()
+
+        assert copy.tell() == 0
+        assert copy.read(10) == body[:10]
+        assert file.read(10) == body[2000:2010]
+
+        put_object(s3, "bods/object", random_bytes(3000, 1))
+        with pytest.raises(ClientError):
+            copy.seek(2500)
+            copy.read(10)
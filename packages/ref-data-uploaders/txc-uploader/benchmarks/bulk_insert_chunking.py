@@ -0,0 +1,180 @@
+"""
+Compares rows per second for bulk inserts of tracks, vehicle journeys and journey
+pattern links at different chunk sizes, measured against SQLite and predicted for the
+Data API with the fake connection's latency model. Chunk size 1 is the same number of
+statements as one INSERT per row, and executemany is included as the baseline.
+
+Run from the txc-uploader directory:
+    python3 -m benchmarks.bulk_insert_chunking [--output results.json] [--rows 20000]
+        [--chunk-size 1 --chunk-size 100 ...] [--call-latency 0.025]
+"""
+
+import argparse
+import json
+import platform
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fakes import (
+    DEFAULT_CALL_LATENCY_SECONDS,
+    DEFAULT_SECONDS_PER_KILOBYTE,
+    FakeDataApiConnection,
+    LatencyModel,
+)
+from benchmarks.ingest_phases import get_git_commit
+from txc_bulk_insert import DEFAULT_BULK_INSERT_MAX_BYTES, BulkInsertLimits, bulk_insert
+from txc_connections import SqliteConnection
+
+DEFAULT_ROWS = 20000
+DEFAULT_CHUNK_SIZES = [1, 10, 100, 500, 1000, 2000]
+EXECUTEMANY = "executemany"
+
+TABLE_QUERIES = {
+    "tracks_new": (
+        """INSERT INTO tracks_new (operatorServiceId, longitude, latitude) VALUES (:operator_service_id, :longitude, :latitude)""",
+        lambda i: {
+            "operator_service_id": 1,
+            "longitude": f"-1.{i:06d}",
+            "latitude": f"52.{i:06d}",
+        },
+    ),
+    "vehicle_journeys_new": (
+        "INSERT INTO vehicle_journeys_new (vehicleJourneyCode, serviceRef, lineRef, journeyPatternRef, departureTime, journeyCode, operatorServiceId) VALUES (:vehicle_journey_code, :service_ref, :line_ref, :journey_pattern_ref, :departure_time, :journey_code, :operator_service_id)",
+        lambda i: {
+            "vehicle_journey_code": f"VJ{i}",
+            "service_ref": "PB0000001:1",
+            "line_ref": "SL1",
+            "journey_pattern_ref": f"JP{i % 50}",
+            "departure_time": f"{i // 60 % 24:02d}:{i % 60:02d}:00",
+            "journey_code": str(i),
+            "operator_service_id": 1,
+        },
+    ),
+    "service_journey_pattern_links_new": (
+        """INSERT INTO service_journey_pattern_links_new (journeyPatternId, fromAtcoCode, fromTimingStatus, fromSequenceNumber,
+        toAtcoCode, toTimingStatus, toSequenceNumber, runtime, orderInSequence) VALUES (:journey_pattern_id, :from_atco_code, :from_timing_status, :from_sequence_number, :to_atco_code, :to_timing_status, :to_sequence_number, :run_time, :order)""",
+        lambda i: {
+            "journey_pattern_id": i // 40 + 1,
+            "from_atco_code": f"0100BRP{i:05d}",
+            "from_timing_status": "PTP",
+            "from_sequence_number": str(i % 40),
+            "to_atco_code": f"0100BRP{i + 1:05d}",
+            "to_timing_status": "OTH",
+            "to_sequence_number": str(i % 40 + 1),
+            "run_time": "PT2M",
+            "order": i % 40,
+        },
+    ),
+}
+
+
+def insert_rows(cursor, query: str, values: list, chunk_size):
+    if chunk_size == EXECUTEMANY:
+        cursor.executemany(query, values)
+        return
+
+    limits = BulkInsertLimits(chunk_size, DEFAULT_BULK_INSERT_MAX_BYTES)
+    bulk_insert(cursor, query, values, {table: limits for table in TABLE_QUERIES})
+
+
+def benchmark_sqlite(query: str, values: list, chunk_size) -> float:
+    connection = SqliteConnection()
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        insert_rows(cursor, query, values, chunk_size)
+    connection.commit()
+
+    return time.perf_counter() - start
+
+
+def benchmark_data_api(
+    query: str, values: list, chunk_size, latency_model: LatencyModel
+) -> dict:
+    connection = FakeDataApiConnection(latency_model)
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        insert_rows(cursor, query, values, chunk_size)
+    connection.commit()
+    wall_time = time.perf_counter() - start
+
+    data_api_stats = connection.get_stats()
+    data_api_stats["predicted_seconds"] = (
+        wall_time + data_api_stats["simulated_latency_seconds"]
+    )
+
+    return data_api_stats
+
+
+def benchmark_table(table: str, rows: int, chunk_sizes: list, latency_model) -> list:
+    query, build_values = TABLE_QUERIES[table]
+    values = [build_values(i) for i in range(rows)]
+    results = []
+
+    for chunk_size in [EXECUTEMANY, *chunk_sizes]:
+        sqlite_seconds = benchmark_sqlite(query, values, chunk_size)
+        data_api = benchmark_data_api(query, values, chunk_size, latency_model)
+        results.append(
+            {
+                "table": table,
+                "rows": rows,
+                "chunk_size": chunk_size,
+                "sqlite_seconds": sqlite_seconds,
+                "sqlite_rows_per_second": rows / sqlite_seconds,
+                "data_api_rows_per_second": rows / data_api["predicted_seconds"],
+                "data_api": data_api,
+            }
+        )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="benchmark-bulk-insert-results.json")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--chunk-size", type=int, action="append")
+    parser.add_argument("--table", choices=TABLE_QUERIES, action="append")
+    parser.add_argument(
+        "--call-latency", type=float, default=DEFAULT_CALL_LATENCY_SECONDS
+    )
+    parser.add_argument(
+        "--seconds-per-kilobyte", type=float, default=DEFAULT_SECONDS_PER_KILOBYTE
+    )
+    args = parser.parse_args()
+
+    latency_model = LatencyModel(args.call_latency, args.seconds_per_kilobyte)
+    results = [
+        result
+        for table in args.table or TABLE_QUERIES
+        for result in benchmark_table(
+            table, args.rows, args.chunk_size or DEFAULT_CHUNK_SIZES, latency_model
+        )
+    ]
+
+    with open(args.output, "w") as output_file:
+        json.dump(
+            {
+                "benchmark": "bulk_insert_chunking",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "git_commit": get_git_commit(),
+                "python_version": platform.python_version(),
+                "latency_model": vars(latency_model),
+                "results": results,
+            },
+            output_file,
+            indent=2,
+        )
+
+    print(
+        f"{'table':<34} {'chunk':>11} {'requests':>9} {'max kB':>7} {'sqlite rows/s':>14} {'data api rows/s':>16}"
+    )
+    for result in results:
+        data_api = result["data_api"]
+        print(
+            f"{result['table']:<34} {result['chunk_size']:>11} {data_api['requests']:>9} {data_api['max_payload_bytes'] / 1024:>7.0f} {result['sqlite_rows_per_second']:>14.0f} {result['data_api_rows_per_second']:>16.0f}"
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
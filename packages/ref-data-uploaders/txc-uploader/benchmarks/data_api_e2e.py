@@ -0,0 +1,163 @@
+"""
+Runs download_from_s3_and_write_to_db end to end against moto S3 and CloudWatch and a
+fake Data API connection that charges every request a modelled latency, predicting
+how long each file would take against Aurora. The predicted time is the measured
+wall time plus the simulated request latency, unless --sleep is given in which case
+the latency is slept for and already part of the wall time.
+
+Run from the txc-uploader directory:
+    python3 -m benchmarks.data_api_e2e [--output results.json] [--call-latency 0.025]
+        [--seconds-per-kilobyte 0.0002] [--sleep] [--profile medium] [extra.xml ...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import boto3
+from moto import mock_cloudwatch, mock_s3
+
+from benchmarks.fakes import (
+    DEFAULT_CALL_LATENCY_SECONDS,
+    DEFAULT_SECONDS_PER_KILOBYTE,
+    FakeDataApiConnection,
+    LatencyModel,
+)
+from benchmarks.ingest_phases import (
+    DEFAULT_PROFILES,
+    FIXTURE_FILES,
+    get_data_source,
+    get_git_commit,
+)
+from benchmarks.txc_generator import PROFILES, get_sizes, write_txc_file
+from txc_cache import StopCache
+from txc_processor import download_from_s3_and_write_to_db
+
+BUCKET_NAME = "benchmark-txc-bucket"
+REGION_NAME = "eu-west-2"
+
+logger = logging.getLogger("benchmarks.data_api_e2e")
+logger.setLevel(logging.WARNING)
+
+
+def get_object_key(file_path: str) -> str:
+    file_name = os.path.basename(file_path)
+    if get_data_source(file_path) == "tnds":
+        return f"tnds/SE/{file_name}"
+
+    return f"bods/{file_name}"
+
+
+def benchmark_file(
+    s3, cloudwatch, file_path: str, latency_model: LatencyModel, download_dir: str
+) -> dict:
+    key = get_object_key(file_path)
+    s3.upload_file(file_path, BUCKET_NAME, key)
+
+    db_connection = FakeDataApiConnection(latency_model)
+    download_path = f"{download_dir}/{os.path.basename(key)}"
+
+    start = time.perf_counter()
+    download_from_s3_and_write_to_db(
+        s3,
+        cloudwatch,
+        BUCKET_NAME,
+        key,
+        download_path,
+        db_connection,
+        logger,
+        stop_cache=StopCache(),
+    )
+    wall_time = time.perf_counter() - start
+    os.remove(download_path)
+
+    data_api_stats = db_connection.get_stats()
+    simulated_latency = data_api_stats["simulated_latency_seconds"]
+
+    return {
+        "key": key,
+        "size_bytes": os.path.getsize(file_path),
+        "wall_time_seconds": wall_time,
+        "predicted_seconds": wall_time
+        if latency_model.sleep
+        else wall_time + simulated_latency,
+        "data_api": data_api_stats,
+        "cursor": db_connection.counting_cursor.get_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="*", help="extra TXC files to benchmark")
+    parser.add_argument("--output", default="benchmark-data-api-results.json")
+    parser.add_argument(
+        "--call-latency", type=float, default=DEFAULT_CALL_LATENCY_SECONDS
+    )
+    parser.add_argument(
+        "--seconds-per-kilobyte", type=float, default=DEFAULT_SECONDS_PER_KILOBYTE
+    )
+    parser.add_argument("--sleep", action="store_true")
+    parser.add_argument("--profile", choices=PROFILES, action="append")
+    args = parser.parse_args()
+
+    latency_model = LatencyModel(
+        args.call_latency, args.seconds_per_kilobyte, args.sleep
+    )
+
+    for credential_name in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
+        os.environ.setdefault(credential_name, "testing")
+
+    with tempfile.TemporaryDirectory() as work_dir, mock_s3(), mock_cloudwatch():
+        s3 = boto3.client("s3", region_name=REGION_NAME)
+        cloudwatch = boto3.client("cloudwatch", region_name=REGION_NAME)
+        s3.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": REGION_NAME},
+        )
+
+        file_paths = list(FIXTURE_FILES)
+        for profile in args.profile or DEFAULT_PROFILES:
+            file_paths.append(
+                write_txc_file(f"{work_dir}/{profile}.xml", get_sizes(profile))
+            )
+        file_paths.extend(os.path.realpath(file_path) for file_path in args.files)
+
+        download_dir = f"{work_dir}/downloads"
+        os.makedirs(download_dir)
+        results = [
+            benchmark_file(s3, cloudwatch, file_path, latency_model, download_dir)
+            for file_path in file_paths
+        ]
+
+    with open(args.output, "w") as output_file:
+        json.dump(
+            {
+                "benchmark": "data_api_e2e",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "git_commit": get_git_commit(),
+                "python_version": platform.python_version(),
+                "latency_model": vars(latency_model),
+                "results": results,
+            },
+            output_file,
+            indent=2,
+        )
+
+    print(
+        f"{'key':<28} {'size kB':>9} {'requests':>9} {'payload kB':>11} {'wall s':>8} {'latency s':>10} {'predicted s':>12}"
+    )
+    for result in results:
+        data_api = result["data_api"]
+        print(
+            f"{result['key']:<28} {result['size_bytes'] / 1024:>9.0f} {data_api['requests']:>9} {data_api['payload_bytes'] / 1024:>11.0f} {result['wall_time_seconds']:>8.2f} {data_api['simulated_latency_seconds']:>10.2f} {result['predicted_seconds']:>12.2f}"
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Stand-ins for the Data API connection and CloudWatch client used when benchmarking
+write_to_database without AWS.
+"""
+
+import json
+import re
+import time
+from collections import Counter
+
+from aurora_data_api import AuroraDataAPICursor
+
+from txc_bulk_insert import DATA_API_MAX_SQL_LENGTH
+
+table_name_pattern = re.compile(
+    r"(?:INSERT\s+(?:IGNORE\s+)?INTO|FROM|UPDATE)\s+(\w+)", re.IGNORECASE
+)
+
+
+class CountingCursor:
+    """
+    Behaves like an AuroraDataAPICursor against empty tables, so every service,
+    journey pattern and stop lookup takes the insert path. Counts every call by
+    method and by table, and the number of parameter sets sent.
+    """
+
+    def __init__(self):
+        self.lastrowid = None
+        self.next_id = 1
+        self.calls = Counter()
+        self.calls_by_table = Counter()
+        self.parameter_sets = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def record_call(self, method, query, parameter_sets):
+        self.calls[method] += 1
+        self.parameter_sets += parameter_sets
+
+        match = table_name_pattern.search(query)
+        if match:
+            self.calls_by_table[f"{method} {match.group(1)}"] += 1
+
+    def execute(self, query, params=None):
+        self.record_call("execute", query, 1 if params else 0)
+        if query.lstrip().upper().startswith("INSERT"):
+            self.lastrowid = self.next_id
+            self.next_id += 1
+
+    def executemany(self, query, params_list):
+        self.record_call("executemany", query, len(params_list))
+
+    def fetchone(self):
+        self.calls["fetchone"] += 1
+        return None
+
+    def fetchall(self):
+        self.calls["fetchall"] += 1
+        return []
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "round_trips": self.calls["execute"] + self.calls["executemany"],
+            "parameter_sets": self.parameter_sets,
+            "calls_by_table": dict(sorted(self.calls_by_table.items())),
+        }
+
+
+class CountingConnection:
+    def __init__(self):
+        self.counting_cursor = CountingCursor()
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self.counting_cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class NullCloudWatch:
+    def __init__(self):
+        self.metrics = Counter()
+
+    def put_metric_data(self, MetricData, Namespace):
+        for metric in MetricData:
+            self.metrics[metric["MetricName"]] += metric.get("Value", 1)
+
+
+DEFAULT_CALL_LATENCY_SECONDS = 0.025
+DEFAULT_SECONDS_PER_KILOBYTE = 0.0002
+DATA_API_BATCH_PAGE_SIZE = 1000
+
+# only used for its parameter formatting, which needs no client
+data_api_formatter = AuroraDataAPICursor.__new__(AuroraDataAPICursor)
+
+
+def get_data_api_payload_bytes(sql: str, parameter_sets: list) -> int:
+    return len(
+        json.dumps(
+            {
+                "sql": sql,
+                "parameterSets": [
+                    [
+                        data_api_formatter.prepare_param(name, value)
+                        for name, value in (parameters or {}).items()
+                    ]
+                    for parameters in parameter_sets
+                ],
+            },
+            default=str,
+        )
+    )
+
+
+class LatencyModel:
+    """
+    The cost of a Data API request, a fixed round trip latency plus a cost for each
+    kilobyte of request payload. With sleep set the cost is slept for, otherwise it
+    is only added up.
+    """
+
+    def __init__(
+        self,
+        call_latency_seconds: float = DEFAULT_CALL_LATENCY_SECONDS,
+        seconds_per_kilobyte: float = DEFAULT_SECONDS_PER_KILOBYTE,
+        sleep: bool = False,
+    ):
+        self.call_latency_seconds = call_latency_seconds
+        self.seconds_per_kilobyte = seconds_per_kilobyte
+        self.sleep = sleep
+
+    def get_cost(self, payload_bytes: int) -> float:
+        return (
+            self.call_latency_seconds + payload_bytes / 1024 * self.seconds_per_kilobyte
+        )
+
+
+class FakeDataApiCursor(CountingCursor):
+    """
+    A CountingCursor that also records every request aurora_data_api would send,
+    executemany being paged into BatchExecuteStatement requests of 1000 parameter
+    sets as it is there, and charges each one to the connection's LatencyModel.
+    """
+
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        super().execute(query, params)
+        self.connection.send_request(
+            "ExecuteStatement", query, [params] if params else []
+        )
+
+    def executemany(self, query, params_list):
+        super().executemany(query, params_list)
+        params_list = list(params_list)
+        for page_start in range(0, len(params_list), DATA_API_BATCH_PAGE_SIZE):
+            self.connection.send_request(
+                "BatchExecuteStatement",
+                query,
+                params_list[page_start : page_start + DATA_API_BATCH_PAGE_SIZE],
+            )
+
+
+class FakeDataApiConnection(CountingConnection):
+    """
+    Stands in for an aurora_data_api connection, which begins a transaction the first
+    time a cursor is opened and commits or rolls it back with a request of its own.
+    """
+
+    def __init__(self, latency_model: LatencyModel = None):
+        super().__init__()
+        self.latency_model = latency_model or LatencyModel()
+        self.counting_cursor = FakeDataApiCursor(self)
+        self.in_transaction = False
+        self.requests = []
+        self.simulated_seconds = 0.0
+
+    def send_request(self, operation: str, sql: str = "", parameter_sets=()):
+        if len(sql) > DATA_API_MAX_SQL_LENGTH:
+            # the Data API rejects the request, so a benchmark must not count it as sent
+            raise ValueError(
+                f"{operation} sql is {len(sql)} characters, the Data API allows {DATA_API_MAX_SQL_LENGTH}"
+            )
+
+        payload_bytes = get_data_api_payload_bytes(sql, list(parameter_sets))
+        cost = self.latency_model.get_cost(payload_bytes)
+
+        self.requests.append(
+            {
+                "operation": operation,
+                "parameter_sets": len(parameter_sets),
+                "payload_bytes": payload_bytes,
+                "seconds": cost,
+            }
+        )
+        self.simulated_seconds += cost
+        if self.latency_model.sleep:
+            time.sleep(cost)
+
+    def cursor(self):
+        if not self.in_transaction:
+            self.send_request("BeginTransaction")
+            self.in_transaction = True
+
+        return self.counting_cursor
+
+    def commit(self):
+        super().commit()
+        if self.in_transaction:
+            self.send_request("CommitTransaction")
+            self.in_transaction = False
+
+    def rollback(self):
+        super().rollback()
+        if self.in_transaction:
+            self.send_request("RollbackTransaction")
+            self.in_transaction = False
+
+    def get_stats(self) -> dict:
+        requests_by_operation = Counter(
+            request["operation"] for request in self.requests
+        )
+
+        return {
+            "requests": len(self.requests),
+            "requests_by_operation": dict(requests_by_operation),
+            "payload_bytes": sum(request["payload_bytes"] for request in self.requests),
+            "max_payload_bytes": max(
+                (request["payload_bytes"] for request in self.requests), default=0
+            ),
+            "simulated_latency_seconds": self.simulated_seconds,
+        }
@@ -0,0 +1,399 @@
+"""
+Times each phase of ingesting a TXC file, parsing, building the TxcDocument,
+collect_journey_patterns, format_vehicle_journeys, collect_track_data and the whole
+write_to_database against a counting cursor, without AWS. Every phase reports its
+best wall time over the repeats, its peak traced memory and, for write_to_database,
+the cursor calls made. Results are written as JSON so runs can be compared between
+commits.
+
+Run from the txc-uploader directory:
+    python3 -m benchmarks.ingest_phases [--output results.json] [--repeat 3]
+        [--scale 10 --scale 50] [--profile medium]
+        [--engine counting --engine sqlite] [extra.xml ...]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import xmltodict
+
+from benchmarks.fakes import CountingConnection, NullCloudWatch
+from benchmarks.txc_generator import PROFILES, get_sizes, write_txc_file
+from txc_cache import StopCache
+from txc_connections import SqliteConnection
+from txc_document import TxcDocument
+from txc_parser import TXC_NAMESPACE, make_list, parse_txc_file
+from txc_processor import (
+    collect_journey_patterns,
+    collect_track_data,
+    format_vehicle_journeys,
+    get_lines_for_service,
+    get_operators,
+    write_to_database,
+)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+repo_test_data_path = os.path.realpath(f"{dir_path}/../../../../test-data")
+
+FIXTURE_FILES = [
+    f"{repo_test_data_path}/bods/test.xml",
+    f"{repo_test_data_path}/tnds/test.xml",
+]
+DEFAULT_SCALE_FACTORS = [10, 50]
+DEFAULT_PROFILES = ["medium"]
+
+ENGINE_COUNTING = "counting"
+ENGINE_SQLITE = "sqlite"
+ENGINES = [ENGINE_COUNTING, ENGINE_SQLITE]
+
+WRITTEN_TABLES = [
+    "services_new",
+    "service_journey_patterns_new",
+    "service_journey_pattern_links_new",
+    "vehicle_journeys_new",
+    "tracks_new",
+    "service_admin_area_codes_new",
+]
+DEFAULT_REPEAT = 3
+
+logger = logging.getLogger("benchmarks.ingest_phases")
+logger.setLevel(logging.WARNING)
+
+
+def write_scaled_file(source_path: str, factor: int, output_dir: str) -> str:
+    """
+    Writes a copy of source_path with every VehicleJourney repeated factor times,
+    each copy with its own VehicleJourneyCode.
+    """
+    data = parse_txc_file(source_path)
+    transxchange = data["TransXChange"]
+    vehicle_journeys = make_list(
+        (transxchange.get("VehicleJourneys") or {}).get("VehicleJourney", [])
+    )
+
+    scaled_vehicle_journeys = []
+    for copy_number in range(factor):
+        for vehicle_journey in vehicle_journeys:
+            scaled_vehicle_journey = copy.deepcopy(vehicle_journey)
+            if "VehicleJourneyCode" in scaled_vehicle_journey:
+                scaled_vehicle_journey[
+                    "VehicleJourneyCode"
+                ] = f"{vehicle_journey['VehicleJourneyCode']}-{copy_number}"
+            scaled_vehicle_journeys.append(scaled_vehicle_journey)
+
+    if scaled_vehicle_journeys:
+        transxchange["VehicleJourneys"] = {"VehicleJourney": scaled_vehicle_journeys}
+    for attr_name in [name for name in transxchange if "://" in name]:
+        # namespaced attributes such as xsi:schemaLocation cannot be written back
+        del transxchange[attr_name]
+    transxchange["@xmlns"] = TXC_NAMESPACE
+
+    source_name = os.path.basename(os.path.dirname(source_path))
+    output_path = f"{output_dir}/{source_name}-x{factor}.xml"
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        xmltodict.unparse(data, output=output_file, pretty=True)
+
+    return output_path
+
+
+def get_services(document: TxcDocument, operators: list) -> list:
+    services = []
+    for operator in operators:
+        services.extend(document.get_services_for_operator(operator))
+
+    return services
+
+
+def run_collect_journey_patterns(document: TxcDocument, services: list):
+    return [collect_journey_patterns(document, service) for service in services]
+
+
+def run_format_vehicle_journeys(document: TxcDocument, services: list):
+    return [
+        format_vehicle_journeys(document, line["@id"])
+        for service in services
+        for line in get_lines_for_service(service)
+    ]
+
+
+def run_collect_track_data(document: TxcDocument, journey_patterns_by_service: list):
+    tracks = []
+    for journey_patterns in journey_patterns_by_service:
+        for journey_pattern in journey_patterns:
+            route = document.get_route(
+                journey_pattern["journey_pattern_info"]["route_ref"]
+            )
+            if route is None or route.get("RouteSectionRef") is None:
+                continue
+
+            link_refs = [
+                link.get("route_link_ref")
+                for section in journey_pattern["journey_pattern_sections"]
+                for link in section
+            ]
+            tracks.append(
+                collect_track_data(
+                    document, make_list(route["RouteSectionRef"]), link_refs
+                )
+            )
+
+    return tracks
+
+
+def get_data_source(file_path: str) -> str:
+    return "tnds" if "tnds" in os.path.relpath(file_path, repo_test_data_path) else "bods"
+
+
+def get_stop_codes(data: dict) -> set:
+    stop_points = data["TransXChange"].get("StopPoints") or {}
+    return {
+        stop_point["StopPointRef"]
+        for stop_point in make_list(stop_points.get("AnnotatedStopPointRef", []))
+        if stop_point and "StopPointRef" in stop_point
+    } | {
+        stop_point["AtcoCode"]
+        for stop_point in make_list(stop_points.get("StopPoint", []))
+        if stop_point and "AtcoCode" in stop_point
+    }
+
+
+def create_sqlite_connection(data: dict) -> SqliteConnection:
+    """
+    An SQLite stand-in holding every stop the file references, all in one locality,
+    so stop lookups find rows as they would against Aurora.
+    """
+    db_connection = SqliteConnection()
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO localities_new (nptgLocalityCode, administrativeAreaCode) VALUES ('E0000001', '099')"
+        )
+        cursor.executemany(
+            "INSERT INTO stops_new (atcoCode, nptgLocalityCode, longitude, latitude) VALUES (:atco_code, 'E0000001', '-1.5', '53.5')",
+            [{"atco_code": stop_code} for stop_code in get_stop_codes(data)],
+        )
+    db_connection.commit()
+
+    return db_connection
+
+
+def count_written_rows(db_connection: SqliteConnection) -> dict:
+    rows = {}
+    with db_connection.cursor() as cursor:
+        for table in WRITTEN_TABLES:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            rows[table] = cursor.fetchone()[0]
+
+    return rows
+
+
+def run_write_to_database(file_path: str, data: dict, db_connection):
+    cloudwatch = NullCloudWatch()
+    stop_cache = StopCache()
+
+    write_to_database(
+        data,
+        None,
+        get_data_source(file_path),
+        file_path,
+        db_connection,
+        logger,
+        cloudwatch,
+        stop_cache=stop_cache,
+    )
+
+    if isinstance(db_connection, SqliteConnection):
+        return {
+            "rows": count_written_rows(db_connection),
+            "stop_cache": stop_cache.get_stats(),
+        }
+
+    return {
+        **db_connection.counting_cursor.get_stats(),
+        "commits": db_connection.commits,
+        "rollbacks": db_connection.rollbacks,
+        "stop_cache": stop_cache.get_stats(),
+    }
+
+
+def measure(phase, repeat: int, setup=lambda: ()) -> tuple:
+    """
+    Runs phase(*setup()) repeat times, only the phase is timed. Memory is traced in
+    a separate run so the tracing overhead is not timed either.
+    """
+    wall_times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        result = phase(*args)
+        wall_times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    phase(*args)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "wall_time_seconds": min(wall_times),
+        "mean_wall_time_seconds": sum(wall_times) / len(wall_times),
+        "peak_memory_bytes": peak_memory,
+    }, result
+
+
+def benchmark_file(file_path: str, repeat: int, engines: list) -> dict:
+    phases = {}
+
+    phases["parse"], data = measure(lambda: parse_txc_file(file_path), repeat)
+    phases["build_document"], document = measure(lambda: TxcDocument(data), repeat)
+
+    services = get_services(document, get_operators(data, None, None))
+
+    phases["collect_journey_patterns"], journey_patterns_by_service = measure(
+        lambda: run_collect_journey_patterns(document, services), repeat
+    )
+    phases["format_vehicle_journeys"], _ = measure(
+        lambda: run_format_vehicle_journeys(document, services), repeat
+    )
+    phases["collect_track_data"], _ = measure(
+        lambda: run_collect_track_data(document, journey_patterns_by_service), repeat
+    )
+    # write_to_database is given a fresh parse and connection each time as it caches
+    # on the document
+    write_stats = {}
+    for engine in engines:
+        phase_name = (
+            "write_to_database"
+            if engine == ENGINE_COUNTING
+            else f"write_to_database_{engine}"
+        )
+        phases[phase_name], write_stats[engine] = measure(
+            lambda data, db_connection: run_write_to_database(
+                file_path, data, db_connection
+            ),
+            repeat,
+            setup=lambda: (
+                parse_txc_file(file_path),
+                CountingConnection()
+                if engine == ENGINE_COUNTING
+                else create_sqlite_connection(data),
+            ),
+        )
+        if "rows" in write_stats[engine]:
+            phases[phase_name]["rows_per_second"] = sum(
+                write_stats[engine]["rows"].values()
+            ) / max(phases[phase_name]["wall_time_seconds"], 1e-9)
+
+    return {
+        "file": os.path.relpath(file_path, repo_test_data_path)
+        if file_path.startswith(repo_test_data_path)
+        else os.path.basename(file_path),
+        "size_bytes": os.path.getsize(file_path),
+        "services": len(services),
+        "vehicle_journeys": len(document.vehicle_journeys),
+        "phases": phases,
+        "cursor": write_stats.get(ENGINE_COUNTING),
+        "engines": write_stats,
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=dir_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(results: list):
+    print(
+        f"{'file':<24} {'size kB':>9} {'phase':<26} {'best ms':>10} {'peak MB':>9} {'round trips':>12}"
+    )
+    for result in results:
+        for phase_name, phase in result["phases"].items():
+            round_trips = (
+                result["cursor"]["round_trips"]
+                if phase_name == "write_to_database"
+                else ""
+            )
+            print(
+                f"{result['file']:<24} {result['size_bytes'] / 1024:>9.0f} {phase_name:<26} {phase['wall_time_seconds'] * 1000:>10.2f} {phase['peak_memory_bytes'] / 1024 / 1024:>9.2f} {round_trips:>12}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="*", help="extra TXC files to benchmark")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        "--scale",
+        type=int,
+        action="append",
+        help="vehicle journey multipliers for the generated files",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILES,
+        action="append",
+        help="synthetic files to generate with benchmarks.txc_generator",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        action="append",
+        help="connections to run write_to_database against, counting by default",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as generated_dir:
+        file_paths = list(FIXTURE_FILES)
+        for factor in args.scale or DEFAULT_SCALE_FACTORS:
+            file_paths.extend(
+                write_scaled_file(fixture_file, factor, generated_dir)
+                for fixture_file in FIXTURE_FILES
+            )
+        for profile in args.profile or DEFAULT_PROFILES:
+            file_paths.append(
+                write_txc_file(f"{generated_dir}/{profile}.xml", get_sizes(profile))
+            )
+        file_paths.extend(os.path.realpath(file_path) for file_path in args.files)
+
+        results = [
+            benchmark_file(file_path, args.repeat, args.engine or [ENGINE_COUNTING])
+            for file_path in file_paths
+        ]
+
+    with open(args.output, "w") as output_file:
+        json.dump(
+            {
+                "benchmark": "ingest_phases",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "git_commit": get_git_commit(),
+                "python_version": platform.python_version(),
+                "repeat": args.repeat,
+                "results": results,
+            },
+            output_file,
+            indent=2,
+        )
+
+    print_summary(results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
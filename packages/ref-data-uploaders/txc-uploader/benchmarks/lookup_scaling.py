@@ -0,0 +1,79 @@
+"""
+Compares resolving JourneyPatternSection and RouteLink references with the linear
+scans TxcDocument replaced against its indexed lookups, as the section count grows.
+
+Run from the txc-uploader directory: python3 -m benchmarks.lookup_scaling
+"""
+
+import time
+
+from txc_document import TxcDocument
+
+SECTION_COUNTS = [100, 500, 1000, 5000]
+
+
+def build_data(section_count: int) -> dict:
+    return {
+        "TransXChange": {
+            "JourneyPatternSections": {
+                "JourneyPatternSection": [
+                    {"@id": f"JPS{i}", "JourneyPatternTimingLink": {"@id": f"JPTL{i}"}}
+                    for i in range(section_count)
+                ]
+            },
+            "RouteSections": {
+                "RouteSection": {
+                    "@id": "RS1",
+                    "RouteLink": [{"@id": f"RL{i}"} for i in range(section_count)],
+                }
+            },
+        }
+    }
+
+
+def linear_lookup(items: list, ref: str):
+    return next((item for item in items if item["@id"] == ref), None)
+
+
+def time_lookups(lookup, refs: list) -> float:
+    start = time.perf_counter()
+    for ref in refs:
+        lookup(ref)
+
+    return time.perf_counter() - start
+
+
+def main():
+    print(
+        f"{'sections':>8} {'build ms':>10} {'section scan us':>16} {'section index us':>17} {'link scan us':>13} {'link index us':>14}"
+    )
+
+    for section_count in SECTION_COUNTS:
+        data = build_data(section_count)
+        transxchange = data["TransXChange"]
+        sections = transxchange["JourneyPatternSections"]["JourneyPatternSection"]
+        route_links = transxchange["RouteSections"]["RouteSection"]["RouteLink"]
+
+        build_start = time.perf_counter()
+        document = TxcDocument(data)
+        build_time = time.perf_counter() - build_start
+
+        section_refs = [section["@id"] for section in sections]
+        link_refs = [route_link["@id"] for route_link in route_links]
+
+        section_scan = time_lookups(
+            lambda ref: linear_lookup(sections, ref), section_refs
+        )
+        section_index = time_lookups(document.get_journey_pattern_section, section_refs)
+        link_scan = time_lookups(lambda ref: linear_lookup(route_links, ref), link_refs)
+        link_index = time_lookups(
+            lambda ref: document.get_route_link("RS1", ref), link_refs
+        )
+
+        print(
+            f"{section_count:>8} {build_time * 1000:>10.2f} {section_scan * 1e6 / section_count:>16.3f} {section_index * 1e6 / section_count:>17.3f} {link_scan * 1e6 / section_count:>13.3f} {link_index * 1e6 / section_count:>14.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
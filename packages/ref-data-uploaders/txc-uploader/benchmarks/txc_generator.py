@@ -0,0 +1,470 @@
+"""
+Writes synthetic TXC files for scale testing the uploader, with configurable counts of
+operators, services, lines, journey patterns, sections per pattern, timing links,
+vehicle journeys, VehicleJourneyRef only journeys, route sections and track points.
+Files are written element by element so national coach sized files do not have to
+fit in memory, and can be zipped the way the BODS and TNDS archives are.
+
+Run from the txc-uploader directory:
+    python3 -m benchmarks.txc_generator OUTPUT_DIR [--profile national-coach]
+        [--files 1] [--services-per-operator 20 ...] [--zip bods|tnds --region SE]
+"""
+
+import argparse
+import os
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from txc_parser import TXC_NAMESPACE
+
+DEFAULT_SIZES = {
+    "operators": 1,
+    "services_per_operator": 2,
+    "lines_per_service": 2,
+    "journey_patterns_per_service": 4,
+    "sections_per_journey_pattern": 2,
+    "timing_links_per_section": 5,
+    "vehicle_journeys_per_line": 20,
+    "vehicle_journey_refs_per_line": 2,
+    "route_sections_per_route": 2,
+    "track_points_per_route_link": 5,
+}
+
+# sizes for each profile override DEFAULT_SIZES
+PROFILES = {
+    "small": {},
+    "medium": {
+        "services_per_operator": 10,
+        "journey_patterns_per_service": 10,
+        "vehicle_journeys_per_line": 100,
+    },
+    "national-coach": {
+        "services_per_operator": 150,
+        "lines_per_service": 1,
+        "journey_patterns_per_service": 20,
+        "sections_per_journey_pattern": 4,
+        "timing_links_per_section": 8,
+        "vehicle_journeys_per_line": 300,
+        "vehicle_journey_refs_per_line": 50,
+        "track_points_per_route_link": 5,
+    },
+}
+
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+
+
+def format_attributes(attrs: dict = None) -> str:
+    return "".join(
+        f" {attr_name}={quoteattr(str(attr_value))}"
+        for attr_name, attr_value in (attrs or {}).items()
+    )
+
+
+class XmlWriter:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.open_elements = []
+
+    def start(self, name: str, attrs: dict = None):
+        self.output_file.write(
+            f"{'  ' * len(self.open_elements)}<{name}{format_attributes(attrs)}>\n"
+        )
+        self.open_elements.append(name)
+
+    def end(self):
+        name = self.open_elements.pop()
+        self.output_file.write(f"{'  ' * len(self.open_elements)}</{name}>\n")
+
+    def element(self, name: str, text=None, attrs: dict = None):
+        attributes = format_attributes(attrs)
+        indent = "  " * len(self.open_elements)
+        if text is None:
+            self.output_file.write(f"{indent}<{name}{attributes} />\n")
+        else:
+            self.output_file.write(
+                f"{indent}<{name}{attributes}>{escape(str(text))}</{name}>\n"
+            )
+
+
+def get_sizes(profile: str = "small", **overrides) -> dict:
+    return {**DEFAULT_SIZES, **PROFILES[profile], **overrides}
+
+
+class TxcFileLayout:
+    """
+    The ids used by a generated file. Every journey pattern has its own route, route
+    sections and journey pattern sections, and each timing link has its own route
+    link, so the work done per file grows with every count.
+    """
+
+    def __init__(self, file_number: int, sizes: dict):
+        self.file_number = file_number
+        self.sizes = sizes
+
+    def noc(self, operator: int) -> str:
+        return f"SY{operator:02d}"
+
+    def service_code(self, operator: int, service: int) -> str:
+        return f"PB{self.file_number:04d}{operator:02d}:{service}"
+
+    def line_id(self, operator: int, service: int, line: int) -> str:
+        return f"{self.noc(operator)}:{self.service_code(operator, service)}:{line}"
+
+    def journey_pattern_id(self, operator: int, service: int, journey_pattern: int):
+        return f"JP{operator}-{service}-{journey_pattern}"
+
+    def journey_patterns(self):
+        for operator in range(self.sizes["operators"]):
+            for service in range(self.sizes["services_per_operator"]):
+                for journey_pattern in range(
+                    self.sizes["journey_patterns_per_service"]
+                ):
+                    yield operator, service, journey_pattern
+
+    def stop_code(self, journey_pattern_key: tuple, stop: int) -> str:
+        operator, service, journey_pattern = journey_pattern_key
+        # neighbouring journey patterns of a service share half their stops
+        offset = journey_pattern * self.links_per_journey_pattern() // 2
+        return f"{self.file_number:03d}0{operator:02d}{service:04d}{offset + stop:05d}"
+
+    def links_per_journey_pattern(self) -> int:
+        return (
+            self.sizes["sections_per_journey_pattern"]
+            * self.sizes["timing_links_per_section"]
+        )
+
+
+def write_stop_points(writer: XmlWriter, layout: TxcFileLayout):
+    stop_codes = set()
+    for journey_pattern_key in layout.journey_patterns():
+        for stop in range(layout.links_per_journey_pattern() + 1):
+            stop_codes.add(layout.stop_code(journey_pattern_key, stop))
+
+    writer.start("StopPoints")
+    for stop_code in sorted(stop_codes):
+        writer.start("AnnotatedStopPointRef")
+        writer.element("StopPointRef", stop_code)
+        writer.element("CommonName", f"Stop {stop_code}")
+        writer.end()
+    writer.end()
+
+
+def write_route_sections(writer: XmlWriter, layout: TxcFileLayout):
+    sizes = layout.sizes
+    links_per_journey_pattern = layout.links_per_journey_pattern()
+    route_sections = sizes["route_sections_per_route"]
+
+    writer.start("RouteSections")
+    for journey_pattern_key in layout.journey_patterns():
+        journey_pattern_id = layout.journey_pattern_id(*journey_pattern_key)
+        for route_section in range(route_sections):
+            writer.start(
+                "RouteSection", {"id": f"RS{journey_pattern_id}-{route_section}"}
+            )
+            for link in range(
+                route_section, links_per_journey_pattern, route_sections
+            ):
+                writer.start("RouteLink", {"id": f"RL{journey_pattern_id}-{link}"})
+                writer.start("From")
+                writer.element(
+                    "StopPointRef", layout.stop_code(journey_pattern_key, link)
+                )
+                writer.end()
+                writer.start("To")
+                writer.element(
+                    "StopPointRef", layout.stop_code(journey_pattern_key, link + 1)
+                )
+                writer.end()
+                writer.element("Distance", 250)
+                writer.start("Track")
+                writer.start("Mapping")
+                for point in range(sizes["track_points_per_route_link"]):
+                    offset = link * 0.001 + point * 0.0001
+                    writer.start(
+                        "Location", {"id": f"L{journey_pattern_id}-{link}-{point}"}
+                    )
+                    writer.start("Translation")
+                    writer.element("Longitude", f"{-2.5 + offset:.6f}")
+                    writer.element("Latitude", f"{53.7 + offset:.6f}")
+                    writer.end()
+                    writer.end()
+                writer.end()
+                writer.end()
+                writer.end()
+            writer.end()
+    writer.end()
+
+
+def write_routes(writer: XmlWriter, layout: TxcFileLayout):
+    writer.start("Routes")
+    for journey_pattern_key in layout.journey_patterns():
+        journey_pattern_id = layout.journey_pattern_id(*journey_pattern_key)
+        writer.start("Route", {"id": f"RT{journey_pattern_id}"})
+        writer.element("Description", f"Route {journey_pattern_id}")
+        for route_section in range(layout.sizes["route_sections_per_route"]):
+            writer.element("RouteSectionRef", f"RS{journey_pattern_id}-{route_section}")
+        writer.end()
+    writer.end()
+
+
+def write_journey_pattern_sections(writer: XmlWriter, layout: TxcFileLayout):
+    sizes = layout.sizes
+
+    writer.start("JourneyPatternSections")
+    for journey_pattern_key in layout.journey_patterns():
+        journey_pattern_id = layout.journey_pattern_id(*journey_pattern_key)
+        link = 0
+        for section in range(sizes["sections_per_journey_pattern"]):
+            writer.start(
+                "JourneyPatternSection", {"id": f"JPS{journey_pattern_id}-{section}"}
+            )
+            for _ in range(sizes["timing_links_per_section"]):
+                writer.start(
+                    "JourneyPatternTimingLink",
+                    {"id": f"JPTL{journey_pattern_id}-{link}"},
+                )
+                writer.start("From", {"SequenceNumber": link + 1})
+                writer.element("Activity", "pickUp")
+                writer.element(
+                    "StopPointRef", layout.stop_code(journey_pattern_key, link)
+                )
+                writer.element("TimingStatus", "principalTimingPoint")
+                writer.end()
+                writer.start("To", {"SequenceNumber": link + 2})
+                writer.element("Activity", "setDown")
+                writer.element(
+                    "StopPointRef", layout.stop_code(journey_pattern_key, link + 1)
+                )
+                writer.element("TimingStatus", "otherPoint")
+                writer.end()
+                writer.element("RouteLinkRef", f"RL{journey_pattern_id}-{link}")
+                writer.element("RunTime", "PT2M")
+                writer.end()
+                link += 1
+            writer.end()
+    writer.end()
+
+
+def write_operators(writer: XmlWriter, layout: TxcFileLayout):
+    writer.start("Operators")
+    for operator in range(layout.sizes["operators"]):
+        noc = layout.noc(operator)
+        writer.start("Operator", {"id": noc})
+        writer.element("NationalOperatorCode", noc)
+        writer.element("OperatorCode", noc)
+        writer.element("OperatorShortName", f"Operator {noc}")
+        writer.end()
+    writer.end()
+
+
+def write_services(writer: XmlWriter, layout: TxcFileLayout):
+    sizes = layout.sizes
+
+    writer.start("Services")
+    for operator in range(sizes["operators"]):
+        for service in range(sizes["services_per_operator"]):
+            writer.start("Service")
+            writer.element("ServiceCode", layout.service_code(operator, service))
+            writer.start("Lines")
+            for line in range(sizes["lines_per_service"]):
+                writer.start("Line", {"id": layout.line_id(operator, service, line)})
+                writer.element("LineName", f"{service}{chr(ord('A') + line % 26)}")
+                writer.start("OutboundDescription")
+                writer.element("Description", "Town Centre - Outskirts")
+                writer.end()
+                writer.start("InboundDescription")
+                writer.element("Description", "Outskirts - Town Centre")
+                writer.end()
+                writer.end()
+            writer.end()
+            writer.start("OperatingPeriod")
+            writer.element("StartDate", "2024-01-01")
+            writer.element("EndDate", "2030-12-31")
+            writer.end()
+            writer.element("RegisteredOperatorRef", layout.noc(operator))
+            writer.element("Mode", "coach")
+            writer.element("Description", f"Synthetic service {service}")
+            writer.start("StandardService")
+            writer.element("Origin", "Town Centre")
+            writer.element("Destination", "Outskirts")
+            for journey_pattern in range(sizes["journey_patterns_per_service"]):
+                journey_pattern_id = layout.journey_pattern_id(
+                    operator, service, journey_pattern
+                )
+                writer.start("JourneyPattern", {"id": journey_pattern_id})
+                writer.element("DestinationDisplay", f"Stop {journey_pattern}")
+                writer.element(
+                    "Direction", "outbound" if journey_pattern % 2 == 0 else "inbound"
+                )
+                writer.element("RouteRef", f"RT{journey_pattern_id}")
+                for section in range(sizes["sections_per_journey_pattern"]):
+                    writer.element(
+                        "JourneyPatternSectionRefs",
+                        f"JPS{journey_pattern_id}-{section}",
+                    )
+                writer.end()
+            writer.end()
+            writer.end()
+    writer.end()
+
+
+def write_vehicle_journeys(writer: XmlWriter, layout: TxcFileLayout):
+    sizes = layout.sizes
+    journey_patterns_per_service = sizes["journey_patterns_per_service"]
+
+    writer.start("VehicleJourneys")
+    for operator in range(sizes["operators"]):
+        for service in range(sizes["services_per_operator"]):
+            for line in range(sizes["lines_per_service"]):
+                line_id = layout.line_id(operator, service, line)
+                vehicle_journey_codes = []
+                for vehicle_journey in range(sizes["vehicle_journeys_per_line"]):
+                    code = f"VJ{operator}-{service}-{line}-{vehicle_journey}"
+                    vehicle_journey_codes.append(code)
+                    departure_minutes = 6 * 60 + vehicle_journey * 7
+
+                    writer.start("VehicleJourney")
+                    writer.start("Operational")
+                    writer.start("TicketMachine")
+                    writer.element("JourneyCode", f"{vehicle_journey:04d}")
+                    writer.end()
+                    writer.end()
+                    writer.start("OperatingProfile")
+                    writer.start("RegularDayType")
+                    writer.start("DaysOfWeek")
+                    for day in DAYS_OF_WEEK:
+                        writer.element(day)
+                    writer.end()
+                    writer.end()
+                    writer.end()
+                    writer.element("VehicleJourneyCode", code)
+                    writer.element("ServiceRef", layout.service_code(operator, service))
+                    writer.element("LineRef", line_id)
+                    writer.element(
+                        "JourneyPatternRef",
+                        layout.journey_pattern_id(
+                            operator,
+                            service,
+                            vehicle_journey % journey_patterns_per_service,
+                        ),
+                    )
+                    hours, minutes = divmod(departure_minutes, 60)
+                    writer.element(
+                        "DepartureTime", f"{hours % 24:02d}:{minutes:02d}:00"
+                    )
+                    writer.end()
+
+                for vehicle_journey_ref in range(
+                    sizes["vehicle_journey_refs_per_line"]
+                ):
+                    if not vehicle_journey_codes:
+                        break
+                    writer.start("VehicleJourney")
+                    writer.element(
+                        "VehicleJourneyCode",
+                        f"VJR{operator}-{service}-{line}-{vehicle_journey_ref}",
+                    )
+                    writer.element("ServiceRef", layout.service_code(operator, service))
+                    writer.element("LineRef", line_id)
+                    writer.element(
+                        "VehicleJourneyRef",
+                        vehicle_journey_codes[
+                            vehicle_journey_ref % len(vehicle_journey_codes)
+                        ],
+                    )
+                    writer.element("DepartureTime", "23:00:00")
+                    writer.end()
+    writer.end()
+
+
+def write_txc_file(output_path: str, sizes: dict, file_number: int = 0) -> str:
+    layout = TxcFileLayout(file_number, sizes)
+
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        output_file.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        writer = XmlWriter(output_file)
+        writer.start(
+            "TransXChange",
+            {
+                "xmlns": TXC_NAMESPACE,
+                "CreationDateTime": "2024-01-01T00:00:00",
+                "ModificationDateTime": "2024-01-01T00:00:00",
+                "Modification": "new",
+                "RevisionNumber": 0,
+                "FileName": os.path.basename(output_path),
+                "SchemaVersion": "2.4",
+            },
+        )
+        write_stop_points(writer, layout)
+        write_route_sections(writer, layout)
+        write_routes(writer, layout)
+        write_journey_pattern_sections(writer, layout)
+        write_operators(writer, layout)
+        write_services(writer, layout)
+        write_vehicle_journeys(writer, layout)
+        writer.end()
+
+    return output_path
+
+
+def generate_corpus(
+    output_dir: str,
+    sizes: dict,
+    files: int = 1,
+    archive: str = None,
+    region: str = "SE",
+) -> list:
+    """
+    Writes files TXC files to output_dir. With archive set to "bods" they are zipped
+    into bods.zip, with "tnds" into a zip named after the region, matching the keys
+    the unzipper and uploader expect. Returns the paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    file_paths = [
+        write_txc_file(
+            f"{output_dir}/synthetic_{file_number:04d}.xml", sizes, file_number
+        )
+        for file_number in range(files)
+    ]
+
+    if archive is None:
+        return file_paths
+
+    archive_path = f"{output_dir}/{'bods' if archive == 'bods' else region}.zip"
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive_file:
+        for file_path in file_paths:
+            archive_file.write(file_path, os.path.basename(file_path))
+    for file_path in file_paths:
+        os.remove(file_path)
+
+    return [archive_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output_dir")
+    parser.add_argument("--profile", choices=PROFILES, default="small")
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--zip", choices=["bods", "tnds"], dest="archive")
+    parser.add_argument("--region", default="SE", help="TNDS region of the zip")
+    for size_name in DEFAULT_SIZES:
+        parser.add_argument(f"--{size_name.replace('_', '-')}", type=int)
+    args = parser.parse_args()
+
+    sizes = get_sizes(
+        args.profile,
+        **{
+            size_name: getattr(args, size_name)
+            for size_name in DEFAULT_SIZES
+            if getattr(args, size_name) is not None
+        },
+    )
+
+    for file_path in generate_corpus(
+        args.output_dir, sizes, args.files, args.archive, args.region
+    ):
+        print(f"{file_path} {os.path.getsize(file_path)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,31 @@
+import json
 import logging
-import aurora_data_api
 import os
 from urllib.parse import unquote_plus
 
 import boto3
 
-from txc_processor import download_from_s3_and_write_to_db
+from txc_bulk_insert import parse_bulk_insert_limits
+from txc_bulk_load import BULK_LOAD_MODE_LOCAL_INFILE, create_bulk_load_target
+from txc_cache import (
+    DEFAULT_NOC_CACHE_TTL_SECONDS,
+    DEFAULT_STOP_CACHE_MAX_SIZE,
+    DEFAULT_STOP_CACHE_TTL_SECONDS,
+    NocCache,
+    StopCache,
+)
+from txc_connections import (
+    DB_ENGINE_DATA_API,
+    DEFAULT_MYSQL_POOL_SIZE,
+    InstrumentedConnection,
+    connect,
+)
+from txc_id_allocator import IdAllocator
+from txc_processor import (
+    DEFAULT_STREAMING_CHUNK_SIZE,
+    DEFAULT_STREAMING_THRESHOLD_BYTES,
+    download_from_s3_and_write_to_db,
+)
 
 s3_client = boto3.client("s3")
 cloudwatch_client = boto3.client("cloudwatch")
@@ -13,21 +33,103 @@ cloudwatch_client = boto3.client("cloudwatch")
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-db_connection = aurora_data_api.connect(
-    aurora_cluster_arn=os.getenv("CLUSTER_ARN"),
-    database=os.getenv("DATABASE_NAME"),
-    secret_arn=os.getenv("DATABASE_SECRET_ARN")
+bulk_load_mode = os.getenv("BULK_LOAD_MODE")
+
+
+def connect_to_database():
+    return connect(
+        os.getenv("DB_ENGINE", DB_ENGINE_DATA_API),
+        aurora_cluster_arn=os.getenv("CLUSTER_ARN"),
+        database=os.getenv("DATABASE_NAME"),
+        secret_arn=os.getenv("DATABASE_SECRET_ARN"),
+        # only used by the mysql engine, the host and port otherwise come from the secret
+        host=os.getenv("DATABASE_HOST"),
+        port=os.getenv("DATABASE_PORT"),
+        pool_size=int(os.getenv("DATABASE_POOL_SIZE", DEFAULT_MYSQL_POOL_SIZE)),
+        local_infile=bulk_load_mode == BULK_LOAD_MODE_LOCAL_INFILE,
+    )
+
+
+db_connection = InstrumentedConnection(connect_to_database())
+
+# ids are reserved over a connection of their own so the reservations commit at once
+id_allocation_block_size = int(os.getenv("ID_ALLOCATION_BLOCK_SIZE", 0))
+id_allocator = (
+    IdAllocator(connect_to_database(), id_allocation_block_size)
+    if id_allocation_block_size > 0
+    else None
 )
 
+streaming_threshold_bytes = int(
+    os.getenv("STREAMING_INGEST_THRESHOLD_BYTES", DEFAULT_STREAMING_THRESHOLD_BYTES)
+)
+streaming_chunk_size = int(
+    os.getenv("STREAMING_INGEST_CHUNK_SIZE", DEFAULT_STREAMING_CHUNK_SIZE)
+)
 
-def main(event, context):
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = unquote_plus(event["Records"][0]["s3"]["object"]["key"], encoding="utf-8")
+stop_cache = StopCache(
+    max_size=int(os.getenv("STOP_CACHE_MAX_SIZE", DEFAULT_STOP_CACHE_MAX_SIZE)),
+    ttl_seconds=float(
+        os.getenv("STOP_CACHE_TTL_SECONDS", DEFAULT_STOP_CACHE_TTL_SECONDS)
+    ),
+)
+
+noc_cache = NocCache(
+    ttl_seconds=float(os.getenv("NOC_CACHE_TTL_SECONDS", DEFAULT_NOC_CACHE_TTL_SECONDS))
+)
+
+use_ingest_ledger = os.getenv("INGEST_LEDGER_ENABLED", "false") == "true"
+incremental_ingest = os.getenv("INCREMENTAL_INGEST_ENABLED", "false") == "true"
+
+bulk_insert_limits = parse_bulk_insert_limits(os.getenv("BULK_INSERT_LIMITS"))
+
+bulk_load_target = create_bulk_load_target(
+    bulk_load_mode,
+    s3_client,
+    os.getenv("BULK_LOAD_BUCKET"),
+    os.getenv("BULK_LOAD_PREFIX"),
+)
+
+
+# get_s3_objects and the record handling in main are kept identical to the
+# txc-unzipper's, as each lambda is packaged on its own
+def get_s3_objects(record):
+    if record.get("eventSource") == "aws:sqs":
+        # SQS messages carry an S3 event notification, s3:TestEvent messages have no records
+        s3_records = json.loads(record["body"]).get("Records", [])
+    else:
+        s3_records = [record]
+
+    return [
+        (
+            s3_record["s3"]["bucket"]["name"],
+            unquote_plus(s3_record["s3"]["object"]["key"], encoding="utf-8"),
+        )
+        for s3_record in s3_records
+    ]
+
+
+def process_file(bucket, key):
     file_path = "/tmp/" + key.split("/")[-1]
 
     try:
         download_from_s3_and_write_to_db(
-            s3_client, cloudwatch_client, bucket, key, file_path, db_connection, logger
+            s3_client,
+            cloudwatch_client,
+            bucket,
+            key,
+            file_path,
+            db_connection,
+            logger,
+            streaming_threshold_bytes=streaming_threshold_bytes,
+            streaming_chunk_size=streaming_chunk_size,
+            stop_cache=stop_cache,
+            bulk_insert_limits=bulk_insert_limits,
+            bulk_load_target=bulk_load_target,
+            id_allocator=id_allocator,
+            use_ingest_ledger=use_ingest_ledger,
+            incremental=incremental_ingest,
+            noc_cache=noc_cache,
         )
     except Exception as e:
         logger.error(
@@ -35,8 +137,41 @@ def main(event, context):
         )
         raise e
     finally:
+        statement_summary = {"key": key, **db_connection.pop_summary()}
+        logger.info(f"Database statement summary: {json.dumps(statement_summary)}")
+
         if os.path.exists(file_path):
             logger.info(f"Removing File: {file_path}")
             os.remove(file_path)
         else:
             logger.warn(f"File does not exist: {file_path}")
+
+
+def main(event, context):
+    if id_allocator is not None:
+        id_allocator.discard_reserved_ids()
+
+    records = event.get("Records", [])
+    is_sqs_batch = any(record.get("eventSource") == "aws:sqs" for record in records)
+    batch_item_failures = []
+    errors = []
+
+    for record in records:
+        try:
+            for bucket, key in get_s3_objects(record):
+                process_file(bucket, key)
+        except Exception as e:
+            if record.get("eventSource") == "aws:sqs":
+                batch_item_failures.append({"itemIdentifier": record["messageId"]})
+            else:
+                errors.append(e)
+
+    logger.info(
+        f"Processed {len(records)} records, {len(batch_item_failures) + len(errors)} failed"
+    )
+
+    if is_sqs_batch:
+        return {"batchItemFailures": batch_item_failures}
+
+    if errors:
+        raise errors[0]
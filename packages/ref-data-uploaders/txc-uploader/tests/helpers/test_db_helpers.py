@@ -0,0 +1,110 @@
+import re
+
+table_name_pattern = re.compile(r"INSERT\s+(?:IGNORE\s+)?INTO\s+(\w+)", re.IGNORECASE)
+values_row_pattern = re.compile(r"\(([^()]*)\)")
+numbered_placeholder_pattern = re.compile(r":(\w+)_(\d+)$")
+
+
+def split_multi_row_params(query, params):
+    """
+    Splits the params of a multi-row INSERT built by txc_bulk_insert back into one
+    dict per row, keyed by the single row placeholder names.
+    """
+    values_start = query.upper().rfind("VALUES")
+    if values_start == -1 or not params:
+        return [params]
+
+    rows = []
+    for row_number, row in enumerate(
+        values_row_pattern.findall(query[values_start:])
+    ):
+        row_params = {}
+        for placeholder in row.split(","):
+            match = numbered_placeholder_pattern.match(placeholder.strip())
+            if not match or int(match.group(2)) != row_number:
+                return [params]
+            row_params[match.group(1)] = params[f"{match.group(1)}_{row_number}"]
+        rows.append(row_params)
+
+    return rows
+
+
+def count_rows(connection, table: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def get_table_rows(connection, table: str) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM {table} ORDER BY 1")
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def create_bucket(s3, bucket: str, objects: dict):
+    s3.create_bucket(
+        Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+    )
+    for key, body in objects.items():
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+class FakeCursor:
+    """
+    Stands in for an AuroraDataAPICursor where no rows exist yet, recording every
+    statement and the rows inserted into each table.
+    """
+
+    def __init__(self):
+        self.lastrowid = None
+        self.next_id = 1
+        self.statements = []
+        self.rows = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def record_rows(self, query, params_list):
+        match = table_name_pattern.search(query)
+        if match:
+            self.rows.setdefault(match.group(1), []).extend(params_list)
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        if table_name_pattern.search(query):
+            self.lastrowid = self.next_id
+            self.next_id += 1
+        self.record_rows(query, split_multi_row_params(query, params))
+
+    def executemany(self, query, params_list):
+        self.statements.append(query)
+        self.record_rows(query, list(params_list))
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class FakeConnection:
+    def __init__(self):
+        self.fake_cursor = FakeCursor()
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self.fake_cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def sorted_rows(rows):
+    return sorted(rows, key=lambda row: sorted((k, str(v)) for k, v in row.items()))
@@ -1,13 +1,23 @@
+import glob
 import os
 
 import xmltodict
 import xml.etree.ElementTree as eT
 
+from txc_parser import parse_txc_file, strip_namespace_declarations
+
 dir_path = os.path.dirname(os.path.realpath(__file__))
+repo_test_data_path = os.path.realpath(f"{dir_path}/../../../../../test-data")
 
+fixture_files = sorted(
+    glob.glob(f"{dir_path}/test_data/*.xml")
+    + glob.glob(f"{repo_test_data_path}/bods/test.xml")
+    + glob.glob(f"{repo_test_data_path}/tnds/test.xml")
+)
 
-def generate_mock_data_dict():
-    tree = eT.parse(f"{dir_path}/test_data/mock_txc.xml")
+
+def generate_legacy_data_dict(file_path):
+    tree = eT.parse(file_path)
     xml_data = tree.getroot()
     xml_string = eT.tostring(xml_data, encoding="utf-8", method="xml")
     mock_data_dict = xmltodict.parse(
@@ -16,42 +26,20 @@ def generate_mock_data_dict():
         namespaces={"http://www.transxchange.org.uk/": None},
     )
 
-    return mock_data_dict
+    return strip_namespace_declarations(mock_data_dict)
+
+
+def generate_mock_data_dict():
+    return parse_txc_file(f"{dir_path}/test_data/mock_txc.xml")
 
 
 def generate_mock_invalid_data_dict():
-    tree = eT.parse(f"{dir_path}/test_data/mock_txc_invalid.xml")
-    xml_data = tree.getroot()
-    xml_string = eT.tostring(xml_data, encoding="utf-8", method="xml")
-    mock_data_dict = xmltodict.parse(
-        xml_string,
-        process_namespaces=True,
-        namespaces={"http://www.transxchange.org.uk/": None},
-    )
+    return parse_txc_file(f"{dir_path}/test_data/mock_txc_invalid.xml")
 
-    return mock_data_dict
 
 def generate_mock_ferry_txc_data_dict():
-    tree = eT.parse(f"{dir_path}/test_data/mock_ferry_txc.xml")
-    xml_data = tree.getroot()
-    xml_string = eT.tostring(xml_data, encoding="utf-8", method="xml")
-    mock_data_dict = xmltodict.parse(
-        xml_string,
-        process_namespaces=True,
-        namespaces={"http://www.transxchange.org.uk/": None},
-    )
-
-    return mock_data_dict
+    return parse_txc_file(f"{dir_path}/test_data/mock_ferry_txc.xml")
 
 
 def generate_mock_txc_tracks_data_dict():
-    tree = eT.parse(f"{dir_path}/test_data/mock_txc_tracks.xml")
-    xml_data = tree.getroot()
-    xml_string = eT.tostring(xml_data, encoding="utf-8", method="xml")
-    mock_data_dict = xmltodict.parse(
-        xml_string,
-        process_namespaces=True,
-        namespaces={"http://www.transxchange.org.uk/": None},
-    )
-
-    return mock_data_dict
\ No newline at end of file
+    return parse_txc_file(f"{dir_path}/test_data/mock_txc_tracks.xml")
@@ -0,0 +1,132 @@
+import importlib
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+
+@pytest.fixture(scope="function")
+def index(aws_credentials, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    yield importlib.import_module("index")
+
+
+def s3_record(key, bucket="txc-bucket"):
+    return {
+        "eventSource": "aws:s3",
+        "s3": {"bucket": {"name": bucket}, "object": {"key": key}},
+    }
+
+
+def sqs_record(message_id, *keys):
+    return {
+        "eventSource": "aws:sqs",
+        "messageId": message_id,
+        "body": json.dumps({"Records": [s3_record(key) for key in keys]}),
+    }
+
+
+class TestHandler:
+    def test_every_s3_record_is_processed(self, index):
+        with patch("index.download_from_s3_and_write_to_db") as write_patch:
+            index.main(
+                {"Records": [s3_record("tnds/WM/a.xml"), s3_record("bods/b+c.xml")]},
+                None,
+            )
+
+        keys = [call.args[3] for call in write_patch.call_args_list]
+        assert keys == ["tnds/WM/a.xml", "bods/b c.xml"]
+        call = write_patch.call_args_list[0]
+        assert call.args[5] is index.db_connection
+        assert call.kwargs == {
+            "streaming_threshold_bytes": index.streaming_threshold_bytes,
+            "streaming_chunk_size": index.streaming_chunk_size,
+            "stop_cache": index.stop_cache,
+            "bulk_insert_limits": index.bulk_insert_limits,
+            "bulk_load_target": index.bulk_load_target,
+            "id_allocator": index.id_allocator,
+            "use_ingest_ledger": index.use_ingest_ledger,
+            "incremental": index.incremental_ingest,
+            "noc_cache": index.noc_cache,
+        }
+
+    def test_s3_failures_are_raised_after_all_records_are_processed(self, index):
+        with patch(
+            "index.download_from_s3_and_write_to_db",
+            side_effect=[Exception("failed"), None],
+        ) as write_patch:
+            with pytest.raises(Exception, match="failed"):
+                index.main(
+                    {"Records": [s3_record("tnds/WM/a.xml"), s3_record("bods/b.xml")]},
+                    None,
+                )
+
+        assert write_patch.call_count == 2
+
+    def test_sqs_batch_reports_failed_messages(self, index):
+        with patch(
+            "index.download_from_s3_and_write_to_db",
+            side_effect=[None, Exception("failed"), None],
+        ) as write_patch:
+            response = index.main(
+                {
+                    "Records": [
+                        sqs_record("message-1", "bods/a.xml"),
+                        sqs_record("message-2", "bods/b.xml", "bods/c.xml"),
+                    ]
+                },
+                None,
+            )
+
+        assert response == {"batchItemFailures": [{"itemIdentifier": "message-2"}]}
+        assert write_patch.call_count == 2
+
+    def test_sqs_test_events_are_ignored(self, index):
+        with patch("index.download_from_s3_and_write_to_db") as write_patch:
+            response = index.main(
+                {
+                    "Records": [
+                        {
+                            "eventSource": "aws:sqs",
+                            "messageId": "message-1",
+                            "body": json.dumps({"Event": "s3:TestEvent"}),
+                        }
+                    ]
+                },
+                None,
+            )
+
+        assert response == {"batchItemFailures": []}
+        write_patch.assert_not_called()
+
+    def test_statement_summary_is_logged_for_each_file(self, index):
+        with patch("index.download_from_s3_and_write_to_db"), patch.object(
+            index.db_connection, "pop_summary", return_value={"calls": 3}
+        ) as summary_patch, patch.object(index.logger, "info") as info_patch:
+            index.main(
+                {"Records": [s3_record("tnds/WM/a.xml"), s3_record("bods/b.xml")]},
+                None,
+            )
+
+        summaries = [
+            call.args[0]
+            for call in info_patch.call_args_list
+            if call.args[0].startswith("Database statement summary")
+        ]
+        assert summary_patch.call_count == 2
+        assert summaries == [
+            'Database statement summary: {"key": "tnds/WM/a.xml", "calls": 3}',
+            'Database statement summary: {"key": "bods/b.xml", "calls": 3}',
+        ]
+
+    def test_reserved_ids_are_discarded_once_per_invocation(self, index, monkeypatch):
+        id_allocator = MagicMock()
+        monkeypatch.setattr(index, "id_allocator", id_allocator)
+
+        with patch("index.download_from_s3_and_write_to_db"):
+            index.main(
+                {"Records": [s3_record("tnds/WM/a.xml"), s3_record("bods/b.xml")]},
+                None,
+            )
+
+        id_allocator.discard_reserved_ids.assert_called_once()
@@ -0,0 +1,220 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from benchmarks.bulk_insert_chunking import TABLE_QUERIES
+from benchmarks.fakes import FakeDataApiConnection
+from txc_bulk_insert import (
+    DATA_API_MAX_SQL_LENGTH,
+    DEFAULT_BULK_INSERT_LIMITS,
+    BulkInsertLimits,
+    build_multi_row_inserts,
+    bulk_insert,
+    get_bulk_insert_limits,
+    parse_bulk_insert_limits,
+)
+from txc_connections import SqliteConnection
+
+tracks_query = """INSERT INTO tracks_new (operatorServiceId, longitude, latitude) VALUES (:operator_service_id, :longitude, :latitude)"""
+
+
+def track_values(count: int) -> list:
+    return [
+        {"operator_service_id": 1, "longitude": f"-1.{i}", "latitude": f"52.{i}"}
+        for i in range(count)
+    ]
+
+
+def count_rows(query: str) -> int:
+    return query.count("(:operator_service_id_")
+
+
+def count_rows_in(query: str) -> int:
+    return query.count("), (") + 1
+
+
+class TestBuildMultiRowInserts:
+    def test_rows_are_numbered_within_each_statement(self):
+        [(query, params)] = build_multi_row_inserts(
+            tracks_query, track_values(2), BulkInsertLimits()
+        )
+
+        assert query == (
+            "INSERT INTO tracks_new (operatorServiceId, longitude, latitude) VALUES "
+            "(:operator_service_id_0, :longitude_0, :latitude_0), "
+            "(:operator_service_id_1, :longitude_1, :latitude_1)"
+        )
+        assert params == {
+            "operator_service_id_0": 1,
+            "longitude_0": "-1.0",
+            "latitude_0": "52.0",
+            "operator_service_id_1": 1,
+            "longitude_1": "-1.1",
+            "latitude_1": "52.1",
+        }
+
+    @pytest.mark.parametrize(
+        "row_count, expected_rows",
+        [(3, [3]), (4, [4]), (5, [4, 1]), (8, [4, 4]), (9, [4, 4, 1])],
+    )
+    def test_statements_are_cut_at_max_rows(self, row_count, expected_rows):
+        statements = list(
+            build_multi_row_inserts(
+                tracks_query, track_values(row_count), BulkInsertLimits(max_rows=4)
+            )
+        )
+
+        assert [count_rows(query) for query, _ in statements] == expected_rows
+        assert [len(params) for _, params in statements] == [
+            rows * 3 for rows in expected_rows
+        ]
+
+    def test_statements_are_cut_before_max_bytes(self):
+        [(one_row_query, one_row_params)] = build_multi_row_inserts(
+            tracks_query, track_values(1), BulkInsertLimits()
+        )
+        one_row_bytes = len(one_row_query) + sum(
+            len(name) + len(str(value)) + 40 for name, value in one_row_params.items()
+        )
+
+        statements = list(
+            build_multi_row_inserts(
+                tracks_query,
+                track_values(5),
+                BulkInsertLimits(max_rows=100, max_bytes=one_row_bytes * 2),
+            )
+        )
+
+        assert [count_rows(query) for query, _ in statements] == [2, 2, 1]
+
+    def test_row_over_max_bytes_is_sent_on_its_own(self):
+        values = track_values(3)
+        values[1]["longitude"] = "x" * 1000
+
+        statements = list(
+            build_multi_row_inserts(
+                tracks_query, values, BulkInsertLimits(max_rows=100, max_bytes=500)
+            )
+        )
+
+        assert [count_rows(query) for query, _ in statements] == [1, 1, 1]
+        assert statements[1][1]["longitude_0"] == "x" * 1000
+
+    def test_statements_are_cut_before_max_sql_length(self):
+        [(two_row_query, _)] = build_multi_row_inserts(
+            tracks_query, track_values(2), BulkInsertLimits()
+        )
+
+        for max_sql_length, expected_rows in [
+            (len(two_row_query) + 2, [2, 2, 1]),
+            (len(two_row_query) + 1, [1, 1, 1, 1, 1]),
+        ]:
+            statements = list(
+                build_multi_row_inserts(
+                    tracks_query,
+                    track_values(5),
+                    BulkInsertLimits(max_sql_length=max_sql_length),
+                )
+            )
+
+            assert [count_rows(query) for query, _ in statements] == expected_rows
+            assert all(len(query) <= max_sql_length for query, _ in statements)
+
+    @pytest.mark.parametrize("table", list(DEFAULT_BULK_INSERT_LIMITS))
+    def test_default_limits_fit_the_data_api_sql_length(self, table):
+        query, build_values = TABLE_QUERIES[table]
+        values = [build_values(i) for i in range(5000)]
+
+        statements = list(
+            build_multi_row_inserts(query, values, get_bulk_insert_limits(table))
+        )
+
+        assert max(len(query) for query, _ in statements) <= DATA_API_MAX_SQL_LENGTH
+        # a full statement is cut at max_rows rather than max_sql_length
+        assert count_rows_in(statements[0][0]) == get_bulk_insert_limits(table).max_rows
+
+    def test_no_statements_for_no_values(self):
+        assert list(build_multi_row_inserts(tracks_query, [], BulkInsertLimits())) == []
+
+    def test_query_without_values_is_rejected(self):
+        with pytest.raises(ValueError):
+            list(
+                build_multi_row_inserts(
+                    "DELETE FROM tracks_new", track_values(1), BulkInsertLimits()
+                )
+            )
+
+
+class TestBulkInsertLimits:
+    def test_table_limits_override_the_defaults(self):
+        limits = {"tracks_new": BulkInsertLimits(max_rows=10)}
+
+        assert get_bulk_insert_limits("tracks_new", limits).max_rows == 10
+        assert (
+            get_bulk_insert_limits("vehicle_journeys_new", limits)
+            is DEFAULT_BULK_INSERT_LIMITS["vehicle_journeys_new"]
+        )
+
+    def test_limits_are_parsed_from_json(self):
+        limits = parse_bulk_insert_limits(
+            '{"tracks_new": {"max_rows": 5000, "max_bytes": 2000000}, "vehicle_journeys_new": {"max_rows": 50}}'
+        )
+
+        assert vars(limits["tracks_new"]) == {
+            "max_rows": 5000,
+            "max_bytes": 2000000,
+            "max_sql_length": DEFAULT_BULK_INSERT_LIMITS["tracks_new"].max_sql_length,
+        }
+        assert limits["vehicle_journeys_new"].max_rows == 50
+        assert parse_bulk_insert_limits(None) == {}
+
+
+class TestBulkInsert:
+    def test_statements_over_the_sql_length_are_rejected_by_the_fake_data_api(self):
+        connection = FakeDataApiConnection()
+        values = track_values(3000)
+
+        with connection.cursor() as cursor:
+            bulk_insert(cursor, tracks_query, values)
+            with pytest.raises(ValueError, match="the Data API allows 65536"):
+                bulk_insert(
+                    cursor,
+                    tracks_query,
+                    values,
+                    {
+                        "tracks_new": BulkInsertLimits(
+                            max_rows=3000, max_sql_length=10**6
+                        )
+                    },
+                )
+
+    def test_table_limits_are_used(self):
+        cursor = MagicMock()
+
+        statements = bulk_insert(
+            cursor,
+            tracks_query,
+            track_values(25),
+            {"tracks_new": BulkInsertLimits(max_rows=10)},
+        )
+
+        assert statements == 3
+        assert cursor.execute.call_count == 3
+        cursor.executemany.assert_not_called()
+
+    def test_every_row_is_written(self):
+        connection = SqliteConnection()
+
+        with connection.cursor() as cursor:
+            bulk_insert(
+                cursor,
+                tracks_query,
+                track_values(25),
+                {"tracks_new": BulkInsertLimits(max_rows=7)},
+            )
+            cursor.execute("SELECT longitude, latitude FROM tracks_new ORDER BY id")
+            rows = cursor.fetchall()
+
+        assert [tuple(row) for row in rows] == [
+            (f"-1.{i}", f"52.{i}") for i in range(25)
+        ]
@@ -0,0 +1,154 @@
+import logging
+import os
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from txc_bulk_load import (
+    BulkLoader,
+    LocalInfileTarget,
+    S3Target,
+    create_bulk_load_target,
+    escape_field,
+    read_staging_file,
+    unescape_field,
+)
+from txc_connections import SqliteConnection
+from txc_processor import write_to_database
+
+from tests.helpers import test_xml_helpers
+from tests.helpers.test_db_helpers import get_table_rows
+
+logger = logging.getLogger(__name__)
+
+tracks_query = """INSERT INTO tracks_new (operatorServiceId, longitude, latitude) VALUES (:operator_service_id, :longitude, :latitude)"""
+bulk_tables = ["vehicle_journeys_new", "service_journey_pattern_links_new", "tracks_new"]
+
+
+class TestStagingFileFormat:
+    @pytest.mark.parametrize(
+        "value",
+        ["plain", "tab\there", "new\nline", "back\\slash", "\\N", "", "é", None],
+    )
+    def test_fields_round_trip(self, value):
+        assert unescape_field(escape_field(value)) == value
+
+    def test_rows_are_written_in_placeholder_order(self):
+        bulk_loader = BulkLoader(LocalInfileTarget())
+        bulk_loader.stage_rows(
+            tracks_query,
+            [
+                {"latitude": "52.1", "longitude": "-1.1", "operator_service_id": 1},
+                {"latitude": None, "longitude": "a\tb", "operator_service_id": 2},
+            ],
+        )
+        staging_file = bulk_loader.staging_files["tracks_new"]
+        staging_file.close()
+
+        assert staging_file.columns == ["operatorServiceId", "longitude", "latitude"]
+        assert list(read_staging_file(staging_file.file_path)) == [
+            ["1", "-1.1", "52.1"],
+            ["2", "a\tb", None],
+        ]
+
+        bulk_loader.close()
+        assert not os.path.exists(bulk_loader.staging_dir)
+
+
+class TestBulkLoader:
+    def test_each_table_is_loaded_with_one_statement(self):
+        cursor = MagicMock()
+        cursor.rowcount = 3
+        bulk_loader = BulkLoader(LocalInfileTarget())
+        bulk_loader.stage_rows(
+            tracks_query,
+            [{"operator_service_id": 1, "longitude": "0", "latitude": "0"}] * 2,
+        )
+        bulk_loader.stage_rows(
+            tracks_query,
+            [{"operator_service_id": 2, "longitude": "0", "latitude": "0"}],
+        )
+        bulk_loader.stage_rows(tracks_query, [])
+
+        assert bulk_loader.load(cursor) == {"tracks_new": 3}
+        [statement] = [call.args[0] for call in cursor.execute.call_args_list]
+        assert statement.startswith(
+            f"LOAD DATA LOCAL INFILE '{bulk_loader.staging_dir}/tracks_new.tsv' INTO TABLE tracks_new "
+        )
+        assert statement.endswith("(operatorServiceId, longitude, latitude)")
+
+        bulk_loader.close()
+
+    def test_row_count_mismatch_is_raised(self):
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        bulk_loader = BulkLoader(LocalInfileTarget())
+        bulk_loader.stage_rows(
+            tracks_query,
+            [{"operator_service_id": 1, "longitude": "0", "latitude": "0"}] * 2,
+        )
+
+        with pytest.raises(RuntimeError, match="loaded 1 rows, expected 2"):
+            bulk_loader.load(cursor)
+
+        bulk_loader.close()
+
+    def test_s3_target_uploads_and_removes_staging_files(self, aws_credentials):
+        with mock_s3():
+            s3 = boto3.client("s3", region_name="eu-west-2")
+            s3.create_bucket(
+                Bucket="staging",
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+            cursor = MagicMock()
+            cursor.rowcount = 1
+            bulk_loader = BulkLoader(S3Target(s3, "staging"))
+            bulk_loader.stage_rows(
+                tracks_query,
+                [{"operator_service_id": 1, "longitude": "0", "latitude": "0"}],
+            )
+
+            bulk_loader.load(cursor)
+            key = f"bulk-load/{bulk_loader.batch_name}/tracks_new.tsv"
+            uploaded = s3.get_object(Bucket="staging", Key=key)["Body"].read()
+            bulk_loader.close()
+
+            assert uploaded == b"1\t0\t0\n"
+            assert cursor.execute.call_args.args[0].startswith(
+                f"LOAD DATA FROM S3 FILE 's3://staging/{key}' INTO TABLE tracks_new "
+            )
+            assert "Contents" not in s3.list_objects_v2(Bucket="staging")
+
+    def test_unknown_mode_is_rejected(self):
+        assert create_bulk_load_target(None) is None
+        with pytest.raises(ValueError):
+            create_bulk_load_target("s3")
+        with pytest.raises(ValueError):
+            create_bulk_load_target("copy")
+
+
+class TestBulkLoadIngest:
+    def test_bulk_load_writes_the_same_rows_as_inserts(self):
+        rows_by_mode = []
+
+        for bulk_load_target in [None, LocalInfileTarget()]:
+            connection = SqliteConnection()
+            assert write_to_database(
+                test_xml_helpers.generate_mock_data_dict(),
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                connection,
+                logger,
+                MagicMock(),
+                bulk_load_target=bulk_load_target,
+            )
+            rows_by_mode.append(
+                {table: get_table_rows(connection, table) for table in bulk_tables}
+            )
+
+        assert rows_by_mode[0]["vehicle_journeys_new"]
+        assert rows_by_mode[0]["service_journey_pattern_links_new"]
+        assert rows_by_mode[1] == rows_by_mode[0]
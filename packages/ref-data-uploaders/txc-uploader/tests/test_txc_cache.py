@@ -0,0 +1,148 @@
+from txc_cache import NocCache, StopCache
+
+stops = {
+    "0600MA6001": ("-2.1", "53.2", "060"),
+    "0600MA6002": ("-2.2", "53.3", "060"),
+    "0600MA6003": ("-2.3", "53.4", None),
+}
+
+
+class StopsCursor:
+    def __init__(self):
+        self.queries = []
+        self.result = []
+
+    def execute(self, query, params):
+        self.queries.append(params)
+        self.result = [
+            (atco_code, *stops[atco_code])
+            for atco_code in stops
+            if atco_code.lower() in [code.lower() for code in params.values()]
+        ]
+
+    def fetchall(self):
+        return self.result
+
+
+class OperatorsCursor:
+    def __init__(self, noc_codes: list):
+        self.noc_codes = noc_codes
+        self.queries = 0
+
+    def execute(self, query, params=None):
+        self.queries += 1
+
+    def fetchall(self):
+        return [(noc_code,) for noc_code in self.noc_codes]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStopCache:
+    def test_misses_are_loaded_in_one_query_and_then_hit(self):
+        cursor = StopsCursor()
+        stop_cache = StopCache()
+
+        assert sorted(
+            stop_cache.get_admin_area_codes(cursor, ["0600MA6001", "0600MA6002"])
+        ) == ["060"]
+        assert stop_cache.get_location(cursor, "0600MA6001") == ("-2.1", "53.2")
+
+        assert len(cursor.queries) == 1
+        assert stop_cache.get_stats() == {
+            "size": 2,
+            "hits": 1,
+            "misses": 2,
+            "queries": 1,
+            "evictions": 0,
+        }
+
+    def test_unknown_stops_are_cached_as_not_found(self):
+        cursor = StopsCursor()
+        stop_cache = StopCache()
+
+        assert stop_cache.get_location(cursor, "UNKNOWN") is None
+        assert stop_cache.get_admin_area_codes(cursor, ["UNKNOWN"]) == []
+        assert len(cursor.queries) == 1
+
+    def test_stops_without_locality_have_no_admin_area_codes(self):
+        cursor = StopsCursor()
+        stop_cache = StopCache()
+
+        assert stop_cache.get_admin_area_codes(cursor, ["0600MA6003"]) == []
+        assert stop_cache.get_location(cursor, "0600MA6003") == ("-2.3", "53.4")
+
+    def test_atco_codes_match_case_insensitively(self):
+        cursor = StopsCursor()
+        stop_cache = StopCache()
+
+        assert stop_cache.get_location(cursor, "0600ma6001") == ("-2.1", "53.2")
+        assert stop_cache.get_location(cursor, "0600MA6001") == ("-2.1", "53.2")
+        assert len(cursor.queries) == 1
+
+    def test_misses_are_loaded_in_batches(self):
+        cursor = StopsCursor()
+        stop_cache = StopCache()
+
+        stop_cache.get_admin_area_codes(cursor, [f"STOP{i}" for i in range(1200)])
+
+        assert [len(params) for params in cursor.queries] == [500, 500, 200]
+
+    def test_least_recently_used_stops_are_evicted(self):
+        cursor = StopsCursor()
+        stop_cache = StopCache(max_size=2)
+
+        stop_cache.get_location(cursor, "0600MA6001")
+        stop_cache.get_location(cursor, "0600MA6002")
+        stop_cache.get_location(cursor, "0600MA6001")
+        stop_cache.get_location(cursor, "0600MA6003")
+
+        assert list(stop_cache.entries) == ["0600ma6001", "0600ma6003"]
+        assert stop_cache.evictions == 1
+
+    def test_entries_expire_after_ttl(self):
+        cursor = StopsCursor()
+        clock = FakeClock()
+        stop_cache = StopCache(ttl_seconds=60, clock=clock)
+
+        stop_cache.get_location(cursor, "0600MA6001")
+        clock.now = 30
+        stop_cache.get_location(cursor, "0600MA6001")
+        clock.now = 100
+        stop_cache.get_location(cursor, "0600MA6001")
+
+        assert len(cursor.queries) == 2
+
+
+class TestNocCache:
+    def test_nocs_are_loaded_once_and_match_case_insensitively(self):
+        cursor = OperatorsCursor(["ANWE", "TFLO "])
+        noc_cache = NocCache()
+
+        assert noc_cache.is_valid_noc(cursor, "ANWE")
+        assert noc_cache.is_valid_noc(cursor, "anwe")
+        assert noc_cache.is_valid_noc(cursor, "TFLO")
+        assert not noc_cache.is_valid_noc(cursor, "NONE")
+
+        assert cursor.queries == 1
+        assert noc_cache.get_stats() == {"size": 2, "queries": 1}
+
+    def test_nocs_are_reloaded_after_ttl(self):
+        cursor = OperatorsCursor(["ANWE"])
+        clock = FakeClock()
+        noc_cache = NocCache(ttl_seconds=60, clock=clock)
+
+        assert not noc_cache.is_valid_noc(cursor, "TFLO")
+        cursor.noc_codes.append("TFLO")
+        clock.now = 30
+        assert not noc_cache.is_valid_noc(cursor, "TFLO")
+        clock.now = 100
+        assert noc_cache.is_valid_noc(cursor, "TFLO")
+
+        assert cursor.queries == 2
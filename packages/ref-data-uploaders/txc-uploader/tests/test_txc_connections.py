@@ -0,0 +1,511 @@
+import json
+import logging
+import os
+from unittest.mock import MagicMock, patch
+
+import aurora_data_api
+import boto3
+import pymysql
+import pytest
+from moto import mock_secretsmanager
+
+from txc_connections import (
+    DB_ENGINE_DATA_API,
+    DB_ENGINE_MYSQL,
+    DB_ENGINE_SQLITE,
+    InstrumentedConnection,
+    MysqlConnection,
+    MysqlConnectionPool,
+    SqliteConnection,
+    connect,
+    fingerprint_statement,
+    get_mysql_connect_kwargs,
+    translate_mysql_to_sqlite,
+    translate_named_to_pyformat,
+)
+from txc_processor import (
+    NOC_INTEGRITY_ERROR_MSG,
+    get_existing_txc_line_ids,
+    write_to_database,
+)
+
+from tests.helpers import test_xml_helpers
+from tests.helpers.test_db_helpers import count_rows
+
+logger = logging.getLogger(__name__)
+
+
+class TestTranslateMysqlToSqlite:
+    def test_null_safe_equals_becomes_is(self):
+        assert (
+            translate_mysql_to_sqlite("SELECT id FROM t WHERE a <=> :a AND b<=>:b")
+            == "SELECT id FROM t WHERE a IS :a AND b IS :b"
+        )
+
+    def test_insert_ignore_becomes_insert_or_ignore(self):
+        assert (
+            translate_mysql_to_sqlite("INSERT IGNORE INTO t (a) VALUES (:a)")
+            == "INSERT OR IGNORE INTO t (a) VALUES (:a)"
+        )
+
+    def test_parenthesised_union_members_become_subqueries(self):
+        assert (
+            translate_mysql_to_sqlite(
+                "(SELECT 0 AS candidate, id FROM t LIMIT 1) UNION ALL (SELECT 1 AS candidate, id FROM t LIMIT 1)"
+            )
+            == "SELECT * FROM (SELECT 0 AS candidate, id FROM t LIMIT 1) UNION ALL SELECT * FROM (SELECT 1 AS candidate, id FROM t LIMIT 1)"
+        )
+
+    def test_other_queries_are_unchanged(self):
+        query = "INSERT INTO tracks_new (operatorServiceId) VALUES (:operator_service_id)"
+
+        assert translate_mysql_to_sqlite(query) == query
+
+
+class TestSqliteConnection:
+    def test_lastrowid_is_the_inserted_id(self):
+        connection = SqliteConnection()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO services_new (lineName, dataSource) VALUES (:line_name, :data_source)",
+                {"line_name": "1", "data_source": "bods"},
+            )
+            first_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO services_new (lineName, dataSource) VALUES (:line_name, :data_source)",
+                {"line_name": "2", "data_source": "bods"},
+            )
+
+            assert cursor.lastrowid == first_id + 1
+
+    def test_strings_compare_like_unicode_ci(self):
+        connection = SqliteConnection()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO services_new (nocCode, lineName, dataSource) VALUES ('ABC', 'X1', 'bods')"
+            )
+            service_id = cursor.lastrowid
+
+            existing_line_ids = get_existing_txc_line_ids(
+                cursor, [("abc", "x1  ", None, None, None, "BODS")], logger
+            )
+
+        assert existing_line_ids == {("abc", "x1", None, None, None, "bods"): service_id}
+
+    def test_file_is_written_once_when_ingested_twice(self):
+        connection = SqliteConnection()
+        row_counts = []
+
+        for _ in range(2):
+            assert write_to_database(
+                test_xml_helpers.generate_mock_data_dict(),
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                connection,
+                logger,
+                MagicMock(),
+            )
+            row_counts.append(
+                (
+                    count_rows(connection, "services_new"),
+                    count_rows(connection, "service_journey_patterns_new"),
+                )
+            )
+
+        assert row_counts == [(1, 4), (1, 4)]
+        assert count_rows(connection, "vehicle_journeys_new") > 0
+
+    def test_rollback_discards_uncommitted_rows(self):
+        connection = SqliteConnection()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO tracks_new (operatorServiceId, longitude, latitude) VALUES (1, '0', '0')"
+            )
+        connection.rollback()
+
+        assert count_rows(connection, "tracks_new") == 0
+
+
+class TestFingerprintStatement:
+    def test_parameters_and_whitespace_are_normalised(self):
+        assert (
+            fingerprint_statement(
+                "SELECT id\n    FROM services_new WHERE id = :service_id LIMIT 1"
+            )
+            == "SELECT id FROM services_new WHERE id = ? LIMIT ?"
+        )
+
+    def test_in_lists_and_values_rows_are_collapsed(self):
+        assert fingerprint_statement(
+            "SELECT atcoCode FROM stops_new WHERE atcoCode IN (:k0, :k1, :k2)"
+        ) == fingerprint_statement(
+            "SELECT atcoCode FROM stops_new WHERE atcoCode IN (:k0)"
+        )
+        assert (
+            fingerprint_statement(
+                "INSERT IGNORE INTO service_admin_area_codes_new (serviceId, adminAreaCode) VALUES (:service_id, :k0), (:service_id, :k1)"
+            )
+            == "INSERT IGNORE INTO service_admin_area_codes_new (serviceId, adminAreaCode) VALUES (?, ?), ..."
+        )
+
+    def test_union_all_members_are_collapsed(self):
+        assert (
+            fingerprint_statement(
+                "(SELECT 0 AS candidate, id FROM services_new WHERE nocCode <=> :noc_code_0 LIMIT 1) UNION ALL (SELECT 1 AS candidate, id FROM services_new WHERE nocCode <=> :noc_code_1 LIMIT 1)"
+            )
+            == "(SELECT ? AS candidate, id FROM services_new WHERE nocCode <=> ? LIMIT ?) UNION ALL ..."
+        )
+
+
+class TestInstrumentedConnection:
+    def test_statements_are_summarised_by_fingerprint(self):
+        connection = InstrumentedConnection(SqliteConnection())
+
+        with connection.cursor() as cursor:
+            for line_name in ["1", "2"]:
+                cursor.execute(
+                    "INSERT INTO services_new (lineName, dataSource) VALUES (:line_name, 'bods')",
+                    {"line_name": line_name},
+                )
+            cursor.executemany(
+                "INSERT INTO tracks_new (operatorServiceId) VALUES (:operator_service_id)",
+                [{"operator_service_id": 1}, {"operator_service_id": 2}],
+            )
+            cursor.execute("SELECT id FROM services_new")
+            assert len(cursor.fetchall()) == 2
+        connection.commit()
+
+        summary = connection.pop_summary()
+        statements = {
+            statement["fingerprint"]: statement for statement in summary["statements"]
+        }
+
+        assert summary["calls"] == 5
+        assert summary["rows_sent"] == 4
+        assert (
+            statements[
+                "INSERT INTO services_new (lineName, dataSource) VALUES (?, 'bods')"
+            ]["calls"]
+            == 2
+        )
+        assert (
+            statements[
+                "INSERT INTO tracks_new (operatorServiceId) VALUES (?)"
+            ]["rows_sent"]
+            == 2
+        )
+        assert statements["SELECT id FROM services_new"]["rows_returned"] == 2
+        assert statements["COMMIT"]["calls"] == 1
+
+    def test_summary_is_reset_after_it_is_popped(self):
+        connection = InstrumentedConnection(SqliteConnection())
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM services_new")
+        connection.pop_summary()
+
+        assert connection.pop_summary() == {
+            "calls": 0,
+            "seconds": 0,
+            "rows_sent": 0,
+            "payload_bytes": 0,
+            "statements": [],
+        }
+
+    def test_lastrowid_is_passed_through(self):
+        connection = InstrumentedConnection(SqliteConnection())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO services_new (lineName, dataSource) VALUES ('1', 'bods')"
+            )
+
+            assert cursor.lastrowid == 1
+
+
+class TestTranslateNamedToPyformat:
+    def test_named_placeholders_become_pyformat(self):
+        assert (
+            translate_named_to_pyformat(
+                "SELECT id FROM services_new WHERE nocCode <=> :noc_code_0 AND id = :id"
+            )
+            == "SELECT id FROM services_new WHERE nocCode <=> %(noc_code_0)s AND id = %(id)s"
+        )
+
+    def test_literal_percent_is_escaped(self):
+        assert (
+            translate_named_to_pyformat("SELECT id FROM t WHERE a LIKE 'x%' AND b = :b")
+            == "SELECT id FROM t WHERE a LIKE 'x%%' AND b = %(b)s"
+        )
+
+
+def create_driver_connection():
+    driver_connection = MagicMock()
+    driver_connection.cursor.return_value.lastrowid = 7
+
+    return driver_connection
+
+
+class TestMysqlConnection:
+    def test_transaction_begins_with_the_first_cursor(self):
+        driver_connection = create_driver_connection()
+        connection = MysqlConnection(MysqlConnectionPool(lambda: driver_connection))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO tracks_new (longitude) VALUES (:longitude)",
+                {"longitude": "1"},
+            )
+            assert cursor.lastrowid == 7
+        with connection.cursor():
+            pass
+
+        driver_connection.begin.assert_called_once()
+        driver_connection.cursor.return_value.execute.assert_called_with(
+            "INSERT INTO tracks_new (longitude) VALUES (%(longitude)s)",
+            {"longitude": "1"},
+        )
+
+    def test_unparameterised_statements_are_given_params(self):
+        driver_connection = create_driver_connection()
+        connection = MysqlConnection(MysqlConnectionPool(lambda: driver_connection))
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM services_new WHERE filePath LIKE 'tnds/%'")
+
+        driver_connection.cursor.return_value.execute.assert_called_with(
+            "DELETE FROM services_new WHERE filePath LIKE 'tnds/%%'", {}
+        )
+
+    def test_commit_and_rollback_return_the_connection_to_the_pool(self):
+        driver_connections = [create_driver_connection(), create_driver_connection()]
+        connect_function = MagicMock(side_effect=driver_connections)
+        connection = MysqlConnection(MysqlConnectionPool(connect_function))
+
+        connection.cursor()
+        connection.commit()
+        connection.cursor()
+        connection.rollback()
+
+        assert connect_function.call_count == 1
+        driver_connections[0].commit.assert_called_once()
+        driver_connections[0].rollback.assert_called_once()
+        driver_connections[0].ping.assert_called_once_with(reconnect=True)
+        assert connection.pool.idle_connections == [driver_connections[0]]
+
+    def test_commit_without_a_transaction_does_nothing(self):
+        connect_function = MagicMock()
+        connection = MysqlConnection(MysqlConnectionPool(connect_function))
+
+        connection.commit()
+        connection.rollback()
+
+        connect_function.assert_not_called()
+
+    def test_connection_is_returned_to_the_pool_when_commit_fails(self):
+        driver_connection = create_driver_connection()
+        driver_connection.commit.side_effect = Exception("gone away")
+        connection = MysqlConnection(MysqlConnectionPool(lambda: driver_connection))
+
+        connection.cursor()
+        with pytest.raises(Exception, match="gone away"):
+            connection.commit()
+
+        assert connection.connection is None
+        assert connection.pool.idle_connections == [driver_connection]
+
+    def test_driver_errors_are_raised_as_aurora_data_api_errors(self):
+        driver_connection = create_driver_connection()
+        driver_connection.cursor.return_value.execute.side_effect = (
+            pymysql.err.IntegrityError(1452, NOC_INTEGRITY_ERROR_MSG)
+        )
+        connection = MysqlConnection(MysqlConnectionPool(lambda: driver_connection))
+
+        with pytest.raises(aurora_data_api.IntegrityError) as error:
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO services_new (nocCode) VALUES ('NONE')")
+
+        assert error.value.args == (1452, NOC_INTEGRITY_ERROR_MSG)
+        assert isinstance(error.value.__cause__, pymysql.err.IntegrityError)
+
+    def test_other_errors_are_raised_unchanged(self):
+        driver_connection = create_driver_connection()
+        driver_connection.cursor.return_value.execute.side_effect = KeyError("x")
+        connection = MysqlConnection(MysqlConnectionPool(lambda: driver_connection))
+
+        with pytest.raises(KeyError):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+    def test_invalid_noc_is_skipped_rather_than_failing_the_file(self):
+        driver_connection = create_driver_connection()
+        driver_cursor = driver_connection.cursor.return_value
+        driver_cursor.fetchall.return_value = []
+
+        def execute(query, params=None):
+            if query.startswith("INSERT INTO services_new"):
+                raise pymysql.err.IntegrityError(1452, NOC_INTEGRITY_ERROR_MSG)
+
+        driver_cursor.execute.side_effect = execute
+        connection = MysqlConnection(MysqlConnectionPool(lambda: driver_connection))
+
+        assert not write_to_database(
+            test_xml_helpers.generate_mock_data_dict(),
+            "WM",
+            "tnds",
+            "tnds/WM/test-key",
+            connection,
+            logger,
+            MagicMock(),
+        )
+        driver_connection.rollback.assert_called_once()
+
+    def test_pool_closes_connections_over_its_size(self):
+        driver_connections = [create_driver_connection(), create_driver_connection()]
+        pool = MysqlConnectionPool(
+            MagicMock(side_effect=driver_connections), max_size=1
+        )
+
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+
+        assert pool.idle_connections == [first]
+        second.close.assert_called_once()
+
+
+class TestMysqlConnectKwargs:
+    def test_credentials_and_host_come_from_the_secret(
+        self, aws_credentials, monkeypatch
+    ):
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+        with mock_secretsmanager():
+            secret_arn = boto3.client("secretsmanager").create_secret(
+                Name="ref-data-db",
+                SecretString=json.dumps(
+                    {
+                        "username": "admin",
+                        "password": "secret",
+                        "host": "cluster.eu-west-2.rds.amazonaws.com",
+                        "port": 3306,
+                    }
+                ),
+            )["ARN"]
+
+            connect_kwargs = get_mysql_connect_kwargs(
+                aurora_cluster_arn="cluster", database="ref_data", secret_arn=secret_arn
+            )
+
+        assert connect_kwargs["user"] == "admin"
+        assert connect_kwargs["password"] == "secret"
+        assert connect_kwargs["host"] == "cluster.eu-west-2.rds.amazonaws.com"
+        assert connect_kwargs["port"] == 3306
+        assert connect_kwargs["database"] == "ref_data"
+        assert connect_kwargs["autocommit"] is False
+
+    def test_given_settings_are_used_without_the_secret(self):
+        with patch("txc_connections.boto3.client") as client_patch:
+            connect_kwargs = get_mysql_connect_kwargs(
+                database="ref_data",
+                host="127.0.0.1",
+                port="3307",
+                user="root",
+                password="",
+            )
+
+        client_patch.assert_not_called()
+        assert (connect_kwargs["host"], connect_kwargs["port"]) == ("127.0.0.1", 3307)
+
+
+@pytest.mark.skipif(
+    not os.getenv("TEST_MYSQL_HOST"),
+    reason="needs a local MySQL compatible server, e.g. docker run -e MYSQL_ALLOW_EMPTY_PASSWORD=yes -e MYSQL_DATABASE=ref_data -p 3306:3306 mysql:8",
+)
+class TestMysqlStandIn:
+    def connect(self):
+        return connect(
+            DB_ENGINE_MYSQL,
+            database=os.getenv("TEST_MYSQL_DATABASE", "ref_data"),
+            host=os.getenv("TEST_MYSQL_HOST"),
+            port=os.getenv("TEST_MYSQL_PORT"),
+            user=os.getenv("TEST_MYSQL_USER", "root"),
+            password=os.getenv("TEST_MYSQL_PASSWORD", ""),
+        )
+
+    def test_rows_are_only_kept_when_committed(self):
+        connection = self.connect()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS txc_uploader_connection_test (id INT AUTO_INCREMENT PRIMARY KEY, name VARCHAR(20))"
+            )
+            cursor.execute("DELETE FROM txc_uploader_connection_test")
+        connection.commit()
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO txc_uploader_connection_test (name) VALUES (:name)",
+                [{"name": "a"}, {"name": "b"}],
+            )
+        connection.rollback()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO txc_uploader_connection_test (name) VALUES (:name)",
+                {"name": "c"},
+            )
+            assert cursor.lastrowid is not None
+        connection.commit()
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM txc_uploader_connection_test")
+            rows = cursor.fetchall()
+            cursor.execute("DROP TABLE txc_uploader_connection_test")
+        connection.commit()
+        connection.close()
+
+        assert [tuple(row) for row in rows] == [("c",)]
+
+
+class TestConnect:
+    def test_data_api_engine_uses_aurora_data_api(self):
+        with patch("txc_connections.aurora_data_api.connect") as connect_patch:
+            connect(
+                DB_ENGINE_DATA_API,
+                aurora_cluster_arn="cluster",
+                database="ref_data",
+                secret_arn="secret",
+            )
+
+        connect_patch.assert_called_once_with(
+            aurora_cluster_arn="cluster", database="ref_data", secret_arn="secret"
+        )
+
+    def test_sqlite_engine_creates_the_schema(self):
+        connection = connect(DB_ENGINE_SQLITE)
+
+        assert count_rows(connection, "services_new") == 0
+
+    def test_mysql_engine_uses_a_pooled_driver_connection(self):
+        with patch("pymysql.connect") as connect_patch:
+            connection = connect(
+                DB_ENGINE_MYSQL,
+                database="ref_data",
+                host="127.0.0.1",
+                user="root",
+                password="",
+                pool_size=3,
+            )
+            connection.cursor()
+
+        assert isinstance(connection, MysqlConnection)
+        assert connection.pool.max_size == 3
+        connect_patch.assert_called_once()
+        assert connect_patch.call_args.kwargs["host"] == "127.0.0.1"
+
+    def test_unknown_engine_is_rejected(self):
+        with pytest.raises(ValueError):
+            connect("postgres")
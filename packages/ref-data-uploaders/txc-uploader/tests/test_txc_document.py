@@ -0,0 +1,54 @@
+from txc_document import TxcDocument
+
+from tests.helpers import test_xml_helpers
+
+mock_tracks_data_dict = test_xml_helpers.generate_mock_txc_tracks_data_dict()
+
+
+class TestTxcDocument:
+    def test_sections_routes_and_links_are_indexed_by_id(self):
+        document = TxcDocument(mock_tracks_data_dict)
+        transxchange = mock_tracks_data_dict["TransXChange"]
+
+        assert len(document.journey_pattern_sections) == len(
+            transxchange["JourneyPatternSections"]["JourneyPatternSection"]
+        )
+        assert document.get_route("RT1") == transxchange["Routes"]["Route"][0]
+        assert document.get_route_section("RS1")["@id"] == "RS1"
+        assert document.get_route_link("RS1", "RL1")["@id"] == "RL1"
+
+    def test_missing_references_resolve_to_none(self):
+        document = TxcDocument(mock_tracks_data_dict)
+
+        assert document.get_journey_pattern_section("missing") is None
+        assert document.get_route("missing") is None
+        assert document.get_route_section("missing") is None
+        assert document.get_route_link("RS1", "missing") is None
+        assert document.get_route_link("missing", "RL1") is None
+
+    def test_first_item_is_kept_for_duplicate_ids(self):
+        document = TxcDocument(
+            {
+                "TransXChange": {
+                    "JourneyPatternSections": {
+                        "JourneyPatternSection": [
+                            {"@id": "JPS1", "JourneyPatternTimingLink": "first"},
+                            {"@id": "JPS1", "JourneyPatternTimingLink": "second"},
+                        ]
+                    }
+                }
+            }
+        )
+
+        assert (
+            document.get_journey_pattern_section("JPS1")["JourneyPatternTimingLink"]
+            == "first"
+        )
+
+    def test_document_without_sections_has_empty_indexes(self):
+        document = TxcDocument({"TransXChange": {"RouteSections": None}})
+
+        assert document.journey_pattern_sections == {}
+        assert document.route_sections == {}
+        assert document.route_links == {}
+        assert document.routes == {}
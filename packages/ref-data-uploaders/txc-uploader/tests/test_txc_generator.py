@@ -0,0 +1,68 @@
+import logging
+import zipfile
+from unittest.mock import MagicMock
+
+from benchmarks.txc_generator import generate_corpus, get_sizes, write_txc_file
+from txc_document import TxcDocument
+from txc_parser import parse_txc_file
+from txc_processor import get_operators, write_to_database
+
+from tests.helpers import test_db_helpers
+
+logger = logging.getLogger(__name__)
+
+sizes = get_sizes(
+    operators=2,
+    services_per_operator=3,
+    lines_per_service=2,
+    journey_patterns_per_service=2,
+    vehicle_journeys_per_line=5,
+    vehicle_journey_refs_per_line=1,
+)
+
+
+class TestTxcGenerator:
+    def test_generated_file_has_the_configured_counts(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        document = TxcDocument(data)
+
+        operators = get_operators(data, "bods", None)
+        services = [
+            service
+            for operator in operators
+            for service in document.get_services_for_operator(operator)
+        ]
+
+        assert len(operators) == 2
+        assert len(services) == 6
+        assert len(document.vehicle_journeys) == 6 * 2 * (5 + 1)
+        assert len(document.journey_pattern_sections) == 6 * 2 * 2
+        assert len(document.route_sections) == 6 * 2 * 2
+        assert document.inherited_line_refs
+
+    def test_generated_file_is_written_to_database(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        connection = test_db_helpers.FakeConnection()
+
+        assert write_to_database(
+            data, None, "bods", "bods/test.xml", connection, logger, MagicMock()
+        )
+
+        rows = connection.fake_cursor.rows
+        assert len(rows["services_new"]) == 2 * 3 * 2
+        assert len(rows["vehicle_journeys_new"]) == 2 * 3 * 2 * 5
+        assert len(rows["service_journey_patterns_new"]) == 2 * 3 * 2 * 2
+        assert rows["tracks_new"]
+        assert connection.commits == 1
+
+    def test_corpus_is_zipped_by_region_for_tnds(self, tmp_path):
+        (archive_path,) = generate_corpus(
+            str(tmp_path), sizes, files=2, archive="tnds", region="SW"
+        )
+
+        assert archive_path.endswith("/SW.zip")
+        with zipfile.ZipFile(archive_path) as archive_file:
+            assert archive_file.namelist() == [
+                "synthetic_0000.xml",
+                "synthetic_0001.xml",
+            ]
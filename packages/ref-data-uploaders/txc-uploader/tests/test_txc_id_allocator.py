@@ -0,0 +1,137 @@
+import logging
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from txc_connections import InstrumentedConnection, SqliteConnection
+from txc_id_allocator import IdAllocator
+from txc_processor import write_to_database
+
+from tests.helpers import test_xml_helpers
+from tests.helpers.test_db_helpers import get_table_rows
+
+logger = logging.getLogger(__name__)
+
+
+class TestIdAllocator:
+    def test_first_block_starts_after_the_existing_ids(self):
+        connection = SqliteConnection()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO service_journey_patterns_new (id, operatorServiceId) VALUES (41, 1)"
+            )
+        connection.commit()
+
+        id_allocator = IdAllocator(connection, block_size=3)
+
+        assert [
+            id_allocator.allocate("service_journey_patterns_new") for _ in range(4)
+        ] == [42, 43, 44, 45]
+        assert get_table_rows(connection, "txc_id_sequences") == [
+            ("service_journey_patterns_new", 48)
+        ]
+
+    def test_allocators_sharing_a_sequence_never_hand_out_the_same_id(self):
+        connection = SqliteConnection()
+        id_allocators = [IdAllocator(connection, block_size=2) for _ in range(3)]
+
+        ids = [
+            id_allocator.allocate("services_new")
+            for _ in range(5)
+            for id_allocator in id_allocators
+        ]
+
+        assert len(set(ids)) == len(ids)
+
+    def test_discarded_ids_are_not_handed_out(self):
+        id_allocator = IdAllocator(SqliteConnection(), block_size=10)
+
+        assert id_allocator.allocate("services_new") == 1
+        id_allocator.discard_reserved_ids()
+
+        assert id_allocator.allocate("services_new") == 11
+
+    def test_reservation_is_rolled_back_when_it_fails(self):
+        connection = MagicMock()
+        connection.cursor.return_value.__enter__.return_value.execute.side_effect = (
+            Exception("failed")
+        )
+
+        with pytest.raises(Exception, match="failed"):
+            IdAllocator(connection).allocate("services_new")
+
+        connection.rollback.assert_called_once()
+        connection.commit.assert_not_called()
+
+
+class TestIdAllocatorIngest:
+    def test_journey_patterns_are_written_in_batches_with_the_same_rows(self):
+        tables = ["service_journey_patterns_new", "service_journey_pattern_links_new"]
+        rows_by_mode = []
+        statement_calls_by_mode = []
+
+        for id_allocator in [None, IdAllocator(SqliteConnection())]:
+            connection = InstrumentedConnection(SqliteConnection())
+            assert write_to_database(
+                test_xml_helpers.generate_mock_data_dict(),
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                connection,
+                logger,
+                MagicMock(),
+                id_allocator=id_allocator,
+            )
+            statement_calls_by_mode.append(
+                sum(
+                    statement["calls"]
+                    for statement in connection.pop_summary()["statements"]
+                    if "INTO service_journey_pattern" in statement["fingerprint"]
+                )
+            )
+            rows_by_mode.append(
+                {table: get_table_rows(connection, table) for table in tables}
+            )
+
+        assert len(rows_by_mode[0]["service_journey_patterns_new"]) == 4
+        assert rows_by_mode[1] == rows_by_mode[0]
+        assert statement_calls_by_mode == [8, 2]
+
+    def write(self, connection, id_allocator, key, content_hash=None):
+        return write_to_database(
+            test_xml_helpers.generate_mock_data_dict(),
+            "WM",
+            "tnds",
+            key,
+            connection,
+            logger,
+            MagicMock(),
+            id_allocator=id_allocator,
+            content_hash=content_hash,
+        )
+
+    def test_block_is_kept_for_the_next_file(self):
+        connection = SqliteConnection()
+        id_allocator = IdAllocator(SqliteConnection())
+
+        with patch.object(
+            id_allocator, "reserve_block", wraps=id_allocator.reserve_block
+        ) as reserve_patch:
+            assert self.write(connection, id_allocator, "tnds/WM/a.xml")
+            assert self.write(connection, id_allocator, "tnds/WM/b.xml")
+
+        reserve_patch.assert_called_once_with("service_journey_patterns_new")
+        assert get_table_rows(id_allocator.connection, "txc_id_sequences") == [
+            ("service_journey_patterns_new", 1001)
+        ]
+
+    def test_block_is_discarded_when_a_file_is_rolled_back(self):
+        id_allocator = IdAllocator(SqliteConnection())
+
+        with patch(
+            "txc_processor.record_ingested_content", side_effect=Exception("failed")
+        ):
+            with pytest.raises(Exception, match="failed"):
+                self.write(SqliteConnection(), id_allocator, "tnds/WM/a.xml", "hash")
+
+        assert id_allocator.blocks == {}
@@ -0,0 +1,272 @@
+import copy
+import logging
+from unittest.mock import MagicMock
+
+from benchmarks.txc_generator import get_sizes, write_txc_file
+from txc_connections import InstrumentedConnection, SqliteConnection
+from txc_document import TxcDocument
+from txc_parser import parse_txc_file
+from txc_processor import get_operators, write_to_database
+
+from tests.helpers import test_xml_helpers
+from tests.helpers.test_db_helpers import count_rows
+
+logger = logging.getLogger(__name__)
+
+sizes = get_sizes(
+    services_per_operator=3,
+    lines_per_service=1,
+    journey_patterns_per_service=2,
+    vehicle_journeys_per_line=4,
+    vehicle_journey_refs_per_line=0,
+)
+key = "bods/test.xml"
+service_tables = [
+    "services_new",
+    "service_journey_patterns_new",
+    "service_journey_pattern_links_new",
+    "vehicle_journeys_new",
+    "tracks_new",
+    "service_admin_area_codes_new",
+    "service_file_fingerprints_new",
+]
+
+
+def get_counts(connection: SqliteConnection) -> dict:
+    return {table: count_rows(connection, table) for table in service_tables}
+
+
+def get_fingerprints(connection: SqliteConnection) -> dict:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT serviceCode, fingerprint FROM services_new")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def ingest(
+    data: dict, connection, incremental: bool = True, file_path: str = key
+) -> bool:
+    return write_to_database(
+        copy.deepcopy(data),
+        None,
+        "bods",
+        file_path,
+        connection,
+        logger,
+        MagicMock(),
+        incremental=incremental,
+    )
+
+
+def change_first_departure_time(data: dict, departure_time: str = "23:59:00") -> str:
+    vehicle_journey = data["TransXChange"]["VehicleJourneys"]["VehicleJourney"][0]
+    vehicle_journey["DepartureTime"] = departure_time
+
+    return vehicle_journey["ServiceRef"]
+
+
+class TestServiceFingerprint:
+    def test_fingerprint_changes_with_the_service_data(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        changed_data = copy.deepcopy(data)
+        changed_service_code = change_first_departure_time(changed_data)
+
+        def get_service_fingerprints(data: dict) -> dict:
+            document = TxcDocument(data)
+            return {
+                service["ServiceCode"]: document.get_service_fingerprint(
+                    operator, service
+                )
+                for operator in get_operators(data, "bods", None)
+                for service in document.get_services_for_operator(operator)
+            }
+
+        fingerprints = get_service_fingerprints(data)
+        changed_fingerprints = get_service_fingerprints(changed_data)
+
+        assert len(set(fingerprints.values())) == 3
+        assert get_service_fingerprints(copy.deepcopy(data)) == fingerprints
+        assert {
+            service_code
+            for service_code in fingerprints
+            if changed_fingerprints[service_code] != fingerprints[service_code]
+        } == {changed_service_code}
+
+
+class TestIncrementalIngest:
+    def test_unchanged_services_are_skipped(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        connection = InstrumentedConnection(SqliteConnection())
+
+        assert ingest(data, connection)
+        first_summary = connection.pop_summary()
+        vehicle_journeys = count_rows(connection.connection, "vehicle_journeys_new")
+        fingerprints = get_fingerprints(connection.connection)
+
+        assert ingest(data, connection)
+        second_summary = connection.pop_summary()
+
+        assert vehicle_journeys == 3 * 4
+        assert all(fingerprints.values())
+        assert count_rows(connection.connection, "services_new") == 3
+        assert count_rows(connection.connection, "vehicle_journeys_new") == 12
+        assert get_fingerprints(connection.connection) == fingerprints
+        assert second_summary["calls"] < first_summary["calls"] / 2
+        assert not [
+            statement
+            for statement in second_summary["statements"]
+            if statement["fingerprint"].startswith(("INSERT", "UPDATE"))
+        ]
+
+    def test_changed_service_is_written_again(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        connection = SqliteConnection()
+        assert ingest(data, connection)
+        counts = get_counts(connection)
+        fingerprints = get_fingerprints(connection)
+
+        changed_service_code = change_first_departure_time(data)
+        assert ingest(data, connection)
+        changed_fingerprints = get_fingerprints(connection)
+
+        assert counts["vehicle_journeys_new"] == 12
+        assert counts["service_journey_pattern_links_new"]
+        assert counts["tracks_new"]
+        assert get_counts(connection) == counts
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM vehicle_journeys_new WHERE departureTime = '23:59:00'"
+            )
+            assert cursor.fetchone()[0] == 1
+
+        assert {
+            service_code
+            for service_code in fingerprints
+            if changed_fingerprints[service_code] != fingerprints[service_code]
+        } == {changed_service_code}
+
+    def test_services_removed_from_the_file_are_deleted(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        connection = SqliteConnection()
+        assert ingest(data, connection)
+
+        services = data["TransXChange"]["Services"]["Service"]
+        removed_service_code = services.pop()["ServiceCode"]
+        assert ingest(data, connection)
+
+        fresh_connection = SqliteConnection()
+        assert ingest(data, fresh_connection)
+
+        assert removed_service_code not in get_fingerprints(connection)
+        assert get_counts(connection) == get_counts(fresh_connection)
+
+    def test_rows_written_before_incremental_ingest_are_replaced(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        connection = SqliteConnection()
+        assert ingest(data, connection, incremental=False)
+        counts = get_counts(connection)
+
+        assert ingest(data, connection)
+
+        assert get_counts(connection) == counts
+        assert all(get_fingerprints(connection).values())
+
+    def test_services_sharing_a_line_are_not_written_twice(self):
+        data = test_xml_helpers.generate_mock_data_dict()
+        service = data["TransXChange"]["Services"]["Service"]
+        shared_line_service = copy.deepcopy(service)
+        shared_line_service["Description"] = "Same line, different service data"
+        data["TransXChange"]["Services"]["Service"] = [service, shared_line_service]
+        connection = SqliteConnection()
+
+        assert ingest(data, connection)
+        counts = get_counts(connection)
+        assert ingest(data, connection)
+
+        assert counts["services_new"] == 1
+        assert get_counts(connection) == counts
+        assert set(get_fingerprints(connection).values()) == {None}
+
+    def test_fingerprints_are_not_written_without_incremental(self, tmp_path):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        connection = SqliteConnection()
+
+        assert ingest(data, connection, incremental=False)
+        assert ingest(data, connection, incremental=False)
+
+        assert set(get_fingerprints(connection).values()) == {None}
+        assert count_rows(connection, "services_new") == 3
+
+
+class TestIncrementalIngestAcrossFiles:
+    """
+    Files with services of the same line key write their rows under the one service
+    row, inserted by whichever file was ingested first.
+    """
+
+    other_key = "bods/other.xml"
+
+    def get_departure_time_count(self, connection, departure_time: str) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM vehicle_journeys_new WHERE departureTime = :time",
+                {"time": departure_time},
+            )
+            return cursor.fetchone()[0]
+
+    def ingest_both(self, tmp_path, other_incremental: bool = True):
+        data = parse_txc_file(write_txc_file(f"{tmp_path}/test.xml", sizes))
+        other_data = copy.deepcopy(data)
+        change_first_departure_time(other_data, "05:55:00")
+        connection = SqliteConnection()
+
+        assert ingest(
+            other_data, connection, other_incremental, file_path=self.other_key
+        )
+        assert ingest(data, connection)
+
+        return data, other_data, connection
+
+    def test_unchanged_file_sharing_services_is_not_written_again(self, tmp_path):
+        data, _, connection = self.ingest_both(tmp_path)
+        counts = get_counts(connection)
+
+        for _ in range(3):
+            assert ingest(data, connection)
+
+        assert counts["services_new"] == 3
+        assert counts["vehicle_journeys_new"] == 24
+        assert get_counts(connection) == counts
+
+    def test_changed_file_does_not_delete_rows_of_another_file(self, tmp_path):
+        data, _, connection = self.ingest_both(tmp_path)
+        counts = get_counts(connection)
+
+        change_first_departure_time(data)
+        assert ingest(data, connection)
+
+        assert self.get_departure_time_count(connection, "05:55:00") == 1
+        assert get_counts(connection) == counts
+
+    def test_changed_file_keeps_services_another_file_wrote_to(self, tmp_path):
+        _, other_data, connection = self.ingest_both(tmp_path)
+        counts = get_counts(connection)
+
+        change_first_departure_time(other_data, "06:06:00")
+        assert ingest(other_data, connection, file_path=self.other_key)
+        assert ingest(other_data, connection, file_path=self.other_key)
+
+        assert self.get_departure_time_count(connection, "05:55:00") == 1
+        assert get_counts(connection) == counts
+
+    def test_rows_written_into_another_files_services_are_recorded(self, tmp_path):
+        _, other_data, connection = self.ingest_both(
+            tmp_path, other_incremental=False
+        )
+        counts = get_counts(connection)
+
+        assert ingest(other_data, connection, file_path=self.other_key)
+
+        assert counts["service_file_fingerprints_new"] == 3
+        assert self.get_departure_time_count(connection, "05:55:00") == 1
+        assert get_counts(connection) == counts
@@ -0,0 +1,118 @@
+import logging
+import os
+from unittest.mock import MagicMock, patch
+
+import txc_processor
+from txc_connections import SqliteConnection
+from txc_processor import download_from_s3_and_write_to_db
+
+from tests.helpers.test_db_helpers import count_rows, create_bucket
+
+logger = logging.getLogger(__name__)
+
+mock_file_path = (
+    os.path.dirname(os.path.realpath(__file__)) + "/helpers/test_data/mock_txc.xml"
+)
+bucket = "test-bucket"
+
+
+class TestIngestLedger:
+    def ingest(self, s3, connection, key, tmp_path, cloudwatch=None):
+        cloudwatch = cloudwatch or MagicMock()
+        with patch(
+            "txc_processor.parse_txc_file", wraps=txc_processor.parse_txc_file
+        ) as parse_patch:
+            download_from_s3_and_write_to_db(
+                s3,
+                cloudwatch,
+                bucket,
+                key,
+                f"{tmp_path}/{os.path.basename(key)}",
+                connection,
+                logger,
+                use_ingest_ledger=True,
+            )
+
+        return parse_patch.call_count
+
+    def test_file_with_ingested_content_is_skipped(self, s3, tmp_path):
+        with open(mock_file_path, "rb") as mock_file:
+            create_bucket(s3, bucket, {"tnds/WM/a.xml": mock_file.read()})
+        connection = SqliteConnection()
+        cloudwatch = MagicMock()
+
+        assert self.ingest(s3, connection, "tnds/WM/a.xml", tmp_path) == 1
+        vehicle_journeys = count_rows(connection, "vehicle_journeys_new")
+        os.remove(f"{tmp_path}/a.xml")
+        assert self.ingest(s3, connection, "tnds/WM/a.xml", tmp_path, cloudwatch) == 0
+
+        assert count_rows(connection, "vehicle_journeys_new") == vehicle_journeys
+        assert count_rows(connection, "txc_ingest_ledger_new") == 1
+        assert not os.path.exists(f"{tmp_path}/a.xml")
+        metric = cloudwatch.put_metric_data.call_args.kwargs["MetricData"][0]
+        assert metric["MetricName"] == "UnchangedFileSkipped"
+        assert metric["Dimensions"][0]["Value"] == "tnds"
+
+    def test_same_content_at_another_path_is_ingested(self, s3, tmp_path):
+        with open(mock_file_path, "rb") as mock_file:
+            body = mock_file.read()
+        create_bucket(s3, bucket, {"tnds/WM/a.xml": body, "tnds/SE/b.xml": body})
+        connection = SqliteConnection()
+
+        assert self.ingest(s3, connection, "tnds/WM/a.xml", tmp_path) == 1
+        assert self.ingest(s3, connection, "tnds/SE/b.xml", tmp_path) == 1
+
+        # the services are shared with the first file, so the second path's rows are
+        # its contributions to them
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM service_file_fingerprints_new WHERE filePath = ?",
+                ("tnds/SE/b.xml",),
+            )
+            assert cursor.fetchone()[0] == count_rows(connection, "services_new")
+        assert count_rows(connection, "txc_ingest_ledger_new") == 2
+
+    def test_same_content_from_another_data_source_is_ingested(self, s3, tmp_path):
+        with open(mock_file_path, "rb") as mock_file:
+            body = mock_file.read()
+        create_bucket(s3, bucket, {"tnds/WM/a.xml": body, "bods/a.xml": body})
+        connection = SqliteConnection()
+
+        assert self.ingest(s3, connection, "tnds/WM/a.xml", tmp_path) == 1
+        assert self.ingest(s3, connection, "bods/a.xml", tmp_path) == 1
+
+        assert count_rows(connection, "txc_ingest_ledger_new") == 2
+
+    def test_content_is_not_recorded_when_nothing_is_written(self, s3, tmp_path):
+        create_bucket(
+            s3,
+            bucket,
+            {"bods/empty.xml": b"<TransXChange><Operators /></TransXChange>"},
+        )
+        connection = SqliteConnection()
+
+        assert self.ingest(s3, connection, "bods/empty.xml", tmp_path) == 1
+        assert self.ingest(s3, connection, "bods/empty.xml", tmp_path) == 1
+
+        assert count_rows(connection, "txc_ingest_ledger_new") == 0
+
+    def test_lookup_transaction_is_ended_before_the_file_is_written(
+        self, s3, tmp_path
+    ):
+        with open(mock_file_path, "rb") as mock_file:
+            create_bucket(s3, bucket, {"tnds/WM/a.xml": mock_file.read()})
+        connection = SqliteConnection()
+        download_file = s3.download_file
+        rollbacks_before_download = []
+
+        def download_after_rollback(*args):
+            rollbacks_before_download.append(connection.rollback.call_count)
+            return download_file(*args)
+
+        with patch.object(
+            connection, "rollback", wraps=connection.rollback
+        ), patch.object(s3, "download_file", side_effect=download_after_rollback):
+            assert self.ingest(s3, connection, "tnds/WM/a.xml", tmp_path) == 1
+
+        assert rollbacks_before_download == [1]
+        assert count_rows(connection, "txc_ingest_ledger_new") == 1
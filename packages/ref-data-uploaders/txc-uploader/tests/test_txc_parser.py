@@ -0,0 +1,32 @@
+import pytest
+
+from txc_parser import parse_txc, parse_txc_file
+
+from tests.helpers import test_xml_helpers
+
+fixture_files = test_xml_helpers.fixture_files
+
+
+class TestTxcParser:
+    def test_fixture_files_are_found(self):
+        assert len(fixture_files) == 6
+
+    @pytest.mark.parametrize("file_path", fixture_files)
+    def test_single_pass_parse_matches_legacy_parse(self, file_path):
+        assert parse_txc_file(
+            file_path
+        ) == test_xml_helpers.generate_legacy_data_dict(file_path)
+
+    def test_namespace_is_stripped_from_elements(self):
+        data = parse_txc(
+            b'<TransXChange xmlns="http://www.transxchange.org.uk/" SchemaVersion="2.4"><Operators><Operator id="O1"><NationalOperatorCode>ABC</NationalOperatorCode></Operator></Operators></TransXChange>'
+        )
+
+        assert data == {
+            "TransXChange": {
+                "@SchemaVersion": "2.4",
+                "Operators": {
+                    "Operator": {"@id": "O1", "NationalOperatorCode": "ABC"}
+                },
+            }
+        }
@@ -1,11 +1,26 @@
+import copy
 import os
+
+import pytest
 from unittest.mock import ANY, patch, MagicMock
 from aurora_data_api import AuroraDataAPICursor
 
 import boto3
 
+from benchmarks.txc_generator import get_sizes, write_txc_file
+from txc_cache import NocCache
+from txc_connections import SqliteConnection
+from txc_document import TxcDocument
+from txc_parser import parse_txc_file, parse_txc_reference_sections
+import txc_processor
 from txc_processor import (
+    JourneyPatternRegistry,
+    StreamedVehicleJourneys,
     download_from_s3_and_write_to_db,
+    write_to_database,
+    get_existing_txc_line_ids,
+    get_txc_line_key,
+    normalise_collated_key,
     extract_data_for_txc_operator_service_table,
     collect_journey_pattern_section_refs_and_info,
     collect_journey_patterns,
@@ -19,7 +34,7 @@ from txc_processor import (
     select_route_and_run_insert_query,
 )
 
-from tests.helpers import test_xml_helpers
+from tests.helpers import test_db_helpers, test_xml_helpers
 from tests.helpers.test_data import test_data
 
 
@@ -28,6 +43,10 @@ mock_data_dict = test_xml_helpers.generate_mock_data_dict()
 mock_non_bus_dict = test_xml_helpers.generate_mock_ferry_txc_data_dict()
 mock_invalid_data_dict = test_xml_helpers.generate_mock_invalid_data_dict()
 mock_tracks_data_dict = test_xml_helpers.generate_mock_txc_tracks_data_dict()
+mock_document = TxcDocument(mock_data_dict)
+mock_non_bus_document = TxcDocument(mock_non_bus_dict)
+mock_invalid_document = TxcDocument(mock_invalid_data_dict)
+mock_tracks_document = TxcDocument(mock_tracks_data_dict)
 
 
 class TestLineIdGeneration:
@@ -37,21 +56,305 @@ class TestLineIdGeneration:
 
 class TestNonBusFileHasUsableData:
     def test_non_bus_file_with_valid_data_is_usable(self):
-        data = mock_non_bus_dict
         service = mock_non_bus_dict["TransXChange"]["Services"]["Service"]
-        assert check_file_has_usable_data(data, service) == True
+        assert check_file_has_usable_data(mock_non_bus_document, service) == True
 
 
 class TestFileHasUsableData:
     def test_file_with_valid_data_is_usable(self):
-        data = mock_data_dict
         service = mock_data_dict["TransXChange"]["Services"]["Service"]
-        assert check_file_has_usable_data(data, service) == True
+        assert check_file_has_usable_data(mock_document, service) == True
 
     def test_file_with_invalid_data_is_not_usable(self):
-        data = mock_invalid_data_dict
         service = mock_invalid_data_dict["TransXChange"]["Services"]["Service"]
-        assert check_file_has_usable_data(data, service) == False
+        assert check_file_has_usable_data(mock_invalid_document, service) == False
+
+
+def legacy_vehicle_journeys_for_line(vehicle_journeys: list, line_id: str):
+    vehicle_journey_refs = [
+        journey["VehicleJourneyRef"]
+        for journey in vehicle_journeys
+        if journey["LineRef"] == line_id
+        and "JourneyPatternRef" not in journey
+        and "VehicleJourneyRef" in journey
+    ]
+    return [
+        journey
+        for journey in vehicle_journeys
+        if "JourneyPatternRef" in journey
+        and (
+            journey.get("LineRef") == line_id
+            or journey.get("VehicleJourneyCode") in vehicle_journey_refs
+        )
+    ]
+
+
+class TestVehicleJourneyGrouping:
+    def test_grouped_vehicle_journeys_match_per_line_scan(self):
+        for file_path in test_xml_helpers.fixture_files:
+            data = parse_txc_file(file_path)
+            document = TxcDocument(data)
+            vehicle_journeys = make_list(
+                data["TransXChange"]["VehicleJourneys"]["VehicleJourney"]
+            )
+            line_ids = {journey["LineRef"] for journey in vehicle_journeys}
+
+            for line_id in line_ids:
+                expected_vehicle_journeys = legacy_vehicle_journeys_for_line(
+                    vehicle_journeys, line_id
+                )
+                vehicle_journeys_for_line, journey_pattern_to_use = (
+                    format_vehicle_journeys(document, line_id)
+                )
+
+                assert vehicle_journeys_for_line == [
+                    collect_vehicle_journey(journey)
+                    for journey in expected_vehicle_journeys
+                ]
+                assert journey_pattern_to_use == max(
+                    journey["JourneyPatternRef"]
+                    for journey in expected_vehicle_journeys
+                )
+
+    def test_vehicle_journey_refs_add_referenced_journeys_to_line(self):
+        document = TxcDocument(
+            {
+                "TransXChange": {
+                    "VehicleJourneys": {
+                        "VehicleJourney": [
+                            {
+                                "VehicleJourneyCode": "VJ1",
+                                "LineRef": "L1",
+                                "JourneyPatternRef": "JP1",
+                            },
+                            {
+                                "VehicleJourneyCode": "VJ2",
+                                "LineRef": "L2",
+                                "VehicleJourneyRef": "VJ1",
+                            },
+                            {
+                                "VehicleJourneyCode": "VJ3",
+                                "LineRef": "L2",
+                                "VehicleJourneyRef": "VJ1",
+                            },
+                        ]
+                    }
+                }
+            }
+        )
+
+        assert [
+            journey["VehicleJourneyCode"]
+            for journey in document.get_vehicle_journeys_for_line("L1")
+        ] == ["VJ1"]
+        assert [
+            journey["VehicleJourneyCode"]
+            for journey in document.get_vehicle_journeys_for_line("L2")
+        ] == ["VJ1"]
+        assert document.get_vehicle_journeys_for_line("L3") == []
+
+    def test_services_are_grouped_by_operator(self):
+        service = mock_data_dict["TransXChange"]["Services"]["Service"]
+        operator = mock_data_dict["TransXChange"]["Operators"]["Operator"]
+
+        assert mock_document.get_services_for_operator(operator) == [service]
+        assert mock_document.get_services_for_operator({"@id": "missing"}) == []
+
+
+class TestJourneyPatternMemoisation:
+    @pytest.mark.parametrize("line_count", [1, 3, 10])
+    def test_journey_patterns_are_collected_once_per_service(self, line_count):
+        data = copy.deepcopy(mock_data_dict)
+        service = data["TransXChange"]["Services"]["Service"]
+        line = service["Lines"]["Line"]
+        service["Lines"]["Line"] = [line] + [
+            {**line, "@id": f"{line['@id']}_{i}"} for i in range(1, line_count)
+        ]
+
+        with patch(
+            "txc_processor.collect_journey_patterns",
+            wraps=txc_processor.collect_journey_patterns,
+        ) as collect_patch:
+            write_to_database(
+                data,
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                test_db_helpers.FakeConnection(),
+                logger,
+                MagicMock(),
+            )
+
+        assert collect_patch.call_count == 1
+
+    def test_usable_data_verdict_is_reused_for_a_service(self):
+        document = TxcDocument(mock_data_dict)
+        service = mock_data_dict["TransXChange"]["Services"]["Service"]
+
+        assert check_file_has_usable_data(document, service) == True
+
+        document.journey_patterns_by_service.clear()
+        with patch("txc_processor.collect_journey_patterns") as collect_patch:
+            assert check_file_has_usable_data(document, service) == True
+
+        collect_patch.assert_not_called()
+
+
+class TestServiceExistenceLookup:
+    def test_line_keys_are_resolved_in_batches(self):
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = []
+        line_keys = [
+            ("ANWE", f"line{i}", "NW_01_ANW_4_1", "2018-01-28", None, "tnds")
+            for i in range(120)
+        ]
+
+        get_existing_txc_line_ids(mock_cursor, line_keys + line_keys[:10], logger)
+
+        assert mock_cursor.execute.call_count == 3
+        first_query, first_params = mock_cursor.execute.call_args_list[0].args
+        assert first_query.count("UNION ALL") == 49
+        assert len(first_params) == 50 * 6
+        assert first_params["line_name_49"] == "line49"
+
+    def test_existing_ids_are_mapped_to_their_line_keys(self):
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [(1, 77)]
+        line_keys = [
+            ("ANWE", "4", "NW_01_ANW_4_1", "2018-01-28", "2099-12-31", "tnds"),
+            ("ANWE", "5", "NW_01_ANW_4_1", "2018-01-28", "2099-12-31", "tnds"),
+        ]
+
+        existing_line_ids = get_existing_txc_line_ids(mock_cursor, line_keys, logger)
+
+        assert existing_line_ids == {normalise_collated_key(line_keys[1]): 77}
+
+    def test_no_queries_are_sent_without_line_keys(self):
+        mock_cursor = MagicMock()
+
+        assert get_existing_txc_line_ids(mock_cursor, [], logger) == {}
+        mock_cursor.execute.assert_not_called()
+
+    def test_existing_service_is_reused(self):
+        operator = mock_data_dict["TransXChange"]["Operators"]["Operator"]
+        service = mock_data_dict["TransXChange"]["Services"]["Service"]
+        line_key = get_txc_line_key(operator, service, service["Lines"]["Line"], "tnds")
+        connection = test_db_helpers.FakeConnection()
+
+        with patch(
+            "txc_processor.get_existing_txc_line_ids",
+            return_value={normalise_collated_key(line_key): 99},
+        ):
+            write_to_database(
+                mock_data_dict,
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                connection,
+                logger,
+                MagicMock(),
+            )
+
+        rows = connection.fake_cursor.rows
+        assert "services_new" not in rows
+        assert {row["operator_service_id"] for row in rows["vehicle_journeys_new"]} == {
+            99
+        }
+
+    def test_duplicate_lines_in_a_file_are_inserted_once(self):
+        data = copy.deepcopy(mock_data_dict)
+        service = data["TransXChange"]["Services"]["Service"]
+        data["TransXChange"]["Services"]["Service"] = [service, copy.deepcopy(service)]
+        connection = test_db_helpers.FakeConnection()
+
+        write_to_database(
+            data,
+            "WM",
+            "tnds",
+            "tnds/WM/test-key",
+            connection,
+            logger,
+            MagicMock(),
+        )
+
+        assert len(connection.fake_cursor.rows["services_new"]) == 1
+        assert connection.fake_cursor.statements[0].startswith("(SELECT 0 AS candidate")
+
+
+class TestJourneyPatternRegistry:
+    def test_new_services_are_checked_without_querying(self):
+        connection = test_db_helpers.FakeConnection()
+
+        write_to_database(
+            mock_data_dict,
+            "WM",
+            "tnds",
+            "tnds/WM/test-key",
+            connection,
+            logger,
+            MagicMock(),
+        )
+
+        statements = connection.fake_cursor.statements
+        assert not any(
+            statement.startswith("SELECT") and "service_journey_patterns_new" in statement
+            for statement in statements
+        )
+        assert len(connection.fake_cursor.rows["service_journey_patterns_new"]) == 4
+
+    def test_existing_service_signatures_are_loaded_once(self):
+        operator = mock_data_dict["TransXChange"]["Operators"]["Operator"]
+        service = mock_data_dict["TransXChange"]["Services"]["Service"]
+        line_key = get_txc_line_key(operator, service, service["Lines"]["Line"], "tnds")
+        connection = test_db_helpers.FakeConnection()
+
+        with patch(
+            "txc_processor.get_existing_txc_line_ids",
+            return_value={normalise_collated_key(line_key): 99},
+        ):
+            write_to_database(
+                mock_data_dict,
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                connection,
+                logger,
+                MagicMock(),
+            )
+
+        signature_queries = [
+            statement
+            for statement in connection.fake_cursor.statements
+            if statement.startswith("SELECT") and "service_journey_patterns_new" in statement
+        ]
+        assert len(signature_queries) == 1
+
+    def test_existing_signatures_are_matched_like_the_database(self):
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            ("Macclesfield ", "outbound", None, "JPS1JPS2")
+        ]
+        registry = JourneyPatternRegistry()
+
+        assert registry.journey_pattern_exists(
+            mock_cursor, 5, ("macclesfield", "outbound", None, "JPS1JPS2")
+        )
+        assert not registry.journey_pattern_exists(
+            mock_cursor, 5, ("macclesfield", "inbound", None, "JPS1JPS2")
+        )
+        assert mock_cursor.execute.call_count == 1
+
+    def test_inserted_journey_patterns_are_registered(self):
+        mock_cursor = MagicMock()
+        registry = JourneyPatternRegistry()
+        registry.add_service(5)
+
+        registry.add_journey_pattern(mock_cursor, 5, (None, "inbound", "RT1", "JPS1"))
+
+        assert registry.journey_pattern_exists(
+            mock_cursor, 5, (None, "inbound", "RT1", "JPS1")
+        )
+        mock_cursor.execute.assert_not_called()
 
 
 class TestDatabaseInsertQuerying:
@@ -61,18 +364,15 @@ class TestDatabaseInsertQuerying:
         self, mock_jp_insert, mock_jpl_insert
     ):
         service = mock_data_dict["TransXChange"]["Services"]["Service"]
-        mock_journey_patterns = collect_journey_patterns(mock_data_dict, service)
-        vehicle_journeys, _ = format_vehicle_journeys(
-            mock_data_dict["TransXChange"]["VehicleJourneys"]["VehicleJourney"],
-            "l_4_ANW",
-        )
+        mock_journey_patterns = collect_journey_patterns(mock_document, service)
+        vehicle_journeys, _ = format_vehicle_journeys(mock_document, "l_4_ANW")
         mock_jp_insert.side_effect = [9, 27, 13, 1, 11, 5, 28, 12, 10, 6, 13, 27, 4]
         mock_cursor = MagicMock()
         mock_op_service_id = 12
 
         iterate_through_journey_patterns_and_run_insert_queries(
             mock_cursor,
-            mock_data_dict,
+            mock_document,
             mock_op_service_id,
             service,
             vehicle_journeys,
@@ -143,7 +443,7 @@ class TestDataCollectionFunctionality:
     def test_collect_journey_patterns(self):
         service = mock_data_dict["TransXChange"]["Services"]["Service"]
         assert (
-            collect_journey_patterns(mock_data_dict, service)
+            collect_journey_patterns(mock_document, service)
             == test_data.expected_list_of_journey_patterns
         )
 
@@ -163,13 +463,10 @@ class TestDataCollectionFunctionality:
         service = mock_tracks_data_dict["TransXChange"]["Services"]["Service"]
         mock_cursor = MagicMock()
         mock_op_service_id = 12
-        vehicle_journeys, _ = format_vehicle_journeys(
-            mock_data_dict["TransXChange"]["VehicleJourneys"]["VehicleJourney"],
-            "l_4_ANW",
-        )
+        vehicle_journeys, _ = format_vehicle_journeys(mock_document, "l_4_ANW")
         route_ref, link_refs = iterate_through_journey_patterns_and_run_insert_queries(
             mock_cursor,
-            mock_tracks_data_dict,
+            mock_tracks_document,
             mock_op_service_id,
             service,
             vehicle_journeys,
@@ -202,7 +499,7 @@ class TestDataCollectionFunctionality:
         mock_op_service_id = 12
         select_route_and_run_insert_query(
             mock_cursor,
-            mock_tracks_data_dict,
+            mock_tracks_document,
             mock_op_service_id,
             "RT1",
             [
@@ -226,6 +523,8 @@ class TestDataCollectionFunctionality:
             mock_cursor,
             test_data.expected_tracks_data_multiple_sections,
             mock_op_service_id,
+            None,
+            None,
         )
 
     @patch("txc_processor.insert_into_txc_tracks_table")
@@ -236,7 +535,7 @@ class TestDataCollectionFunctionality:
         mock_op_service_id = 12
         select_route_and_run_insert_query(
             mock_cursor,
-            mock_tracks_data_dict,
+            mock_tracks_document,
             mock_op_service_id,
             "RT3",
             ["RL14"],
@@ -246,6 +545,8 @@ class TestDataCollectionFunctionality:
             mock_cursor,
             test_data.expected_tracks_data_single_section,
             mock_op_service_id,
+            None,
+            None,
         )
 
 
@@ -271,5 +572,168 @@ class TestMainFunctionality:
             s3, cloudwatch, mock_bucket, mock_key, mock_file_dir, db_connection, logger
         )
         db_patch.assert_called_once_with(
-            mock_data_dict, "WM", "tnds", mock_key, db_connection, logger, cloudwatch
+            mock_data_dict,
+            "WM",
+            "tnds",
+            mock_key,
+            db_connection,
+            logger,
+            cloudwatch,
+            vehicle_journey_stream=None,
+            stop_cache=None,
+            bulk_insert_limits=None,
+            bulk_load_target=None,
+            id_allocator=None,
+            content_hash=None,
+            incremental=False,
+            noc_cache=None,
         )
+
+    @patch("txc_processor.write_to_database")
+    def test_files_over_streaming_threshold_are_streamed(
+        self, db_patch, s3, cloudwatch
+    ):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        mock_file_dir = dir_path + "/helpers/test_data/mock_txc.xml"
+        mock_bucket = "test-bucket"
+        mock_key = "tnds/WM/test-key"
+        db_connection = MagicMock()
+        conn = boto3.resource("s3", region_name="eu-west-2")
+        # pylint: disable=no-member
+        conn.create_bucket(
+            Bucket=mock_bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3.put_object(Bucket=mock_bucket, Key=mock_key, Body=open(mock_file_dir, "rb"))
+
+        download_from_s3_and_write_to_db(
+            s3,
+            cloudwatch,
+            mock_bucket,
+            mock_key,
+            mock_file_dir,
+            db_connection,
+            logger,
+            streaming_threshold_bytes=1024,
+            streaming_chunk_size=10,
+        )
+
+        data_dict = db_patch.call_args.args[0]
+        vehicle_journey_stream = db_patch.call_args.kwargs["vehicle_journey_stream"]
+        assert data_dict == parse_txc_reference_sections(mock_file_dir)
+        assert isinstance(vehicle_journey_stream, StreamedVehicleJourneys)
+        assert vehicle_journey_stream.chunk_size == 10
+
+
+class TestStreamingIngest:
+    def test_reference_sections_match_full_parse(self):
+        for file_path in test_xml_helpers.fixture_files:
+            full_data = parse_txc_file(file_path)
+            streamed_data = parse_txc_reference_sections(file_path)
+
+            full_vehicle_journeys = make_list(
+                full_data["TransXChange"].pop("VehicleJourneys")["VehicleJourney"]
+            )
+            selectors = streamed_data["TransXChange"].pop("VehicleJourneys")[
+                "VehicleJourney"
+            ]
+
+            assert streamed_data == full_data
+            assert len(selectors) == len(full_vehicle_journeys)
+            for selector, vehicle_journey in zip(selectors, full_vehicle_journeys):
+                assert selector.items() <= vehicle_journey.items()
+                assert "DepartureTime" not in selector
+
+    def test_streamed_ingest_writes_same_rows_as_in_memory_ingest(self):
+        for file_path in test_xml_helpers.fixture_files:
+            in_memory_connection = test_db_helpers.FakeConnection()
+            write_to_database(
+                parse_txc_file(file_path),
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                in_memory_connection,
+                logger,
+                MagicMock(),
+            )
+
+            streamed_connection = test_db_helpers.FakeConnection()
+            streamed_data = parse_txc_reference_sections(file_path)
+            write_to_database(
+                streamed_data,
+                "WM",
+                "tnds",
+                "tnds/WM/test-key",
+                streamed_connection,
+                logger,
+                MagicMock(),
+                vehicle_journey_stream=StreamedVehicleJourneys(
+                    file_path, 3, streamed_data
+                ),
+            )
+
+            in_memory_rows = in_memory_connection.fake_cursor.rows
+            streamed_rows = streamed_connection.fake_cursor.rows
+            assert in_memory_connection.commits == streamed_connection.commits
+            assert set(in_memory_rows) == set(streamed_rows)
+            for table in in_memory_rows:
+                assert test_db_helpers.sorted_rows(
+                    in_memory_rows[table]
+                ) == test_db_helpers.sorted_rows(streamed_rows[table])
+
+    def test_vehicle_journeys_are_inserted_in_chunks(self):
+        file_path = f"{test_xml_helpers.dir_path}/test_data/mock_txc.xml"
+        cursor = test_db_helpers.FakeCursor()
+        data = parse_txc_reference_sections(file_path)
+        vehicle_journey_stream = StreamedVehicleJourneys(file_path, 4, data)
+        vehicle_journey_stream.add_line("l_4_ANW", 12)
+
+        vehicle_journey_stream.write(cursor)
+
+        vehicle_journey_rows = cursor.rows["vehicle_journeys_new"]
+        assert len(cursor.statements) == 2
+        assert len(vehicle_journey_rows) == 5
+        assert {row["operator_service_id"] for row in vehicle_journey_rows} == {12}
+
+
+class TestInvalidNocs:
+    def test_invalid_nocs_are_skipped_without_insert_errors(self, tmp_path):
+        data = parse_txc_file(
+            write_txc_file(
+                f"{tmp_path}/test.xml",
+                get_sizes(operators=3, services_per_operator=1, lines_per_service=1),
+            )
+        )
+        nocs = [
+            operator["NationalOperatorCode"]
+            for operator in txc_processor.get_operators(data, "bods", None)
+        ]
+        connection = SqliteConnection()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO operators (nocCode) VALUES (:noc_code)",
+                {"noc_code": nocs[0]},
+            )
+        noc_cache = NocCache()
+
+        with patch("txc_processor.put_metric_data_by_data_source") as metric_patch:
+            assert write_to_database(
+                data,
+                None,
+                "bods",
+                "bods/test.xml",
+                connection,
+                logger,
+                MagicMock(),
+                noc_cache=noc_cache,
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT nocCode FROM services_new")
+            assert [row[0] for row in cursor.fetchall()] == [nocs[0]]
+
+        invalid_noc_calls = [
+            call for call in metric_patch.call_args_list if call.args[2] == "InvalidNoc"
+        ]
+        assert [call.args[3] for call in invalid_noc_calls] == [2]
+        assert noc_cache.queries == 1
@@ -0,0 +1,148 @@
+import json
+import re
+from typing import Optional
+
+# every Data API parameter is sent as {"name": ..., "value": {"stringValue": ...}}
+DATA_API_PARAMETER_OVERHEAD_BYTES = 40
+# ExecuteStatement rejects a sql field longer than this, whatever the request size
+DATA_API_MAX_SQL_LENGTH = 65536
+DEFAULT_BULK_INSERT_MAX_ROWS = 300
+DEFAULT_BULK_INSERT_MAX_BYTES = 1024 * 1024
+DEFAULT_BULK_INSERT_MAX_SQL_LENGTH = 60 * 1024
+
+table_name_pattern = re.compile(r"\bINTO\s+(\w+)", re.IGNORECASE)
+values_pattern = re.compile(r"\bVALUES\s*(\(.*\))\s*$", re.IGNORECASE | re.DOTALL)
+placeholder_pattern = re.compile(r":(\w+)")
+
+
+class BulkInsertLimits:
+    """
+    The most rows, the most estimated request bytes and the longest SQL sent in one
+    multi-row INSERT.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = DEFAULT_BULK_INSERT_MAX_ROWS,
+        max_bytes: int = DEFAULT_BULK_INSERT_MAX_BYTES,
+        max_sql_length: int = DEFAULT_BULK_INSERT_MAX_SQL_LENGTH,
+    ):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_sql_length = max_sql_length
+
+
+# row counts that keep the SQL of a full statement around 48,000 characters
+DEFAULT_BULK_INSERT_LIMITS = {
+    "vehicle_journeys_new": BulkInsertLimits(),
+    "service_journey_pattern_links_new": BulkInsertLimits(max_rows=250),
+    # tracks rows are small, so more of them fit in a request
+    "tracks_new": BulkInsertLimits(max_rows=800),
+}
+
+
+def get_bulk_insert_limits(
+    table: str, bulk_insert_limits: Optional[dict] = None
+) -> BulkInsertLimits:
+    return (bulk_insert_limits or {}).get(table) or DEFAULT_BULK_INSERT_LIMITS.get(
+        table, BulkInsertLimits()
+    )
+
+
+def parse_bulk_insert_limits(config: Optional[str]) -> dict:
+    """
+    Parses per table limits from JSON such as {"tracks_new": {"max_rows": 5000}},
+    leaving out limits falls back to the defaults.
+    """
+    if not config:
+        return {}
+
+    return {
+        table: BulkInsertLimits(**limits) for table, limits in json.loads(config).items()
+    }
+
+
+def split_insert_query(query: str) -> tuple:
+    """
+    Splits an "INSERT ... VALUES (:a, :b)" query into the statement before VALUES and
+    the row of placeholders.
+    """
+    match = values_pattern.search(query)
+    if match is None:
+        raise ValueError(f"Expected a single row INSERT ... VALUES (...) query: {query}")
+
+    return query[: match.start(1)], match.group(1)
+
+
+def build_row(row_template: str, row_number: int, values: dict) -> tuple:
+    params = {}
+
+    def number_placeholder(match):
+        name = match.group(1)
+        params[f"{name}_{row_number}"] = values[name]
+        return f":{name}_{row_number}"
+
+    return placeholder_pattern.sub(number_placeholder, row_template), params
+
+
+def estimate_row_bytes(row_sql: str, params: dict) -> int:
+    return len(row_sql) + sum(
+        len(name) + len(str(value)) + DATA_API_PARAMETER_OVERHEAD_BYTES
+        for name, value in params.items()
+    )
+
+
+def build_multi_row_inserts(query: str, values: list, limits: BulkInsertLimits):
+    """
+    Yields (query, params) for INSERTs of up to limits.max_rows rows each, cut early
+    when the next row would take the estimated request size past limits.max_bytes or
+    the SQL past limits.max_sql_length. A row over either on its own is sent by itself.
+    """
+    statement, row_template = split_insert_query(query)
+    rows = []
+    params = {}
+    chunk_bytes = len(statement)
+    chunk_sql_length = len(statement)
+
+    for row_values in values:
+        row_sql, row_params = build_row(row_template, len(rows), row_values)
+        row_bytes = estimate_row_bytes(row_sql, row_params) + 2
+
+        if rows and (
+            len(rows) >= limits.max_rows
+            or chunk_bytes + row_bytes > limits.max_bytes
+            or chunk_sql_length + len(row_sql) + 2 > limits.max_sql_length
+        ):
+            yield f"{statement}{', '.join(rows)}", params
+            rows = []
+            params = {}
+            chunk_bytes = len(statement)
+            chunk_sql_length = len(statement)
+            row_sql, row_params = build_row(row_template, 0, row_values)
+            row_bytes = estimate_row_bytes(row_sql, row_params) + 2
+
+        rows.append(row_sql)
+        params.update(row_params)
+        chunk_bytes += row_bytes
+        chunk_sql_length += len(row_sql) + 2
+
+    if rows:
+        yield f"{statement}{', '.join(rows)}", params
+
+
+def bulk_insert(
+    cursor, query: str, values: list, bulk_insert_limits: Optional[dict] = None
+) -> int:
+    """
+    Inserts values with multi-row INSERTs built from the single row query, within the
+    limits for the table it inserts into. Returns the number of statements sent.
+    """
+    table = table_name_pattern.search(query).group(1)
+    statements = 0
+    for chunk_query, chunk_params in build_multi_row_inserts(
+        query, values, get_bulk_insert_limits(table, bulk_insert_limits)
+    ):
+        cursor.execute(chunk_query, chunk_params)
+        statements += 1
+
+    return statements
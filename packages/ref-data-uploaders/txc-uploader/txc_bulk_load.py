@@ -0,0 +1,204 @@
+import os
+import re
+import shutil
+import tempfile
+from typing import Optional
+
+from txc_bulk_insert import placeholder_pattern, split_insert_query, table_name_pattern
+
+BULK_LOAD_MODE_S3 = "s3"
+BULK_LOAD_MODE_LOCAL_INFILE = "local-infile"
+BULK_LOAD_MODES = [BULK_LOAD_MODE_S3, BULK_LOAD_MODE_LOCAL_INFILE]
+DEFAULT_BULK_LOAD_PREFIX = "bulk-load"
+
+# the MySQL defaults, spelt out so the staging files and the statement always agree
+LOAD_DATA_FORMAT = "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'"
+NULL_FIELD = "\\N"
+
+insert_columns_pattern = re.compile(r"\bINTO\s+\w+\s*\(([^)]*)\)", re.IGNORECASE)
+escape_sequence_pattern = re.compile(r"\\(.)")
+
+escaped_characters = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+unescaped_characters = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "0": "\0"}
+
+
+def escape_field(value) -> str:
+    if value is None:
+        return NULL_FIELD
+
+    return "".join(escaped_characters.get(char, char) for char in str(value))
+
+
+def unescape_field(field: str) -> Optional[str]:
+    if field == NULL_FIELD:
+        return None
+
+    return escape_sequence_pattern.sub(
+        lambda match: unescaped_characters.get(match.group(1), match.group(1)), field
+    )
+
+
+def read_staging_file(file_path: str):
+    """
+    Yields the rows of a staging file as lists of values, the way LOAD DATA reads them.
+    """
+    with open(file_path, encoding="utf-8", newline="") as staging_file:
+        for line in staging_file:
+            yield [unescape_field(field) for field in line.rstrip("\n").split("\t")]
+
+
+class StagingFile:
+    """
+    The rows for one table, written tab separated in the LOAD DATA format.
+    """
+
+    def __init__(self, file_path: str, table: str, columns: list, params: list):
+        self.file_path = file_path
+        self.table = table
+        self.columns = columns
+        self.params = params
+        self.rows = 0
+        self.file = open(file_path, "w", encoding="utf-8", newline="")
+
+    def write_rows(self, values: list):
+        for row_values in values:
+            self.file.write(
+                "\t".join(escape_field(row_values[name]) for name in self.params)
+            )
+            self.file.write("\n")
+
+        self.rows += len(values)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class LocalInfileTarget:
+    """
+    Loads staging files from the local disk with LOAD DATA LOCAL INFILE, which needs
+    the mysql engine with local_infile enabled.
+    """
+
+    def get_source(self, staging_file: StagingFile, batch_name: str) -> str:
+        return f"LOCAL INFILE '{staging_file.file_path}'"
+
+    def cleanup(self, batch_name: str):
+        pass
+
+
+class S3Target:
+    """
+    Uploads staging files to S3 and loads them with Aurora's LOAD DATA FROM S3, which
+    works over the Data API as well as the mysql engine. The cluster needs an IAM role
+    that can read the bucket.
+    """
+
+    def __init__(self, s3, bucket: str, prefix: str = DEFAULT_BULK_LOAD_PREFIX):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.uploaded_keys = {}
+
+    def get_source(self, staging_file: StagingFile, batch_name: str) -> str:
+        key = f"{self.prefix}/{batch_name}/{staging_file.table}.tsv"
+        self.s3.upload_file(staging_file.file_path, self.bucket, key)
+        self.uploaded_keys.setdefault(batch_name, []).append(key)
+
+        return f"FROM S3 FILE 's3://{self.bucket}/{key}'"
+
+    def cleanup(self, batch_name: str):
+        keys = self.uploaded_keys.pop(batch_name, [])
+        if keys:
+            self.s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys]},
+            )
+
+
+def create_bulk_load_target(
+    mode: Optional[str], s3=None, bucket: str = None, prefix: str = None
+):
+    if not mode:
+        return None
+    if mode == BULK_LOAD_MODE_LOCAL_INFILE:
+        return LocalInfileTarget()
+    if mode == BULK_LOAD_MODE_S3:
+        if not bucket:
+            raise ValueError("A bucket is needed to bulk load from S3")
+        return S3Target(s3, bucket, prefix or DEFAULT_BULK_LOAD_PREFIX)
+
+    raise ValueError(
+        f"Unknown bulk load mode: '{mode}', expected one of {BULK_LOAD_MODES}"
+    )
+
+
+class BulkLoader:
+    """
+    Stages the rows of the high volume tables in delimited files while a TXC file is
+    transformed, then loads each table with a single LOAD DATA statement and checks
+    the number of rows loaded is the number of rows staged.
+    """
+
+    def __init__(self, target, staging_dir: Optional[str] = None):
+        self.target = target
+        self.staging_dir = tempfile.mkdtemp(prefix="txc-bulk-load-", dir=staging_dir)
+        self.batch_name = os.path.basename(self.staging_dir)
+        self.staging_files = {}
+
+    def get_staging_file(self, query: str) -> StagingFile:
+        table = table_name_pattern.search(query).group(1)
+        if table not in self.staging_files:
+            _, row_template = split_insert_query(query)
+            columns = [
+                column.strip()
+                for column in insert_columns_pattern.search(query).group(1).split(",")
+            ]
+            self.staging_files[table] = StagingFile(
+                f"{self.staging_dir}/{table}.tsv",
+                table,
+                columns,
+                placeholder_pattern.findall(row_template),
+            )
+
+        return self.staging_files[table]
+
+    def stage_rows(self, query: str, values: list):
+        """
+        Writes the rows a single row INSERT query would have inserted to the staging
+        file for its table.
+        """
+        if values:
+            self.get_staging_file(query).write_rows(values)
+
+    def load(self, cursor) -> dict:
+        """
+        Loads every staging file and returns the number of rows loaded for each table,
+        raising if any table loaded a different number of rows than were staged.
+        """
+        loaded_rows = {}
+        for table, staging_file in self.staging_files.items():
+            staging_file.close()
+            if staging_file.rows == 0:
+                continue
+
+            cursor.execute(
+                f"LOAD DATA {self.target.get_source(staging_file, self.batch_name)} INTO TABLE {table} {LOAD_DATA_FORMAT} ({', '.join(staging_file.columns)})"
+            )
+            loaded_rows[table] = cursor.rowcount
+
+            if loaded_rows[table] != staging_file.rows:
+                raise RuntimeError(
+                    f"Bulk load of {table} loaded {loaded_rows[table]} rows, expected {staging_file.rows}"
+                )
+
+        return loaded_rows
+
+    def close(self):
+        for staging_file in self.staging_files.values():
+            staging_file.close()
+
+        try:
+            self.target.cleanup(self.batch_name)
+        finally:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
@@ -0,0 +1,177 @@
+import time
+from collections import OrderedDict
+
+DEFAULT_STOP_CACHE_MAX_SIZE = 200000
+DEFAULT_STOP_CACHE_TTL_SECONDS = 60 * 60
+STOP_LOOKUP_BATCH_SIZE = 500
+DEFAULT_NOC_CACHE_TTL_SECONDS = 15 * 60
+
+
+def normalise_collated_value(value):
+    # the ref data tables compare strings case insensitively and ignoring trailing
+    # spaces, so values held in memory are matched the same way
+    return value.casefold().rstrip(" ") if isinstance(value, str) else value
+
+
+class StopCache:
+    """
+    Admin area codes and locations of stops by atcoCode, kept across warm invocations.
+    Stops missing from the cache are loaded in batches of STOP_LOOKUP_BATCH_SIZE, stops
+    not found are cached as None so they are not looked up again. Entries expire after
+    ttl_seconds and the least recently used are evicted past max_size.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_STOP_CACHE_MAX_SIZE,
+        ttl_seconds: float = DEFAULT_STOP_CACHE_TTL_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.evictions = 0
+
+    def get_cached(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+
+        loaded_at, stop = entry
+        if self.clock() - loaded_at > self.ttl_seconds:
+            del self.entries[key]
+            return False, None
+
+        self.entries.move_to_end(key)
+        return True, stop
+
+    def put(self, key, stop):
+        self.entries[key] = (self.clock(), stop)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def load_stops(self, cursor, atco_codes: list) -> dict:
+        stops = {}
+        for batch_start in range(0, len(atco_codes), STOP_LOOKUP_BATCH_SIZE):
+            batch = atco_codes[batch_start : batch_start + STOP_LOOKUP_BATCH_SIZE]
+            codes_dict = {f"k{k}": v for k, v in enumerate(batch)}
+            query = "SELECT stops.atcoCode, stops.longitude, stops.latitude, localities.administrativeAreaCode FROM stops_new as stops left join localities_new as localities on localities.nptgLocalityCode = stops.nptgLocalityCode WHERE stops.atcoCode IN (%s)"
+            keys = ", ".join(list([f":{v}" for v in codes_dict.keys()]))
+            query = query % keys
+
+            cursor.execute(query, codes_dict)
+            self.queries += 1
+
+            for atco_code, longitude, latitude, admin_area_code in (
+                cursor.fetchall() or []
+            ):
+                stop = stops.setdefault(
+                    normalise_collated_value(atco_code),
+                    {
+                        "admin_area_codes": set(),
+                        "location": (longitude, latitude),
+                    },
+                )
+                if admin_area_code is not None:
+                    stop["admin_area_codes"].add(admin_area_code)
+
+        return stops
+
+    def get_stops(self, cursor, atco_codes) -> dict:
+        stops = {}
+        missing = {}
+
+        for atco_code in atco_codes:
+            key = normalise_collated_value(atco_code)
+            if key in stops or key in missing:
+                continue
+
+            found, stop = self.get_cached(key)
+            if found:
+                self.hits += 1
+                stops[key] = stop
+            else:
+                self.misses += 1
+                missing[key] = atco_code
+
+        if missing:
+            loaded_stops = self.load_stops(cursor, list(missing.values()))
+            for key in missing:
+                stop = loaded_stops.get(key)
+                self.put(key, stop)
+                stops[key] = stop
+
+        return stops
+
+    def get_admin_area_codes(self, cursor, atco_codes) -> list:
+        admin_area_codes = set()
+        for stop in self.get_stops(cursor, atco_codes).values():
+            if stop is not None:
+                admin_area_codes.update(stop["admin_area_codes"])
+
+        return list(admin_area_codes)
+
+    def get_location(self, cursor, atco_code):
+        stops = self.get_stops(cursor, [atco_code])
+        stop = stops.get(normalise_collated_value(atco_code))
+
+        return stop["location"] if stop is not None else None
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "queries": self.queries,
+            "evictions": self.evictions,
+        }
+
+
+class NocCache:
+    """
+    The NOCs in the operators table, which services_new references by foreign key,
+    loaded with a single query and kept across warm invocations. The set is reloaded
+    once ttl_seconds have passed, so operators added by the NOC retriever are picked
+    up without a cold start.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_NOC_CACHE_TTL_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.noc_codes = None
+        self.loaded_at = None
+        self.queries = 0
+
+    def load_noc_codes(self, cursor) -> set:
+        cursor.execute("SELECT nocCode FROM operators")
+        self.queries += 1
+
+        # operators compares nocCodes the same way stops_new compares atcoCodes
+        return {normalise_collated_value(row[0]) for row in cursor.fetchall() or []}
+
+    def get_noc_codes(self, cursor) -> set:
+        if self.noc_codes is None or self.clock() - self.loaded_at > self.ttl_seconds:
+            self.noc_codes = self.load_noc_codes(cursor)
+            self.loaded_at = self.clock()
+
+        return self.noc_codes
+
+    def is_valid_noc(self, cursor, noc_code) -> bool:
+        return normalise_collated_value(noc_code) in self.get_noc_codes(cursor)
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self.noc_codes or ()),
+            "queries": self.queries,
+        }
@@ -0,0 +1,679 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import aurora_data_api
+import boto3
+
+from txc_bulk_load import read_staging_file
+
+DB_ENGINE_DATA_API = "data-api"
+DB_ENGINE_SQLITE = "sqlite"
+DB_ENGINE_MYSQL = "mysql"
+DB_ENGINES = [DB_ENGINE_DATA_API, DB_ENGINE_SQLITE, DB_ENGINE_MYSQL]
+
+DEFAULT_MYSQL_PORT = 3306
+DEFAULT_MYSQL_POOL_SIZE = 2
+DEFAULT_MYSQL_CONNECT_TIMEOUT_SECONDS = 10
+
+# the DB-API exceptions, most specific first, which pymysql and aurora_data_api share
+# the names of but not the classes
+DB_API_ERROR_NAMES = [
+    "IntegrityError",
+    "DataError",
+    "OperationalError",
+    "ProgrammingError",
+    "NotSupportedError",
+    "InternalError",
+    "InterfaceError",
+    "DatabaseError",
+    "Error",
+]
+
+SQLITE_COLLATION = "unicode_ci"
+
+# the columns of the _new tables the uploader reads and writes, text columns use a
+# collation that compares strings like utf8mb4_unicode_ci does in Aurora
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS services_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nocCode TEXT COLLATE {SQLITE_COLLATION},
+    lineName TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    lineId TEXT COLLATE {SQLITE_COLLATION},
+    startDate TEXT,
+    endDate TEXT,
+    operatorShortName TEXT COLLATE {SQLITE_COLLATION},
+    inboundDirectionDescription TEXT COLLATE {SQLITE_COLLATION},
+    outboundDirectionDescription TEXT COLLATE {SQLITE_COLLATION},
+    serviceDescription TEXT COLLATE {SQLITE_COLLATION},
+    serviceCode TEXT COLLATE {SQLITE_COLLATION},
+    regionCode TEXT COLLATE {SQLITE_COLLATION},
+    dataSource TEXT COLLATE {SQLITE_COLLATION} NOT NULL CHECK (dataSource IN ('bods', 'tnds')),
+    origin TEXT COLLATE {SQLITE_COLLATION},
+    destination TEXT COLLATE {SQLITE_COLLATION},
+    mode TEXT COLLATE {SQLITE_COLLATION},
+    filePath TEXT COLLATE {SQLITE_COLLATION},
+    centrePointLon TEXT,
+    centrePointLat TEXT,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_services_new_lineName ON services_new (lineName);
+CREATE INDEX IF NOT EXISTS idx_services_new_nocCode ON services_new (nocCode);
+
+CREATE TABLE IF NOT EXISTS service_journey_patterns_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operatorServiceId INTEGER NOT NULL,
+    destinationDisplay TEXT COLLATE {SQLITE_COLLATION},
+    direction TEXT COLLATE {SQLITE_COLLATION},
+    routeRef TEXT COLLATE {SQLITE_COLLATION},
+    journeyPatternRef TEXT COLLATE {SQLITE_COLLATION},
+    sectionRefs TEXT COLLATE {SQLITE_COLLATION}
+);
+CREATE INDEX IF NOT EXISTS idx_service_journey_patterns_new_operatorServiceId
+    ON service_journey_patterns_new (operatorServiceId);
+
+CREATE TABLE IF NOT EXISTS service_journey_pattern_links_new (
+    journeyPatternId INTEGER NOT NULL,
+    fromAtcoCode TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    fromTimingStatus TEXT COLLATE {SQLITE_COLLATION},
+    fromSequenceNumber TEXT,
+    toAtcoCode TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    toTimingStatus TEXT COLLATE {SQLITE_COLLATION},
+    toSequenceNumber TEXT,
+    runtime TEXT,
+    orderInSequence INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS vehicle_journeys_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicleJourneyCode TEXT COLLATE {SQLITE_COLLATION},
+    serviceRef TEXT COLLATE {SQLITE_COLLATION},
+    lineRef TEXT COLLATE {SQLITE_COLLATION},
+    journeyPatternRef TEXT COLLATE {SQLITE_COLLATION},
+    departureTime TEXT,
+    journeyCode TEXT COLLATE {SQLITE_COLLATION},
+    operatorServiceId INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS tracks_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operatorServiceId INTEGER,
+    longitude TEXT,
+    latitude TEXT
+);
+
+CREATE TABLE IF NOT EXISTS service_admin_area_codes_new (
+    serviceId INTEGER NOT NULL,
+    adminAreaCode TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    PRIMARY KEY (serviceId, adminAreaCode)
+);
+
+CREATE TABLE IF NOT EXISTS stops_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    atcoCode TEXT COLLATE {SQLITE_COLLATION} UNIQUE,
+    commonName TEXT COLLATE {SQLITE_COLLATION},
+    nptgLocalityCode TEXT COLLATE {SQLITE_COLLATION},
+    longitude TEXT,
+    latitude TEXT,
+    administrativeAreaCode TEXT COLLATE {SQLITE_COLLATION}
+);
+
+CREATE TABLE IF NOT EXISTS txc_ingest_ledger_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dataSource TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    contentHash TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    filePath TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    ingestedAt TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (dataSource, contentHash, filePath)
+);
+
+CREATE TABLE IF NOT EXISTS service_file_fingerprints_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operatorServiceId INTEGER NOT NULL,
+    filePath TEXT COLLATE {SQLITE_COLLATION} NOT NULL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_service_file_fingerprints_new_operatorServiceId
+    ON service_file_fingerprints_new (operatorServiceId);
+
+CREATE TABLE IF NOT EXISTS txc_id_sequences (
+    tableName TEXT PRIMARY KEY,
+    nextId INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS localities_new (
+    nptgLocalityCode TEXT COLLATE {SQLITE_COLLATION} PRIMARY KEY,
+    localityName TEXT COLLATE {SQLITE_COLLATION},
+    administrativeAreaCode TEXT COLLATE {SQLITE_COLLATION} NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS operators (
+    nocCode TEXT COLLATE {SQLITE_COLLATION} PRIMARY KEY
+);
+"""
+
+STATEMENT_FINGERPRINT_MAX_LENGTH = 200
+
+whitespace_pattern = re.compile(r"\s+")
+named_parameter_pattern = re.compile(r":\w+")
+number_literal_pattern = re.compile(r"\b\d+\b")
+in_list_pattern = re.compile(r"IN \((?:\?, )*\?\)", re.IGNORECASE)
+repeated_values_pattern = re.compile(r"(\([^()]*\))(?:, \1)+")
+repeated_union_pattern = re.compile(r"(\(SELECT .*?\))(?: UNION ALL \1)+")
+
+named_placeholder_pattern = re.compile(r"(?<![\w:]):(\w+)")
+null_safe_equals_pattern = re.compile(r"\s*<=>\s*")
+insert_ignore_pattern = re.compile(r"^\s*INSERT\s+IGNORE\s+INTO", re.IGNORECASE)
+parenthesised_select_pattern = re.compile(r"\(\s*SELECT\s", re.IGNORECASE)
+load_data_local_infile_pattern = re.compile(
+    r"^\s*LOAD DATA LOCAL INFILE '([^']+)' INTO TABLE (\w+) .*\(([^)]*)\)\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def translate_mysql_to_sqlite(query: str) -> str:
+    """
+    Rewrites the MySQL only syntax the uploader uses: the null safe <=> comparison,
+    INSERT IGNORE and parenthesised UNION ALL members, which SQLite only accepts as
+    subqueries.
+    """
+    query = null_safe_equals_pattern.sub(" IS ", query)
+    query = insert_ignore_pattern.sub("INSERT OR IGNORE INTO", query)
+
+    if query.lstrip().startswith("("):
+        query = parenthesised_select_pattern.sub("SELECT * FROM (SELECT ", query)
+
+    return query
+
+
+def compare_unicode_ci(left: str, right: str) -> int:
+    left = left.casefold().rstrip(" ")
+    right = right.casefold().rstrip(" ")
+
+    return (left > right) - (left < right)
+
+
+class SqliteCursor:
+    """
+    The parts of an AuroraDataAPICursor the uploader uses, over a sqlite3 cursor.
+    Queries are translated with translate_mysql_to_sqlite before they are run.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query, params=None):
+        load_data_match = load_data_local_infile_pattern.match(query)
+        if load_data_match:
+            self.load_data_local_infile(*load_data_match.groups())
+            return
+
+        self.cursor.execute(translate_mysql_to_sqlite(query), params or {})
+
+    def executemany(self, query, params_list):
+        self.cursor.executemany(translate_mysql_to_sqlite(query), params_list)
+
+    def load_data_local_infile(self, file_path: str, table: str, columns: str):
+        column_names = [column.strip() for column in columns.split(",")]
+        self.cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(column_names)}) VALUES ({', '.join('?' for _ in column_names)})",
+            read_staging_file(file_path),
+        )
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class SqliteConnection:
+    """
+    A local stand-in for the Aurora Data API connection, with the _new tables the
+    uploader writes to created in an SQLite database. Foreign keys to operators and
+    stops are not created, so invalid NOCs are only detected when a NocCache is used
+    and the operators table is filled in. LOAD DATA LOCAL INFILE of a bulk load
+    staging file is run as an INSERT of its rows.
+    """
+
+    def __init__(self, database: str = ":memory:"):
+        self.connection = sqlite3.connect(database)
+        self.connection.create_collation(SQLITE_COLLATION, compare_unicode_ci)
+        self.connection.executescript(SQLITE_SCHEMA)
+
+    def cursor(self):
+        return SqliteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+def translate_named_to_pyformat(query: str) -> str:
+    """
+    Rewrites the :name placeholders the uploader uses into the %(name)s placeholders
+    the MySQL driver expects, escaping any literal % first.
+    """
+    return named_placeholder_pattern.sub(r"%(\1)s", query.replace("%", "%%"))
+
+
+def translate_driver_error(error: Exception) -> Exception:
+    """
+    The aurora_data_api exception of the same DB-API type as a driver error, with its
+    (code, message) args, so errors are handled the same way whatever the engine.
+    Anything other than a DB-API error is returned unchanged.
+    """
+    error_names = {error_class.__name__ for error_class in type(error).__mro__}
+    for name in DB_API_ERROR_NAMES:
+        if name in error_names:
+            return getattr(aurora_data_api, name)(*error.args)
+
+    return error
+
+
+@contextmanager
+def translated_driver_errors():
+    try:
+        yield
+    except Exception as e:
+        translated_error = translate_driver_error(e)
+        if translated_error is e:
+            raise e
+        raise translated_error from e
+
+
+class MysqlCursor:
+    """
+    The parts of an AuroraDataAPICursor the uploader uses, over a MySQL driver cursor.
+    executemany of an INSERT is sent by the driver as multi-row INSERTs.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query, params=None):
+        with translated_driver_errors():
+            # the driver only unescapes %% when given params, so a dict is always passed
+            self.cursor.execute(translate_named_to_pyformat(query), params or {})
+
+    def executemany(self, query, params_list):
+        with translated_driver_errors():
+            self.cursor.executemany(
+                translate_named_to_pyformat(query), list(params_list)
+            )
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return list(self.cursor.fetchall())
+
+
+class MysqlConnectionPool:
+    """
+    Keeps up to max_size idle driver connections open between files and invocations,
+    pinging each one, and reconnecting if it has been closed, before handing it out.
+    """
+
+    def __init__(self, connect_function, max_size: int = DEFAULT_MYSQL_POOL_SIZE):
+        self.connect_function = connect_function
+        self.max_size = max_size
+        self.idle_connections = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            connection = self.idle_connections.pop() if self.idle_connections else None
+
+        if connection is None:
+            return self.connect_function()
+
+        connection.ping(reconnect=True)
+        return connection
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle_connections) < self.max_size:
+                self.idle_connections.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle_connections, self.idle_connections = self.idle_connections, []
+
+        for connection in idle_connections:
+            connection.close()
+
+
+class MysqlConnection:
+    """
+    Talks to Aurora over the MySQL protocol with the transaction semantics of an
+    aurora_data_api connection: a transaction begins when the first cursor is opened
+    and ends with commit or rollback, which hand the driver connection back to the pool.
+    """
+
+    def __init__(self, pool: MysqlConnectionPool):
+        self.pool = pool
+        self.connection = None
+
+    def cursor(self):
+        if self.connection is None:
+            self.connection = self.pool.acquire()
+            self.connection.begin()
+
+        return MysqlCursor(self.connection.cursor())
+
+    def end_transaction(self, method_name: str):
+        if self.connection is None:
+            return
+
+        connection, self.connection = self.connection, None
+        try:
+            getattr(connection, method_name)()
+        finally:
+            self.pool.release(connection)
+
+    def commit(self):
+        self.end_transaction("commit")
+
+    def rollback(self):
+        self.end_transaction("rollback")
+
+    def close(self):
+        self.rollback()
+        self.pool.close()
+
+
+def get_mysql_connect_kwargs(
+    aurora_cluster_arn: str = None,
+    database: str = None,
+    secret_arn: str = None,
+    host: str = None,
+    port: int = None,
+    user: str = None,
+    password: str = None,
+    local_infile: bool = False,
+) -> dict:
+    """
+    Builds the driver connection settings. The user, password, host and port come from
+    the database secret unless they are given, and the host from the cluster endpoint
+    if the secret has none.
+    """
+    if secret_arn and (user is None or password is None):
+        secret = json.loads(
+            boto3.client("secretsmanager").get_secret_value(SecretId=secret_arn)[
+                "SecretString"
+            ]
+        )
+        user = user or secret.get("username")
+        password = password or secret.get("password")
+        host = host or secret.get("host")
+        port = port or secret.get("port")
+
+    if host is None and aurora_cluster_arn:
+        cluster = boto3.client("rds").describe_db_clusters(
+            DBClusterIdentifier=aurora_cluster_arn
+        )["DBClusters"][0]
+        host = cluster["Endpoint"]
+        port = port or cluster.get("Port")
+
+    return {
+        "host": host,
+        "port": int(port or DEFAULT_MYSQL_PORT),
+        "user": user,
+        "password": password,
+        "database": database,
+        "charset": "utf8mb4",
+        "autocommit": False,
+        "connect_timeout": DEFAULT_MYSQL_CONNECT_TIMEOUT_SECONDS,
+        "local_infile": local_infile,
+    }
+
+
+def connect_mysql(pool_size: int = DEFAULT_MYSQL_POOL_SIZE, **kwargs) -> MysqlConnection:
+    # only needed by the mysql engine, so not imported unless it is used
+    import pymysql
+
+    connect_kwargs = get_mysql_connect_kwargs(**kwargs)
+
+    return MysqlConnection(
+        MysqlConnectionPool(lambda: pymysql.connect(**connect_kwargs), pool_size)
+    )
+
+
+def fingerprint_statement(query: str) -> str:
+    """
+    Normalises a statement so every call of the same query shape shares a fingerprint,
+    parameters and numbers become ?, and IN lists, multi-row VALUES and UNION ALL
+    members that only differ by parameter are collapsed.
+    """
+    fingerprint = whitespace_pattern.sub(" ", query).strip()
+    fingerprint = named_parameter_pattern.sub("?", fingerprint)
+    fingerprint = number_literal_pattern.sub("?", fingerprint)
+    fingerprint = in_list_pattern.sub("IN (...)", fingerprint)
+    fingerprint = repeated_values_pattern.sub(r"\1, ...", fingerprint)
+    fingerprint = repeated_union_pattern.sub(r"\1 UNION ALL ...", fingerprint)
+
+    if len(fingerprint) > STATEMENT_FINGERPRINT_MAX_LENGTH:
+        return f"{fingerprint[:STATEMENT_FINGERPRINT_MAX_LENGTH]}..."
+
+    return fingerprint
+
+
+def estimate_payload_bytes(query: str, parameter_sets: list) -> int:
+    return len(query.encode("utf-8")) + sum(
+        len(json.dumps(parameters, default=str)) for parameters in parameter_sets
+    )
+
+
+class StatementStats:
+    """
+    Calls, time spent, rows sent and returned, and request bytes for each statement
+    fingerprint, collected from every cursor of an InstrumentedConnection.
+    """
+
+    def __init__(self):
+        self.fingerprints = {}
+
+    def record(
+        self,
+        fingerprint: str,
+        seconds: float,
+        rows_sent: int = 0,
+        rows_returned: int = 0,
+        payload_bytes: int = 0,
+        calls: int = 1,
+    ):
+        stats = self.fingerprints.setdefault(
+            fingerprint,
+            {
+                "calls": 0,
+                "seconds": 0.0,
+                "max_seconds": 0.0,
+                "rows_sent": 0,
+                "rows_returned": 0,
+                "payload_bytes": 0,
+            },
+        )
+        stats["calls"] += calls
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["rows_sent"] += rows_sent
+        stats["rows_returned"] += rows_returned
+        stats["payload_bytes"] += payload_bytes
+
+    def get_summary(self) -> dict:
+        statements = sorted(
+            (
+                {"fingerprint": fingerprint, **stats}
+                for fingerprint, stats in self.fingerprints.items()
+            ),
+            key=lambda statement: statement["seconds"],
+            reverse=True,
+        )
+
+        return {
+            "calls": sum(statement["calls"] for statement in statements),
+            "seconds": sum(statement["seconds"] for statement in statements),
+            "rows_sent": sum(statement["rows_sent"] for statement in statements),
+            "payload_bytes": sum(statement["payload_bytes"] for statement in statements),
+            "statements": statements,
+        }
+
+
+class InstrumentedCursor:
+    """
+    Wraps a cursor, timing every execute, executemany and fetch and recording it in
+    the connection's StatementStats under the fingerprint of the statement.
+    """
+
+    def __init__(self, cursor, stats: StatementStats):
+        self.cursor = cursor
+        self.stats = stats
+        self.last_fingerprint = None
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self.cursor.__exit__(*args)
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def run(self, method, query, parameter_sets: list, *args):
+        self.last_fingerprint = fingerprint_statement(query)
+        start = time.perf_counter()
+        try:
+            return method(query, *args)
+        finally:
+            self.stats.record(
+                self.last_fingerprint,
+                time.perf_counter() - start,
+                rows_sent=len(parameter_sets),
+                payload_bytes=estimate_payload_bytes(query, parameter_sets),
+            )
+
+    def execute(self, query, params=None):
+        return self.run(self.cursor.execute, query, [params] if params else [], params)
+
+    def executemany(self, query, params_list):
+        params_list = list(params_list)
+        return self.run(self.cursor.executemany, query, params_list, params_list)
+
+    def fetch(self, method):
+        start = time.perf_counter()
+        rows = method()
+        if isinstance(rows, list):
+            rows_returned = len(rows)
+        else:
+            rows_returned = 0 if rows is None else 1
+        self.stats.record(
+            self.last_fingerprint,
+            time.perf_counter() - start,
+            rows_returned=rows_returned,
+            calls=0,
+        )
+
+        return rows
+
+    def fetchone(self):
+        return self.fetch(self.cursor.fetchone)
+
+    def fetchall(self):
+        return self.fetch(self.cursor.fetchall)
+
+
+class InstrumentedConnection:
+    """
+    Wraps a connection so every cursor it opens is an InstrumentedCursor. The stats
+    cover everything since the last pop_summary, which is called once per file.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.stats = StatementStats()
+
+    def cursor(self):
+        return InstrumentedCursor(self.connection.cursor(), self.stats)
+
+    def commit(self):
+        start = time.perf_counter()
+        self.connection.commit()
+        self.stats.record("COMMIT", time.perf_counter() - start)
+
+    def rollback(self):
+        start = time.perf_counter()
+        self.connection.rollback()
+        self.stats.record("ROLLBACK", time.perf_counter() - start)
+
+    def pop_summary(self) -> dict:
+        summary = self.stats.get_summary()
+        self.stats = StatementStats()
+
+        return summary
+
+
+def connect(engine: str = DB_ENGINE_DATA_API, **kwargs):
+    """
+    Opens a connection for the given engine: "data-api" takes aurora_cluster_arn,
+    database and secret_arn, "sqlite" takes the database path and "mysql" takes the
+    same settings as "data-api" plus optional host, port, user, password, local_infile
+    and pool_size.
+    """
+    if engine == DB_ENGINE_DATA_API:
+        return aurora_data_api.connect(
+            aurora_cluster_arn=kwargs.get("aurora_cluster_arn"),
+            database=kwargs.get("database"),
+            secret_arn=kwargs.get("secret_arn"),
+        )
+    if engine == DB_ENGINE_SQLITE:
+        return SqliteConnection(kwargs.get("database") or ":memory:")
+    if engine == DB_ENGINE_MYSQL:
+        return connect_mysql(**kwargs)
+
+    raise ValueError(f"Unknown database engine: '{engine}', expected one of {DB_ENGINES}")
@@ -0,0 +1,202 @@
+import hashlib
+import json
+
+from txc_parser import make_list
+
+
+def get_section_items(transxchange: dict, section_name: str, item_name: str) -> list:
+    section = transxchange.get(section_name)
+    if not section or section.get(item_name) is None:
+        return []
+
+    return make_list(section[item_name])
+
+
+def index_by_id(items: list) -> dict:
+    # keeps the first item for an id, which is what the linear scans it replaces found
+    index = {}
+    for item in items:
+        if isinstance(item, dict) and "@id" in item:
+            index.setdefault(item["@id"], item)
+
+    return index
+
+
+def get_inherited_line_refs(vehicle_journeys: list) -> dict:
+    """
+    Maps a VehicleJourneyCode to the lines of the journeys that only reference it
+    through a VehicleJourneyRef, so the referenced journey is also used for them.
+    """
+    inherited_line_refs = {}
+    for vehicle_journey in vehicle_journeys:
+        if (
+            "JourneyPatternRef" not in vehicle_journey
+            and "VehicleJourneyRef" in vehicle_journey
+            and "LineRef" in vehicle_journey
+        ):
+            inherited_line_refs.setdefault(
+                vehicle_journey["VehicleJourneyRef"], set()
+            ).add(vehicle_journey["LineRef"])
+
+    return inherited_line_refs
+
+
+def get_line_refs_for_vehicle_journey(
+    vehicle_journey: dict, inherited_line_refs: dict
+) -> set:
+    line_refs = set()
+    if "LineRef" in vehicle_journey:
+        line_refs.add(vehicle_journey["LineRef"])
+    if "VehicleJourneyCode" in vehicle_journey:
+        line_refs.update(
+            inherited_line_refs.get(vehicle_journey["VehicleJourneyCode"], ())
+        )
+
+    return line_refs
+
+
+class TxcDocument:
+    """
+    A parsed TXC file with its JourneyPatternSections, RouteSections, RouteLinks and
+    Routes indexed by id, and its services and vehicle journeys grouped by operator and
+    line, built once per file so references resolve in constant time. It also holds
+    the per service results the uploader would otherwise rebuild for every line of a
+    service.
+    """
+
+    def __init__(self, data: dict):
+        self.data = data
+        transxchange = data["TransXChange"]
+
+        self.journey_pattern_sections = index_by_id(
+            get_section_items(
+                transxchange, "JourneyPatternSections", "JourneyPatternSection"
+            )
+        )
+        self.route_sections = index_by_id(
+            get_section_items(transxchange, "RouteSections", "RouteSection")
+        )
+        self.route_links = {
+            route_section_id: index_by_id(
+                make_list(route_section["RouteLink"])
+                if route_section.get("RouteLink") is not None
+                else []
+            )
+            for route_section_id, route_section in self.route_sections.items()
+        }
+        self.routes = index_by_id(get_section_items(transxchange, "Routes", "Route"))
+
+        self.services_by_operator_ref = {}
+        for service in get_section_items(transxchange, "Services", "Service"):
+            if "RegisteredOperatorRef" in service:
+                self.services_by_operator_ref.setdefault(
+                    service["RegisteredOperatorRef"], []
+                ).append(service)
+
+        self.vehicle_journeys = get_section_items(
+            transxchange, "VehicleJourneys", "VehicleJourney"
+        )
+        self.inherited_line_refs = get_inherited_line_refs(self.vehicle_journeys)
+        self.vehicle_journeys_by_line = {}
+        for vehicle_journey in self.vehicle_journeys:
+            if "JourneyPatternRef" not in vehicle_journey:
+                continue
+            for line_ref in get_line_refs_for_vehicle_journey(
+                vehicle_journey, self.inherited_line_refs
+            ):
+                self.vehicle_journeys_by_line.setdefault(line_ref, []).append(
+                    vehicle_journey
+                )
+
+        # results derived from a service, keyed by id(service) which stays valid for
+        # as long as the document holds the data the service was parsed into
+        self.journey_patterns_by_service = {}
+        self.usable_data_by_service = {}
+        self.fingerprints_by_service = {}
+
+    def get_journey_pattern_section(self, journey_pattern_section_ref: str):
+        return self.journey_pattern_sections.get(journey_pattern_section_ref)
+
+    def get_route_section(self, route_section_ref: str):
+        return self.route_sections.get(route_section_ref)
+
+    def get_route_link(self, route_section_ref: str, route_link_ref: str):
+        return self.route_links.get(route_section_ref, {}).get(route_link_ref)
+
+    def get_route(self, route_ref: str):
+        return self.routes.get(route_ref)
+
+    def get_services_for_operator(self, operator: dict) -> list:
+        return self.services_by_operator_ref.get(operator.get("@id"), [])
+
+    def get_vehicle_journeys_for_line(self, line_id: str) -> list:
+        return self.vehicle_journeys_by_line.get(line_id, [])
+
+    def get_service_fingerprint(self, operator: dict, service: dict) -> str:
+        """
+        A hash of everything the uploader writes for a service: the operator, the
+        service and its lines, the sections and routes its journey patterns use and the
+        vehicle journeys of its lines.
+        """
+        cache_key = (id(operator), id(service))
+        if cache_key not in self.fingerprints_by_service:
+            self.fingerprints_by_service[cache_key] = self.build_service_fingerprint(
+                operator, service
+            )
+
+        return self.fingerprints_by_service[cache_key]
+
+    def build_service_fingerprint(self, operator: dict, service: dict) -> str:
+        journey_patterns = make_list(
+            (service.get("StandardService") or {}).get("JourneyPattern") or []
+        )
+        section_refs = sorted(
+            {
+                section_ref
+                for journey_pattern in journey_patterns
+                for section_ref in make_list(
+                    journey_pattern.get("JourneyPatternSectionRefs") or []
+                )
+            }
+        )
+        route_refs = sorted(
+            {
+                journey_pattern["RouteRef"]
+                for journey_pattern in journey_patterns
+                if journey_pattern.get("RouteRef")
+            }
+        )
+        route_section_refs = sorted(
+            {
+                route_section_ref
+                for route_ref in route_refs
+                for route_section_ref in make_list(
+                    (self.get_route(route_ref) or {}).get("RouteSectionRef") or []
+                )
+            }
+        )
+        line_ids = [
+            line.get("@id")
+            for line in make_list((service.get("Lines") or {}).get("Line") or [])
+        ]
+
+        subtree = {
+            "operator": operator,
+            "service": service,
+            "journey_pattern_sections": [
+                self.get_journey_pattern_section(section_ref)
+                for section_ref in section_refs
+            ],
+            "routes": [self.get_route(route_ref) for route_ref in route_refs],
+            "route_sections": [
+                self.get_route_section(route_section_ref)
+                for route_section_ref in route_section_refs
+            ],
+            "vehicle_journeys": [
+                self.get_vehicle_journeys_for_line(line_id) for line_id in line_ids
+            ],
+        }
+
+        return hashlib.sha256(
+            json.dumps(subtree, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
@@ -0,0 +1,61 @@
+DEFAULT_ID_BLOCK_SIZE = 1000
+
+
+class IdAllocator:
+    """
+    Hands out ids for a table from blocks reserved in the txc_id_sequences table, so
+    rows can be given their ids before they are inserted. Blocks are reserved over
+    their own connection and committed straight away, so the sequence row is only
+    locked for one round trip rather than for the whole file.
+
+    The ids left in a block are kept for the next file of the same invocation. The
+    sequences are cleared when the _new tables are recreated, so they are discarded
+    at the start of every invocation rather than kept for a later run, and when a
+    file is rolled back.
+    Every writer to a table must take its ids from here once it is in use, or its
+    auto increment ids could collide with ids already handed out.
+    """
+
+    def __init__(self, connection, block_size: int = DEFAULT_ID_BLOCK_SIZE):
+        self.connection = connection
+        self.block_size = block_size
+        self.blocks = {}
+
+    def reserve_block(self, table: str) -> range:
+        params = {"table_name": table, "block_size": self.block_size}
+        update_query = "UPDATE txc_id_sequences SET nextId = nextId + :block_size WHERE tableName = :table_name"
+
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(update_query, params)
+                if cursor.rowcount == 0:
+                    # the first block since the table was created starts after its ids
+                    cursor.execute(
+                        f"INSERT IGNORE INTO txc_id_sequences (tableName, nextId) SELECT :table_name, COALESCE(MAX(id), 0) + 1 FROM {table}",
+                        {"table_name": table},
+                    )
+                    cursor.execute(update_query, params)
+
+                cursor.execute(
+                    "SELECT nextId FROM txc_id_sequences WHERE tableName = :table_name",
+                    {"table_name": table},
+                )
+                next_id = cursor.fetchone()[0]
+
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+        return range(next_id - self.block_size, next_id)
+
+    def allocate(self, table: str) -> int:
+        block = self.blocks.get(table)
+        if not block:
+            block = self.reserve_block(table)
+
+        self.blocks[table] = block[1:]
+        return block[0]
+
+    def discard_reserved_ids(self):
+        self.blocks = {}
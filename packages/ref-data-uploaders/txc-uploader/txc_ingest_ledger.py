@@ -0,0 +1,47 @@
+import aurora_data_api
+
+
+def get_content_hash(s3, bucket: str, key: str) -> str:
+    """
+    The S3 ETag of the object, which only changes when its content does, so the file
+    does not need downloading to tell if it has already been ingested.
+    """
+    return s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+
+
+def has_content_been_ingested(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    data_source: str,
+    content_hash: str,
+    file_path: str,
+) -> bool:
+    # the rows of a file carry its path and region, so the same content at another
+    # path is still written
+    query = "SELECT id FROM txc_ingest_ledger_new WHERE dataSource = :data_source AND contentHash = :content_hash AND filePath = :file_path LIMIT 1"
+    cursor.execute(
+        query,
+        {
+            "data_source": data_source,
+            "content_hash": content_hash,
+            "file_path": file_path,
+        },
+    )
+
+    return cursor.fetchone() is not None
+
+
+def record_ingested_content(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    data_source: str,
+    content_hash: str,
+    file_path: str,
+):
+    query = "INSERT IGNORE INTO txc_ingest_ledger_new (dataSource, contentHash, filePath) VALUES (:data_source, :content_hash, :file_path)"
+    cursor.execute(
+        query,
+        {
+            "data_source": data_source,
+            "content_hash": content_hash,
+            "file_path": file_path,
+        },
+    )
@@ -0,0 +1,157 @@
+import xmltodict
+
+TXC_NAMESPACE = "http://www.transxchange.org.uk/"
+XMLTODICT_NAMESPACES = {TXC_NAMESPACE: None}
+
+
+def make_list(item):
+    if not isinstance(item, list):
+        return [item]
+    return item
+
+
+def strip_namespace_declarations(data_dict: dict):
+    # namespace declarations carry no TXC data and their prefixes depend on how
+    # the file was serialised, so they are not part of the parsed document
+    root = data_dict.get("TransXChange") if data_dict else None
+    if isinstance(root, dict):
+        root.pop("@xmlns", None)
+
+    return data_dict
+
+
+def parse_txc(xml_input) -> dict:
+    data_dict = xmltodict.parse(
+        xml_input, process_namespaces=True, namespaces=XMLTODICT_NAMESPACES
+    )
+
+    return strip_namespace_declarations(data_dict)
+
+
+def parse_txc_file(file_path: str) -> dict:
+    with open(file_path, "rb") as xml_file:
+        return parse_txc(xml_file)
+
+
+VEHICLE_JOURNEY_SELECTOR_KEYS = (
+    "VehicleJourneyCode",
+    "LineRef",
+    "JourneyPatternRef",
+    "VehicleJourneyRef",
+)
+
+
+def push_item(parent: dict, key, item):
+    # mirrors how xmltodict collects repeated elements into a list
+    if key not in parent:
+        parent[key] = item
+    elif isinstance(parent[key], list):
+        parent[key].append(item)
+    else:
+        parent[key] = [parent[key], item]
+
+
+def merge_attributes(attrs, item):
+    # xmltodict leaves the attributes of streamed items in the path and does not
+    # strip their text, so both are added back the way parse_txc would have done
+    if isinstance(item, str):
+        item = item.strip() or None
+
+    attributes = {
+        f"@{attr_name}": attr_value
+        for attr_name, attr_value in (attrs or {}).items()
+        if attr_name != "xmlns"
+    }
+
+    if not attributes:
+        return item
+    if item is None:
+        return attributes
+    if isinstance(item, dict):
+        return {**attributes, **item}
+
+    return {**attributes, "#text": item}
+
+
+def stream_txc(
+    xml_input, handle_vehicle_journey, keep_reference_sections: bool = True
+) -> dict:
+    """
+    Parses a TXC document one section item at a time. Each VehicleJourney is passed
+    to handle_vehicle_journey and then discarded, every other item is kept (unless
+    keep_reference_sections is False) and returned in the same shape as parse_txc.
+    Section level attributes and empty sections are not kept.
+    """
+    root = {}
+
+    def handle_item(path, item):
+        (_, root_attrs), (section_name, _), (item_name, item_attrs) = path
+        item = merge_attributes(item_attrs, item)
+
+        if not root and root_attrs:
+            root.update(merge_attributes(root_attrs, {}))
+
+        if section_name == "VehicleJourneys" and item_name == "VehicleJourney":
+            handle_vehicle_journey(item)
+        elif keep_reference_sections:
+            if not isinstance(root.get(section_name), dict):
+                root[section_name] = {}
+            push_item(root[section_name], item_name, item)
+
+        return True
+
+    xmltodict.parse(
+        xml_input,
+        process_namespaces=True,
+        namespaces=XMLTODICT_NAMESPACES,
+        item_depth=3,
+        item_callback=handle_item,
+    )
+
+    return {"TransXChange": root}
+
+
+def parse_txc_reference_sections(file_path: str) -> dict:
+    """
+    Parses everything except the vehicle journeys, which are reduced to the keys
+    used to select journeys for a line. The full journeys are read afterwards with
+    stream_vehicle_journeys. RouteSections and the other reference sections are held
+    in memory in full, as is one selector dict per VehicleJourney.
+    """
+    vehicle_journey_selectors = []
+
+    def handle_vehicle_journey(vehicle_journey):
+        vehicle_journey_selectors.append(
+            {
+                key: vehicle_journey[key]
+                for key in VEHICLE_JOURNEY_SELECTOR_KEYS
+                if key in vehicle_journey
+            }
+        )
+
+    with open(file_path, "rb") as xml_file:
+        data_dict = stream_txc(xml_file, handle_vehicle_journey)
+
+    if vehicle_journey_selectors:
+        data_dict["TransXChange"]["VehicleJourneys"] = {
+            "VehicleJourney": vehicle_journey_selectors
+        }
+
+    return data_dict
+
+
+def stream_vehicle_journeys(file_path: str, chunk_size: int, handle_chunk):
+    chunk = []
+
+    def handle_vehicle_journey(vehicle_journey):
+        nonlocal chunk
+        chunk.append(vehicle_journey)
+        if len(chunk) >= chunk_size:
+            handle_chunk(chunk)
+            chunk = []
+
+    with open(file_path, "rb") as xml_file:
+        stream_txc(xml_file, handle_vehicle_journey, keep_reference_sections=False)
+
+    if chunk:
+        handle_chunk(chunk)
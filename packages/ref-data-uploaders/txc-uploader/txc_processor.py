@@ -1,9 +1,38 @@
 import itertools
+import json
+import os
 from typing import Optional
 
 import aurora_data_api
-import xmltodict
-import xml.etree.ElementTree as eT
+
+from txc_bulk_insert import bulk_insert
+from txc_bulk_load import BulkLoader
+from txc_id_allocator import IdAllocator
+from txc_ingest_ledger import (
+    get_content_hash,
+    has_content_been_ingested,
+    record_ingested_content,
+)
+from txc_cache import NocCache, StopCache, normalise_collated_value
+from txc_document import (
+    TxcDocument,
+    get_inherited_line_refs,
+    get_line_refs_for_vehicle_journey,
+)
+from txc_parser import (
+    make_list,
+    parse_txc_file,
+    parse_txc_reference_sections,
+    stream_vehicle_journeys,
+)
+
+# files over this size stream their vehicle journeys in chunks. Only the journeys are
+# streamed: the other sections, RouteSections included, are still parsed into memory,
+# as is a dict of the selector keys of every VehicleJourney, so memory still grows
+# with the route data and the number of journeys in the file
+DEFAULT_STREAMING_THRESHOLD_BYTES = 50 * 1024 * 1024
+DEFAULT_STREAMING_CHUNK_SIZE = 500
+SERVICE_LOOKUP_BATCH_SIZE = 50
 
 NOC_INTEGRITY_ERROR_MSG = "Cannot add or update a child row: a foreign key constraint fails (`ref_data`.`services`, CONSTRAINT `fk_services_operators_nocCode` FOREIGN KEY (`nocCode`) REFERENCES `operators` (`nocCode`))"
 
@@ -30,12 +59,6 @@ def put_metric_data_by_data_source(cloudwatch, data_source, metric_name, metric_
     )
 
 
-def make_list(item):
-    if not isinstance(item, list):
-        return [item]
-    return item
-
-
 def get_operators(data_dict, data_source, cloudwatch):
     operators = data_dict["TransXChange"].get("Operators", None)
 
@@ -47,15 +70,8 @@ def get_operators(data_dict, data_source, cloudwatch):
     return []
 
 
-def get_services_for_operator(data_dict, operator):
-    if "Services" in data_dict["TransXChange"]:
-        services = make_list(data_dict["TransXChange"]["Services"]["Service"])
-        services_for_operator = [
-            service
-            for service in services
-            if service["RegisteredOperatorRef"] == operator["@id"]
-        ]
-        return services_for_operator
+def get_services_for_operator(document: TxcDocument, operator):
+    return document.get_services_for_operator(operator)
 
 
 def get_vehicle_journeys(data_dict):
@@ -175,51 +191,46 @@ def collect_vehicle_journey(vehicle):
 
 
 def process_journey_pattern_sections(
-    journey_pattern_section_refs: list, raw_journey_pattern_sections: list
+    journey_pattern_section_refs: list, document: TxcDocument
 ):
     journey_pattern_sections = []
     for journey_pattern_section_ref in journey_pattern_section_refs:
-        for raw_journey_pattern_section in raw_journey_pattern_sections:
-            selected_raw_journey_pattern_section = {}
-
-            if raw_journey_pattern_section["@id"] == journey_pattern_section_ref:
-                selected_raw_journey_pattern_section = raw_journey_pattern_section
+        selected_raw_journey_pattern_section = document.get_journey_pattern_section(
+            journey_pattern_section_ref
+        )
 
-            if len(selected_raw_journey_pattern_section) > 0:
-                raw_journey_pattern_timing_links = make_list(
-                    selected_raw_journey_pattern_section.get("JourneyPatternTimingLink")
-                )
-                journey_pattern_timing_links = []
-                for raw_journey_pattern_timing_link in raw_journey_pattern_timing_links:
-                    if raw_journey_pattern_timing_link:
-                        link_from = raw_journey_pattern_timing_link.get("From")
-                        link_to = raw_journey_pattern_timing_link.get("To")
-                        journey_pattern_timing_link = {
-                            "from_atco_code": link_from["StopPointRef"],
-                            "from_timing_status": link_from.get("TimingStatus", None),
-                            "from_sequence_number": link_from.get("@SequenceNumber"),
-                            "to_atco_code": link_to["StopPointRef"],
-                            "to_timing_status": link_to.get("TimingStatus", None),
-                            "run_time": raw_journey_pattern_timing_link.get(
-                                "RunTime", None
-                            ),
-                            "to_sequence_number": link_to.get("@SequenceNumber"),
-                            "route_link_ref": raw_journey_pattern_timing_link.get(
-                                "RouteLinkRef", None
-                            ),
-                        }
-                        journey_pattern_timing_links.append(journey_pattern_timing_link)
-
-                journey_pattern_sections.append(journey_pattern_timing_links)
+        if selected_raw_journey_pattern_section:
+            raw_journey_pattern_timing_links = make_list(
+                selected_raw_journey_pattern_section.get("JourneyPatternTimingLink")
+            )
+            journey_pattern_timing_links = []
+            for raw_journey_pattern_timing_link in raw_journey_pattern_timing_links:
+                if raw_journey_pattern_timing_link:
+                    link_from = raw_journey_pattern_timing_link.get("From")
+                    link_to = raw_journey_pattern_timing_link.get("To")
+                    journey_pattern_timing_link = {
+                        "from_atco_code": link_from["StopPointRef"],
+                        "from_timing_status": link_from.get("TimingStatus", None),
+                        "from_sequence_number": link_from.get("@SequenceNumber"),
+                        "to_atco_code": link_to["StopPointRef"],
+                        "to_timing_status": link_to.get("TimingStatus", None),
+                        "run_time": raw_journey_pattern_timing_link.get(
+                            "RunTime", None
+                        ),
+                        "to_sequence_number": link_to.get("@SequenceNumber"),
+                        "route_link_ref": raw_journey_pattern_timing_link.get(
+                            "RouteLinkRef", None
+                        ),
+                    }
+                    journey_pattern_timing_links.append(journey_pattern_timing_link)
+
+            journey_pattern_sections.append(journey_pattern_timing_links)
 
     return journey_pattern_sections
 
 
-def collect_journey_patterns(data: dict, service: dict):
+def collect_journey_patterns(document: TxcDocument, service: dict):
     raw_journey_patterns = make_list(service["StandardService"]["JourneyPattern"])
-    raw_journey_pattern_sections = make_list(
-        data["TransXChange"]["JourneyPatternSections"]["JourneyPatternSection"]
-    )
 
     journey_patterns_section_refs_and_info = (
         collect_journey_pattern_section_refs_and_info(raw_journey_patterns)
@@ -232,7 +243,7 @@ def collect_journey_patterns(data: dict, service: dict):
         )
         processed_journey_pattern = {
             "journey_pattern_sections": process_journey_pattern_sections(
-                journey_pattern_section_refs, raw_journey_pattern_sections
+                journey_pattern_section_refs, document
             ),
             "journey_pattern_info": journey_pattern["journey_pattern_info"],
             "journey_pattern_section_refs": journey_pattern_section_refs,
@@ -242,20 +253,77 @@ def collect_journey_patterns(data: dict, service: dict):
     return journey_patterns
 
 
+def get_journey_patterns_for_service(document: TxcDocument, service: dict):
+    service_key = id(service)
+    if service_key not in document.journey_patterns_by_service:
+        document.journey_patterns_by_service[service_key] = collect_journey_patterns(
+            document, service
+        )
+
+    return document.journey_patterns_by_service[service_key]
+
+
+class JourneyPatternRegistry:
+    """
+    The (destinationDisplay, direction, routeRef, sectionRefs) signatures of the journey
+    patterns under each service written during a file. Services created during the file
+    start with none, services that already existed have theirs loaded with one query
+    the first time they are checked.
+    """
+
+    def __init__(self):
+        self.signatures_by_service = {}
+
+    def add_service(self, operator_service_id):
+        self.signatures_by_service.setdefault(operator_service_id, set())
+
+    def get_signatures(self, cursor, operator_service_id) -> set:
+        if operator_service_id not in self.signatures_by_service:
+            self.signatures_by_service[operator_service_id] = (
+                get_journey_pattern_signatures(cursor, operator_service_id)
+            )
+
+        return self.signatures_by_service[operator_service_id]
+
+    def journey_pattern_exists(self, cursor, operator_service_id, signature) -> bool:
+        return normalise_collated_key(signature) in self.get_signatures(
+            cursor, operator_service_id
+        )
+
+    def add_journey_pattern(self, cursor, operator_service_id, signature):
+        self.get_signatures(cursor, operator_service_id).add(
+            normalise_collated_key(signature)
+        )
+
+
 def iterate_through_journey_patterns_and_run_insert_queries(
     cursor,
-    data: dict,
+    document: TxcDocument,
     operator_service_id: str,
     service: dict,
     vehicle_journeys: list,
     journey_pattern_to_use_for_tracks: str,
     logger,
+    journey_pattern_registry: Optional[JourneyPatternRegistry] = None,
+    stop_cache: Optional[StopCache] = None,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
+    id_allocator: Optional[IdAllocator] = None,
 ):
-    journey_patterns = collect_journey_patterns(data, service)
+    if journey_pattern_registry is None:
+        journey_pattern_registry = JourneyPatternRegistry()
+    if stop_cache is None:
+        stop_cache = StopCache()
+
+    journey_patterns = get_journey_patterns_for_service(document, service)
     admin_area_codes = set()
     route_ref_for_tracks = None
     link_refs_for_tracks = None
     centre_stop = None
+    # with an id allocator the journey patterns and their links are inserted together
+    # once every journey pattern of the service has been given an id
+    journey_pattern_values = []
+    link_values = []
 
     vehicle_journey_journey_pattern_refs = [
         vehicle_journey["journey_pattern_ref"] for vehicle_journey in vehicle_journeys
@@ -277,19 +345,37 @@ def iterate_through_journey_patterns_and_run_insert_queries(
 
         joined_section_refs = "".join(sorted_journey_pattern_section_refs)
 
-        if check_journey_pattern_exists(
-            cursor,
-            operator_service_id,
+        signature = (
             journey_pattern_info["destination_display"],
             journey_pattern_info["direction"],
             journey_pattern_info["route_ref"],
             joined_section_refs,
-            logger,
+        )
+
+        if journey_pattern_registry.journey_pattern_exists(
+            cursor, operator_service_id, signature
         ):
+            logger.info(
+                f"Existing journey pattern found - '{operator_service_id}' - '{signature[0]}' - '{signature[1]}' - '{signature[2]}' - '{signature[3]}'"
+            )
             continue
 
-        journey_pattern_id = insert_into_txc_journey_pattern_table(
-            cursor, operator_service_id, journey_pattern_info, joined_section_refs
+        if id_allocator is None:
+            journey_pattern_id = insert_into_txc_journey_pattern_table(
+                cursor, operator_service_id, journey_pattern_info, joined_section_refs
+            )
+        else:
+            journey_pattern_id = id_allocator.allocate("service_journey_patterns_new")
+            journey_pattern_values.append(
+                {
+                    "id": journey_pattern_id,
+                    **get_journey_pattern_values(
+                        operator_service_id, journey_pattern_info, joined_section_refs
+                    ),
+                }
+            )
+        journey_pattern_registry.add_journey_pattern(
+            cursor, operator_service_id, signature
         )
 
         links = []
@@ -300,9 +386,14 @@ def iterate_through_journey_patterns_and_run_insert_queries(
                 stop_codes.add(journey_pattern_timing_link["to_atco_code"])
                 links.append(journey_pattern_timing_link)
 
-        insert_into_txc_journey_pattern_link_table(cursor, links, journey_pattern_id)
+        if id_allocator is None:
+            insert_into_txc_journey_pattern_link_table(
+                cursor, links, journey_pattern_id, bulk_insert_limits, bulk_loader
+            )
+        else:
+            link_values.extend(get_journey_pattern_link_values(links, journey_pattern_id))
 
-        admin_area_codes.update(get_admin_area_codes(cursor, stop_codes))
+        admin_area_codes.update(get_admin_area_codes(cursor, stop_codes, stop_cache))
 
         if (
             journey_pattern_to_use_for_tracks is not None
@@ -318,11 +409,21 @@ def iterate_through_journey_patterns_and_run_insert_queries(
                 links[len(links) // 2]["from_atco_code"] if len(links) > 0 else None
             )
 
+    if journey_pattern_values:
+        insert_journey_patterns_with_ids(
+            cursor, journey_pattern_values, bulk_insert_limits
+        )
+        insert_journey_pattern_link_values(
+            cursor, link_values, bulk_insert_limits, bulk_loader
+        )
+
     if admin_area_codes:
         insert_admin_area_codes(cursor, admin_area_codes, operator_service_id)
 
     if centre_stop:
-        stop_location = get_stop_location_by_atco_code(cursor, centre_stop)
+        stop_location = get_stop_location_by_atco_code(
+            cursor, centre_stop, stop_cache
+        )
 
         if stop_location:
             insert_centre_point(cursor, stop_location, operator_service_id)
@@ -331,15 +432,11 @@ def iterate_through_journey_patterns_and_run_insert_queries(
 
 
 def get_stop_location_by_atco_code(
-    cursor: aurora_data_api.AuroraDataAPICursor, centre_stop
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    centre_stop,
+    stop_cache: Optional[StopCache] = None,
 ):
-    query = "SELECT longitude, latitude FROM stops_new WHERE atcoCode = :centre_stop"
-    cursor.execute(
-        query,
-        {"centre_stop": centre_stop},
-    )
-
-    return cursor.fetchone()
+    return (stop_cache or StopCache()).get_location(cursor, centre_stop)
 
 
 def insert_centre_point(
@@ -368,18 +465,25 @@ def insert_admin_area_codes(
     cursor.execute(query, codes_dict)
 
 
-def get_admin_area_codes(cursor: aurora_data_api.AuroraDataAPICursor, stop_codes):
-    codes_dict = {f"k{k}": v for k, v in enumerate(stop_codes)}
-    query = "SELECT DISTINCT localities.administrativeAreaCode from localities_new as localities inner join stops_new as stops on localities.nptgLocalityCode = stops.nptgLocalityCode WHERE stops.atcoCode IN (%s)"
-    keys = ", ".join(list([f":{v}" for v in codes_dict.keys()]))
-    query = query % keys
-
-    cursor.execute(query, codes_dict)
-
-    result = cursor.fetchall()
-    admin_area_codes = list(sum(result, ())) if result and len(result) > 0 else list()
-
-    return admin_area_codes
+def get_admin_area_codes(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    stop_codes,
+    stop_cache: Optional[StopCache] = None,
+):
+    return (stop_cache or StopCache()).get_admin_area_codes(cursor, stop_codes)
+
+
+def get_journey_pattern_values(
+    operator_service_id, journey_pattern_info, joined_section_refs
+) -> dict:
+    return {
+        "op_service_id": operator_service_id,
+        "destination_display": journey_pattern_info["destination_display"],
+        "direction": journey_pattern_info["direction"],
+        "route_ref": journey_pattern_info["route_ref"],
+        "journey_pattern_ref": journey_pattern_info["journey_pattern_ref"],
+        "section_refs": joined_section_refs,
+    }
 
 
 def insert_into_txc_journey_pattern_table(
@@ -391,23 +495,42 @@ def insert_into_txc_journey_pattern_table(
     query = "INSERT INTO service_journey_patterns_new (operatorServiceId, destinationDisplay, direction, routeRef, journeyPatternRef, sectionRefs) VALUES (:op_service_id, :destination_display, :direction, :route_ref, :journey_pattern_ref, :section_refs)"
     cursor.execute(
         query,
-        {
-            "op_service_id": operator_service_id,
-            "destination_display": journey_pattern_info["destination_display"],
-            "direction": journey_pattern_info["direction"],
-            "route_ref": journey_pattern_info["route_ref"],
-            "journey_pattern_ref": journey_pattern_info["journey_pattern_ref"],
-            "section_refs": joined_section_refs,
-        },
+        get_journey_pattern_values(
+            operator_service_id, journey_pattern_info, joined_section_refs
+        ),
     )
     journey_pattern_id = cursor.lastrowid
     return journey_pattern_id
 
 
+def insert_journey_patterns_with_ids(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    values: list,
+    bulk_insert_limits: Optional[dict] = None,
+):
+    query = "INSERT INTO service_journey_patterns_new (id, operatorServiceId, destinationDisplay, direction, routeRef, journeyPatternRef, sectionRefs) VALUES (:id, :op_service_id, :destination_display, :direction, :route_ref, :journey_pattern_ref, :section_refs)"
+    bulk_insert(cursor, query, values, bulk_insert_limits)
+
+
+def insert_bulk_rows(
+    cursor,
+    query: str,
+    values: list,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
+):
+    if bulk_loader is not None:
+        bulk_loader.stage_rows(query, values)
+    else:
+        bulk_insert(cursor, query, values, bulk_insert_limits)
+
+
 def insert_into_txc_vehicle_journey_table(
     cursor: aurora_data_api.AuroraDataAPICursor,
     vehicle_journeys_info,
     operator_service_id,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
 ):
     values = [
         {
@@ -423,13 +546,11 @@ def insert_into_txc_vehicle_journey_table(
     ]
 
     query = "INSERT INTO vehicle_journeys_new (vehicleJourneyCode, serviceRef, lineRef, journeyPatternRef, departureTime, journeyCode, operatorServiceId) VALUES (:vehicle_journey_code, :service_ref, :line_ref, :journey_pattern_ref, :departure_time, :journey_code, :operator_service_id)"
-    cursor.executemany(query, values)
+    insert_bulk_rows(cursor, query, values, bulk_insert_limits, bulk_loader)
 
 
-def insert_into_txc_journey_pattern_link_table(
-    cursor: aurora_data_api.AuroraDataAPICursor, links, journey_pattern_id
-):
-    values = [
+def get_journey_pattern_link_values(links, journey_pattern_id) -> list:
+    return [
         {
             "journey_pattern_id": journey_pattern_id,
             "from_atco_code": link["from_atco_code"],
@@ -443,9 +564,32 @@ def insert_into_txc_journey_pattern_link_table(
         }
         for order, link in enumerate(links)
     ]
+
+
+def insert_journey_pattern_link_values(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    values: list,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
+):
     query = """INSERT INTO service_journey_pattern_links_new (journeyPatternId, fromAtcoCode, fromTimingStatus, fromSequenceNumber,
         toAtcoCode, toTimingStatus, toSequenceNumber, runtime, orderInSequence) VALUES (:journey_pattern_id, :from_atco_code, :from_timing_status, :from_sequence_number, :to_atco_code, :to_timing_status, :to_sequence_number, :run_time, :order)"""
-    cursor.executemany(query, values)
+    insert_bulk_rows(cursor, query, values, bulk_insert_limits, bulk_loader)
+
+
+def insert_into_txc_journey_pattern_link_table(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    links,
+    journey_pattern_id,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
+):
+    insert_journey_pattern_link_values(
+        cursor,
+        get_journey_pattern_link_values(links, journey_pattern_id),
+        bulk_insert_limits,
+        bulk_loader,
+    )
 
 
 def insert_into_txc_operator_service_table(
@@ -456,8 +600,8 @@ def insert_into_txc_operator_service_table(
     region_code,
     data_source,
     file_path,
-    cloudwatch,
     logger,
+    fingerprint: Optional[str] = None,
 ):
     (
         noc_code,
@@ -473,8 +617,8 @@ def insert_into_txc_operator_service_table(
         mode,
     ) = extract_data_for_txc_operator_service_table(operator, service, line)
 
-    query = """INSERT INTO services_new (nocCode, lineName, lineId, startDate, endDate, operatorShortName, inboundDirectionDescription, outboundDirectionDescription, serviceDescription, serviceCode, regionCode, dataSource, origin, destination, mode, filePath)
-        VALUES (:noc_code, :line_name, :line_id, :start_date, :end_date, :operator_short_name, :inbound_direction_description, :outbound_direction_description, :service_description, :service_code, :region_code, :data_source, :origin, :destination, :mode, :file_path)"""
+    query = """INSERT INTO services_new (nocCode, lineName, lineId, startDate, endDate, operatorShortName, inboundDirectionDescription, outboundDirectionDescription, serviceDescription, serviceCode, regionCode, dataSource, origin, destination, mode, filePath, fingerprint)
+        VALUES (:noc_code, :line_name, :line_id, :start_date, :end_date, :operator_short_name, :inbound_direction_description, :outbound_direction_description, :service_description, :service_code, :region_code, :data_source, :origin, :destination, :mode, :file_path, :fingerprint)"""
 
     line_id = line.get("@id", "")
     line_name = line.get("LineName", "")
@@ -502,65 +646,127 @@ def insert_into_txc_operator_service_table(
                 "destination": destination,
                 "mode": mode,
                 "file_path": file_path,
+                "fingerprint": fingerprint,
             },
         )
         operator_service_id = cursor.lastrowid
         return operator_service_id
     except aurora_data_api.IntegrityError as e:
         if e.args[1] == NOC_INTEGRITY_ERROR_MSG:
+            # a NOC removed from operators since the NocCache was loaded
             logger.info(
                 f"NOC not found in database - '{noc_code}' - '{operator_short_name}'"
             )
-            put_metric_data_by_data_source(cloudwatch, data_source, "InvalidNoc", 1)
             return None
         raise e
 
 
-def check_journey_pattern_exists(
+def get_invalid_nocs(
     cursor: aurora_data_api.AuroraDataAPICursor,
-    op_service_id,
-    destination_display,
-    direction,
-    route_ref,
-    joined_section_refs,
+    operators: list,
+    noc_cache: NocCache,
     logger,
-):
-    query = """
-        SELECT id FROM service_journey_patterns_new
-        WHERE operatorServiceId <=> :op_service_id AND destinationDisplay <=> :destination_display AND direction <=> :direction AND routeRef <=> :route_ref AND sectionRefs <=> :section_refs
-        LIMIT 1
+) -> set:
+    invalid_nocs = set()
+    for operator in operators:
+        noc = operator.get("NationalOperatorCode")
+        if noc is not None and not noc_cache.is_valid_noc(cursor, noc):
+            logger.info(
+                f"NOC not found in database - '{noc}' - '{operator.get('OperatorShortName', '')}'"
+            )
+            invalid_nocs.add(noc)
+
+    return invalid_nocs
+
+
+def get_service_fingerprints_for_file(
+    cursor: aurora_data_api.AuroraDataAPICursor, file_path: str
+) -> dict:
+    """
+    The fingerprint of each service row a file inserted, by id, with whether another
+    file has written rows for the same service since.
+    """
+    query = "SELECT id, fingerprint, (SELECT COUNT(*) FROM service_file_fingerprints_new WHERE operatorServiceId = services_new.id) FROM services_new WHERE filePath = :file_path"
+    cursor.execute(query, {"file_path": file_path})
+
+    return {row[0]: (row[1], row[2] > 0) for row in cursor.fetchall() or []}
+
+
+def get_shared_service_fingerprints_for_file(
+    cursor: aurora_data_api.AuroraDataAPICursor, file_path: str
+) -> list:
+    """
+    The (id, fingerprint) of each service row inserted by another file that a file
+    has written rows for.
     """
+    query = "SELECT operatorServiceId, fingerprint FROM service_file_fingerprints_new WHERE filePath = :file_path"
+    cursor.execute(query, {"file_path": file_path})
+
+    return [(row[0], row[1]) for row in cursor.fetchall() or []]
+
 
+def insert_service_file_fingerprint(
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    operator_service_id,
+    file_path: str,
+    fingerprint: Optional[str],
+):
+    query = "INSERT INTO service_file_fingerprints_new (operatorServiceId, filePath, fingerprint) VALUES (:id, :file_path, :fingerprint)"
     cursor.execute(
         query,
-        {
-            "op_service_id": op_service_id,
-            "destination_display": destination_display,
-            "direction": direction,
-            "route_ref": route_ref,
-            "section_refs": joined_section_refs,
-        },
+        {"id": operator_service_id, "file_path": file_path, "fingerprint": fingerprint},
     )
-    result = cursor.fetchone()
 
-    journey_pattern_id = result[0] if result and len(result) > 0 else None
-    if journey_pattern_id:
-        logger.info(
-            f"Existing journey pattern found - '{op_service_id}' - '{destination_display}' - '{direction}' - '{route_ref}' - '{joined_section_refs}'"
-        )
 
-    return True if journey_pattern_id else False
+def collect_service_fingerprints(document: TxcDocument, operators: list) -> set:
+    return {
+        document.get_service_fingerprint(operator, service)
+        for operator in operators
+        if "NationalOperatorCode" in operator
+        for service in document.get_services_for_operator(operator)
+    }
 
 
-def check_txc_line_exists(
-    cursor: aurora_data_api.AuroraDataAPICursor,
-    operator,
-    service,
-    line,
-    data_source,
-    cloudwatch,
-    logger,
+def delete_services(cursor: aurora_data_api.AuroraDataAPICursor, operator_service_ids):
+    """
+    Deletes services and every row written for them, so a service that has changed
+    is written again from scratch rather than on top of its old rows. Only services
+    no other file has written rows for are deleted, as the rows of each file are not
+    told apart.
+    """
+    ids_dict = {f"id{k}": v for k, v in enumerate(operator_service_ids)}
+    keys = ", ".join(f":{v}" for v in ids_dict.keys())
+
+    for query in [
+        "DELETE FROM service_journey_pattern_links_new WHERE journeyPatternId IN (SELECT id FROM service_journey_patterns_new WHERE operatorServiceId IN (%s))",
+        "DELETE FROM service_journey_patterns_new WHERE operatorServiceId IN (%s)",
+        "DELETE FROM vehicle_journeys_new WHERE operatorServiceId IN (%s)",
+        "DELETE FROM tracks_new WHERE operatorServiceId IN (%s)",
+        "DELETE FROM service_admin_area_codes_new WHERE serviceId IN (%s)",
+        "DELETE FROM services_new WHERE id IN (%s)",
+    ]:
+        cursor.execute(query % keys, ids_dict)
+
+
+def clear_service_fingerprint(
+    cursor: aurora_data_api.AuroraDataAPICursor, operator_service_id, file_path: str
 ):
+    # a service sharing its row with another service is rewritten on the next ingest,
+    # and a row written by another file keeps the fingerprint it has there
+    query = "UPDATE services_new SET fingerprint = NULL WHERE id = :id AND filePath = :file_path"
+    cursor.execute(query, {"id": operator_service_id, "file_path": file_path})
+
+
+def get_journey_pattern_signatures(
+    cursor: aurora_data_api.AuroraDataAPICursor, op_service_id
+) -> set:
+    query = "SELECT destinationDisplay, direction, routeRef, sectionRefs FROM service_journey_patterns_new WHERE operatorServiceId = :op_service_id"
+    cursor.execute(query, {"op_service_id": op_service_id})
+
+    return {normalise_collated_key(tuple(row)) for row in cursor.fetchall() or []}
+
+
+def get_txc_line_key(operator, service, line, data_source) -> tuple:
     (
         noc_code,
         start_date,
@@ -575,35 +781,84 @@ def check_txc_line_exists(
         mode,
     ) = extract_data_for_txc_operator_service_table(operator, service, line)
 
-    query = """
-        SELECT id FROM services_new
-        WHERE nocCode <=> :noc_code AND lineName <=> :line_name AND serviceCode <=> :service_code AND startDate <=> :start_date AND endDate <=> :end_date AND dataSource <=> :data_source
-        LIMIT 1
+    return (
+        noc_code,
+        line.get("LineName", ""),
+        service_code,
+        start_date,
+        end_date,
+        data_source,
+    )
+
+
+def normalise_collated_key(key: tuple) -> tuple:
+    return tuple(normalise_collated_value(value) for value in key)
+
+
+def get_existing_txc_line_ids(
+    cursor: aurora_data_api.AuroraDataAPICursor, line_keys: list, logger
+):
+    """
+    Finds the services_new id for each (nocCode, lineName, serviceCode, startDate,
+    endDate, dataSource) key, sending up to SERVICE_LOOKUP_BATCH_SIZE keys per query.
+    Each key keeps its own LIMIT 1 select so rows match exactly as they would if the
+    keys were looked up one at a time.
     """
+    unique_line_keys = list(dict.fromkeys(line_keys))
+    existing_line_ids = {}
+    query_count = 0
+
+    for batch_start in range(0, len(unique_line_keys), SERVICE_LOOKUP_BATCH_SIZE):
+        batch = unique_line_keys[batch_start : batch_start + SERVICE_LOOKUP_BATCH_SIZE]
+        selects = []
+        params = {}
+
+        for candidate, line_key in enumerate(batch):
+            selects.append(
+                f"(SELECT {candidate} AS candidate, id FROM services_new WHERE nocCode <=> :noc_code_{candidate} AND lineName <=> :line_name_{candidate} AND serviceCode <=> :service_code_{candidate} AND startDate <=> :start_date_{candidate} AND endDate <=> :end_date_{candidate} AND dataSource <=> :data_source_{candidate} LIMIT 1)"
+            )
+            (
+                params[f"noc_code_{candidate}"],
+                params[f"line_name_{candidate}"],
+                params[f"service_code_{candidate}"],
+                params[f"start_date_{candidate}"],
+                params[f"end_date_{candidate}"],
+                params[f"data_source_{candidate}"],
+            ) = line_key
+
+        cursor.execute(" UNION ALL ".join(selects), params)
+        query_count += 1
+
+        for candidate, operator_service_id in cursor.fetchall() or []:
+            existing_line_ids[normalise_collated_key(batch[candidate])] = (
+                operator_service_id
+            )
 
-    line_name = line.get("LineName", "")
-    cursor.execute(
-        query,
-        {
-            "noc_code": noc_code,
-            "line_name": line_name,
-            "service_code": service_code,
-            "start_date": start_date,
-            "end_date": end_date,
-            "data_source": data_source,
-        },
+    logger.info(
+        f"Resolved {len(line_keys)} line existence checks with {query_count} queries, saving {len(line_keys) - query_count} round trips"
     )
-    result = cursor.fetchone()
 
-    operator_service_id = result[0] if result and len(result) > 0 else None
-    if operator_service_id:
-        logger.info(
-            f"Existing line found - '{noc_code}' - '{line_name}' - '{service_code}' - '{start_date}' - '{data_source}'"
-        )
-    return operator_service_id
+    return existing_line_ids
+
+
+def collect_txc_line_keys(document: TxcDocument, operators: list, data_source) -> list:
+    line_keys = []
+    for operator in operators:
+        if "NationalOperatorCode" not in operator:
+            continue
+        for service in document.get_services_for_operator(operator):
+            if not service.get("Lines") or "StandardService" not in service:
+                continue
+            for line in get_lines_for_service(service):
+                if line:
+                    line_keys.append(
+                        get_txc_line_key(operator, service, line, data_source)
+                    )
+
+    return line_keys
 
 
-def check_file_has_usable_data(data: dict, service: dict) -> bool:
+def check_file_has_usable_data(document: TxcDocument, service: dict) -> bool:
     def service_has_journey_patterns(service: dict) -> bool:
         return "JourneyPattern" in service.get("StandardService")  # type: ignore
 
@@ -613,8 +868,10 @@ def check_file_has_usable_data(data: dict, service: dict) -> bool:
     def journey_pattern_sections_has_journey_pattern_section(data: dict) -> bool:
         return "JourneyPatternSection" in data.get("TransXChange", {}).get("JourneyPatternSections")  # type: ignore
 
-    def all_journey_pattern_sections_are_not_empty(data: dict, service: dict) -> bool:
-        journey_patterns = collect_journey_patterns(data, service)
+    def all_journey_pattern_sections_are_not_empty(
+        document: TxcDocument, service: dict
+    ) -> bool:
+        journey_patterns = get_journey_patterns_for_service(document, service)
         for jp in journey_patterns:
             for jps in jp.get("journey_pattern_sections"):
                 # if the journey_pattern_section is empty
@@ -622,16 +879,24 @@ def check_file_has_usable_data(data: dict, service: dict) -> bool:
                     return False
         return True
 
-    return (
-        service_has_journey_patterns(service)
-        and data_has_journey_pattern_sections(data)
-        and journey_pattern_sections_has_journey_pattern_section(data)
-        and all_journey_pattern_sections_are_not_empty(data, service)
-    )
+    service_key = id(service)
+    if service_key not in document.usable_data_by_service:
+        document.usable_data_by_service[service_key] = (
+            service_has_journey_patterns(service)
+            and data_has_journey_pattern_sections(document.data)
+            and journey_pattern_sections_has_journey_pattern_section(document.data)
+            and all_journey_pattern_sections_are_not_empty(document, service)
+        )
+
+    return document.usable_data_by_service[service_key]
 
 
 def insert_into_txc_tracks_table(
-    cursor: aurora_data_api.AuroraDataAPICursor, tracks, operator_service_id
+    cursor: aurora_data_api.AuroraDataAPICursor,
+    tracks,
+    operator_service_id,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
 ):
     values = [
         {
@@ -643,28 +908,21 @@ def insert_into_txc_tracks_table(
     ]
 
     query = """INSERT INTO tracks_new (operatorServiceId, longitude, latitude) VALUES (:operator_service_id, :longitude, :latitude)"""
-    cursor.executemany(query, values)
+    insert_bulk_rows(cursor, query, values, bulk_insert_limits, bulk_loader)
 
 
-def collect_track_data(route_sections, route_section_refs, link_refs):
+def collect_track_data(document: TxcDocument, route_section_refs, link_refs):
     routes = []
 
     for ref in route_section_refs:
-        route_section = next(
-            (item for item in route_sections if item["@id"] == ref), None
-        )
+        route_section = document.get_route_section(ref)
 
         if route_section is not None:
             route_links = route_section.get("RouteLink", None)
 
             if route_links is not None:
-                route_links_list = make_list(route_links)
-
                 for link_ref in link_refs:
-                    route_link = next(
-                        (item for item in route_links_list if item["@id"] == link_ref),
-                        None,
-                    )
+                    route_link = document.get_route_link(ref, link_ref)
 
                     if route_link is not None:
                         trackData = route_link.get("Track", None)
@@ -702,52 +960,30 @@ def collect_track_data(route_sections, route_section_refs, link_refs):
 
 
 def select_route_and_run_insert_query(
-    cursor, data: dict, operator_service_id: str, route_ref: str, link_refs: list
+    cursor,
+    document: TxcDocument,
+    operator_service_id: str,
+    route_ref: str,
+    link_refs: list,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_loader: Optional[BulkLoader] = None,
 ):
-    routes = (
-        None
-        if data["TransXChange"].get("Routes", None) is None
-        else make_list(data["TransXChange"]["Routes"]["Route"])
-    )
-    route_sections = (
-        None
-        if data["TransXChange"].get("RouteSections", None) is None
-        else make_list(data["TransXChange"]["RouteSections"]["RouteSection"])
-    )
+    route = document.get_route(route_ref)
 
-    if routes is not None:
-        route_section_refs = next(
-            (item for item in routes if item["@id"] == route_ref), None
-        ).get("RouteSectionRef", None)
+    if route is not None:
+        route_section_refs = route.get("RouteSectionRef", None)
 
         if route_section_refs is not None:
             tracks = collect_track_data(
-                route_sections, make_list(route_section_refs), link_refs
+                document, make_list(route_section_refs), link_refs
+            )
+            insert_into_txc_tracks_table(
+                cursor, tracks, operator_service_id, bulk_insert_limits, bulk_loader
             )
-            insert_into_txc_tracks_table(cursor, tracks, operator_service_id)
 
 
-def format_vehicle_journeys(vehicle_journeys: list, line_id: str):
-    vehicle_journey_refs = [
-        journey["VehicleJourneyRef"]
-        for journey in vehicle_journeys
-        if journey["LineRef"] == line_id
-        and "JourneyPatternRef" not in journey
-        and "VehicleJourneyRef" in journey
-        and "LineRef" in journey
-    ]
-    vehicle_journeys_for_line = [
-        journey
-        for journey in vehicle_journeys
-        if "JourneyPatternRef" in journey
-        and (
-            ("LineRef" in journey and journey["LineRef"] == line_id)
-            or (
-                "VehicleJourneyCode" in journey
-                and journey["VehicleJourneyCode"] in vehicle_journey_refs
-            )
-        )
-    ]
+def format_vehicle_journeys(document: TxcDocument, line_id: str):
+    vehicle_journeys_for_line = document.get_vehicle_journeys_for_line(line_id)
 
     vehicle_journeys_data = []
     journey_pattern_count = {}
@@ -774,6 +1010,65 @@ def format_vehicle_journeys(vehicle_journeys: list, line_id: str):
     return vehicle_journeys_data, journey_pattern_to_use
 
 
+class StreamedVehicleJourneys:
+    """
+    Vehicle journeys for a file parsed with parse_txc_reference_sections. The lines
+    that would have had journeys inserted are recorded while the file is written, then
+    the journeys are read from the file again and inserted chunk_size at a time.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int, data: dict):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.operator_service_ids_by_line = {}
+        self.inherited_line_refs = get_inherited_line_refs(
+            get_vehicle_journeys(data) or []
+        )
+
+    def add_line(self, line_id: str, operator_service_id):
+        self.operator_service_ids_by_line.setdefault(line_id, []).append(
+            operator_service_id
+        )
+
+    def write(
+        self,
+        cursor,
+        bulk_insert_limits: Optional[dict] = None,
+        bulk_loader: Optional[BulkLoader] = None,
+    ):
+        def write_chunk(vehicle_journeys: list):
+            vehicle_journeys_by_service = {}
+            for vehicle_journey in vehicle_journeys:
+                if "JourneyPatternRef" not in vehicle_journey:
+                    continue
+
+                vehicle_journey_info = collect_vehicle_journey(vehicle_journey)
+                for line_ref in get_line_refs_for_vehicle_journey(
+                    vehicle_journey, self.inherited_line_refs
+                ):
+                    for operator_service_id in self.operator_service_ids_by_line.get(
+                        line_ref, []
+                    ):
+                        vehicle_journeys_by_service.setdefault(
+                            operator_service_id, []
+                        ).append(vehicle_journey_info)
+
+            for (
+                operator_service_id,
+                vehicle_journeys_info,
+            ) in vehicle_journeys_by_service.items():
+                insert_into_txc_vehicle_journey_table(
+                    cursor,
+                    vehicle_journeys_info,
+                    operator_service_id,
+                    bulk_insert_limits,
+                    bulk_loader,
+                )
+
+        if self.operator_service_ids_by_line:
+            stream_vehicle_journeys(self.file_path, self.chunk_size, write_chunk)
+
+
 def write_to_database(
     data: dict,
     region_code: Optional[str],
@@ -782,7 +1077,25 @@ def write_to_database(
     db_connection: aurora_data_api.AuroraDataAPIClient,
     logger,
     cloudwatch,
+    vehicle_journey_stream: Optional[StreamedVehicleJourneys] = None,
+    stop_cache: Optional[StopCache] = None,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_load_target=None,
+    id_allocator: Optional[IdAllocator] = None,
+    content_hash: Optional[str] = None,
+    incremental: bool = False,
+    noc_cache: Optional[NocCache] = None,
 ):
+    if stop_cache is None:
+        stop_cache = StopCache()
+    bulk_loader = BulkLoader(bulk_load_target) if bulk_load_target else None
+
+    def rollback():
+        db_connection.rollback()
+        # the ids of a block are kept for the next file, unless this file failed
+        if id_allocator is not None:
+            id_allocator.discard_reserved_ids()
+
     try:
         operators = get_operators(data, data_source, cloudwatch)
 
@@ -792,7 +1105,80 @@ def write_to_database(
 
             return False
 
+        document = TxcDocument(data)
+        if incremental and vehicle_journey_stream is not None:
+            # the vehicle journeys of a streamed file are not in its fingerprints
+            logger.info(f"Streamed file '{key}' is written in full")
+            incremental = False
+
         with db_connection.cursor() as cursor:
+            invalid_nocs = (
+                get_invalid_nocs(cursor, operators, noc_cache, logger)
+                if noc_cache is not None
+                else set()
+            )
+            incremental_stats = {
+                "services": 0,
+                "unchanged_services": 0,
+                "unchanged_lines": 0,
+                "unchanged_vehicle_journeys": 0,
+                "deleted_services": 0,
+                "shared_services_not_rewritten": 0,
+            }
+            previous_fingerprints = set()
+            # service rows this file has written to before that other files have too
+            shared_service_ids = set()
+            if incremental:
+                # services that changed or left the file are deleted before the line
+                # lookup, so their rows are not found and written on top of. A service
+                # another file has written rows for is kept, as its rows are not
+                # deleted with it
+                current_fingerprints = collect_service_fingerprints(document, operators)
+                stale_service_ids = []
+                for operator_service_id, (
+                    fingerprint,
+                    is_shared,
+                ) in get_service_fingerprints_for_file(cursor, key).items():
+                    if fingerprint in current_fingerprints:
+                        previous_fingerprints.add(fingerprint)
+                    elif is_shared:
+                        shared_service_ids.add(operator_service_id)
+                    else:
+                        stale_service_ids.append(operator_service_id)
+
+                for (
+                    operator_service_id,
+                    fingerprint,
+                ) in get_shared_service_fingerprints_for_file(cursor, key):
+                    if fingerprint in current_fingerprints:
+                        previous_fingerprints.add(fingerprint)
+                    else:
+                        shared_service_ids.add(operator_service_id)
+
+                if stale_service_ids:
+                    delete_services(cursor, stale_service_ids)
+                    incremental_stats["deleted_services"] = len(stale_service_ids)
+            service_fingerprints_by_id = {}
+            file_fingerprints_written = set()
+            journey_pattern_registry = JourneyPatternRegistry()
+            existing_line_ids = (
+                get_existing_txc_line_ids(
+                    cursor,
+                    collect_txc_line_keys(
+                        document,
+                        [
+                            operator
+                            for operator in operators
+                            if operator.get("NationalOperatorCode") not in invalid_nocs
+                        ],
+                        data_source,
+                    ),
+                    logger,
+                )
+                if document.vehicle_journeys
+                else {}
+            )
+
             file_has_nocs: bool = False
             file_has_services: bool = False
             file_has_lines: bool = False
@@ -808,8 +1194,8 @@ def write_to_database(
                 file_has_nocs = True
                 valid_noc = True
 
-                services = get_services_for_operator(data, operator)
-                vehicle_journeys = get_vehicle_journeys(data)
+                services = get_services_for_operator(document, operator)
+                vehicle_journeys = document.vehicle_journeys
                 noc = operator.get("NationalOperatorCode", "")
                 if not services:
                     logger.info(
@@ -840,19 +1226,83 @@ def write_to_database(
                         continue
                     file_has_lines = True
 
+                    if noc in invalid_nocs:
+                        valid_noc = False
+                        break
+
+                    fingerprint = (
+                        document.get_service_fingerprint(operator, service)
+                        if incremental
+                        else None
+                    )
+                    incremental_stats["services"] += 1
+                    if fingerprint is not None and fingerprint in previous_fingerprints:
+                        logger.info(
+                            f"Unchanged service skipped - '{noc}' - '{service.get('ServiceCode', '')}'"
+                        )
+                        # it was usable when it was written
+                        file_has_useable_data = True
+                        incremental_stats["unchanged_services"] += 1
+                        incremental_stats["unchanged_lines"] += len(lines)
+                        incremental_stats["unchanged_vehicle_journeys"] += sum(
+                            len(document.get_vehicle_journeys_for_line(line["@id"]))
+                            for line in lines
+                        )
+                        continue
+
+                    if shared_service_ids and any(
+                        existing_line_ids.get(
+                            normalise_collated_key(
+                                get_txc_line_key(operator, service, line, data_source)
+                            )
+                        )
+                        in shared_service_ids
+                        for line in lines
+                    ):
+                        # writing it again would add to the rows already written for
+                        # it, which cannot be deleted without those of the other files
+                        logger.info(
+                            f"Changed service shares its rows with another file and is not written again - '{noc}' - '{service.get('ServiceCode', '')}'"
+                        )
+                        file_has_useable_data = True
+                        incremental_stats["shared_services_not_rewritten"] += 1
+                        continue
+
                     operator_service_id = None
 
                     for line in lines:
-                        operator_service_id = check_txc_line_exists(
-                            cursor,
-                            operator,
-                            service,
-                            line,
-                            data_source,
-                            cloudwatch,
-                            logger,
+                        line_key = get_txc_line_key(
+                            operator, service, line, data_source
                         )
-                        if not operator_service_id:
+                        operator_service_id = existing_line_ids.get(
+                            normalise_collated_key(line_key)
+                        )
+                        if operator_service_id:
+                            logger.info(
+                                f"Existing line found - '{line_key[0]}' - '{line_key[1]}' - '{line_key[2]}' - '{line_key[3]}' - '{line_key[5]}'"
+                            )
+                            if operator_service_id in service_fingerprints_by_id:
+                                if (
+                                    fingerprint is not None
+                                    and service_fingerprints_by_id[operator_service_id]
+                                    != fingerprint
+                                ):
+                                    clear_service_fingerprint(
+                                        cursor, operator_service_id, key
+                                    )
+                            elif (
+                                operator_service_id,
+                                fingerprint,
+                            ) not in file_fingerprints_written:
+                                # a service row of another file, which is kept when
+                                # either file is ingested again
+                                insert_service_file_fingerprint(
+                                    cursor, operator_service_id, key, fingerprint
+                                )
+                                file_fingerprints_written.add(
+                                    (operator_service_id, fingerprint)
+                                )
+                        else:
                             operator_service_id = (
                                 insert_into_txc_operator_service_table(
                                     cursor,
@@ -862,11 +1312,22 @@ def write_to_database(
                                     region_code,
                                     data_source,
                                     key,
-                                    cloudwatch,
                                     logger,
+                                    fingerprint,
                                 )
                             )
+                            if operator_service_id:
+                                existing_line_ids[normalise_collated_key(line_key)] = (
+                                    operator_service_id
+                                )
+                                service_fingerprints_by_id[operator_service_id] = (
+                                    fingerprint
+                                )
+                                journey_pattern_registry.add_service(
+                                    operator_service_id
+                                )
                         if not operator_service_id:
+                            invalid_nocs.add(noc)
                             valid_noc = False
                             break
 
@@ -875,10 +1336,10 @@ def write_to_database(
                         (
                             vehicle_journeys_for_line,
                             journey_pattern_to_use_for_tracks,
-                        ) = format_vehicle_journeys(vehicle_journeys, line_id)
+                        ) = format_vehicle_journeys(document, line_id)
 
                         file_has_useable_data = check_file_has_usable_data(
-                            data, service
+                            document, service
                         )
 
                         if file_has_useable_data:
@@ -887,31 +1348,63 @@ def write_to_database(
                                 link_refs_for_tracks,
                             ) = iterate_through_journey_patterns_and_run_insert_queries(
                                 cursor,
-                                data,
+                                document,
                                 operator_service_id,
                                 service,
                                 vehicle_journeys_for_line,
                                 journey_pattern_to_use_for_tracks,
                                 logger,
+                                journey_pattern_registry,
+                                stop_cache,
+                                bulk_insert_limits,
+                                bulk_loader,
+                                id_allocator,
                             )
 
-                            insert_into_txc_vehicle_journey_table(
-                                cursor, vehicle_journeys_for_line, operator_service_id
-                            )
+                            if vehicle_journey_stream is None:
+                                insert_into_txc_vehicle_journey_table(
+                                    cursor,
+                                    vehicle_journeys_for_line,
+                                    operator_service_id,
+                                    bulk_insert_limits,
+                                    bulk_loader,
+                                )
+                            else:
+                                vehicle_journey_stream.add_line(
+                                    line_id, operator_service_id
+                                )
 
                     if route_ref_for_tracks and link_refs_for_tracks:
                         select_route_and_run_insert_query(
                             cursor,
-                            data,
+                            document,
                             operator_service_id,
                             route_ref_for_tracks,
                             link_refs_for_tracks,
+                            bulk_insert_limits,
+                            bulk_loader,
                         )
 
+            if incremental:
+                logger.info(
+                    f"Incremental ingest of '{key}': {json.dumps(incremental_stats)}"
+                )
+                put_metric_data_by_data_source(
+                    cloudwatch,
+                    data_source,
+                    "UnchangedServicesSkipped",
+                    incremental_stats["unchanged_services"],
+                )
+
+            if invalid_nocs:
+                put_metric_data_by_data_source(
+                    cloudwatch, data_source, "InvalidNoc", len(invalid_nocs)
+                )
+
             if not file_has_nocs:
                 logger.info(f"No NOCs found in TXC file: '{key}'")
 
-                db_connection.rollback()
+                rollback()
                 put_metric_data_by_data_source(
                     cloudwatch, data_source, "NoNOCsInFile", 1
                 )
@@ -920,7 +1413,7 @@ def write_to_database(
             if not file_has_services:
                 logger.info(f"No service data found in TXC file: '{key}'")
 
-                db_connection.rollback()
+                rollback()
                 put_metric_data_by_data_source(
                     cloudwatch, data_source, "NoServiceDataInFile", 1
                 )
@@ -929,7 +1422,7 @@ def write_to_database(
             if not file_has_vehicle_journeys:
                 logger.info(f"No vehicle journeys data found in TXC file: '{key}'")
 
-                db_connection.rollback()
+                rollback()
                 put_metric_data_by_data_source(
                     cloudwatch, data_source, "NoVehicleJourneysDataInFile", 1
                 )
@@ -938,7 +1431,7 @@ def write_to_database(
             if not file_has_lines:
                 logger.info(f"No line data found in TXC file: '{key}'")
 
-                db_connection.rollback()
+                rollback()
                 put_metric_data_by_data_source(
                     cloudwatch, data_source, "NoLineDataInFile", 1
                 )
@@ -947,22 +1440,38 @@ def write_to_database(
             if not file_has_useable_data:
                 logger.info(f"No useable data found in TXC file: '{key}'")
 
-                db_connection.rollback()
+                rollback()
                 put_metric_data_by_data_source(
                     cloudwatch, data_source, "NoUseableDataInFile", 1
                 )
                 return False
 
+            if vehicle_journey_stream is not None:
+                vehicle_journey_stream.write(cursor, bulk_insert_limits, bulk_loader)
+
+            if bulk_loader is not None:
+                loaded_rows = bulk_loader.load(cursor)
+                logger.info(f"Bulk loaded rows: {loaded_rows}")
+
+            if content_hash is not None:
+                record_ingested_content(cursor, data_source, content_hash, key)
+
+            logger.info(f"Stop cache stats: {stop_cache.get_stats()}")
+
             db_connection.commit()
             return True
 
     except Exception as e:
-        db_connection.rollback()
+        rollback()
         logger.error(
             f"ERROR! Unexpected error. Could not write to database. Error: {e}"
         )
         raise e
 
+    finally:
+        if bulk_loader is not None:
+            bulk_loader.close()
+
 
 def download_from_s3_and_write_to_db(
     s3,
@@ -972,24 +1481,74 @@ def download_from_s3_and_write_to_db(
     file_path,
     db_connection: aurora_data_api.AuroraDataAPIClient,
     logger,
+    streaming_threshold_bytes: int = DEFAULT_STREAMING_THRESHOLD_BYTES,
+    streaming_chunk_size: int = DEFAULT_STREAMING_CHUNK_SIZE,
+    stop_cache: Optional[StopCache] = None,
+    bulk_insert_limits: Optional[dict] = None,
+    bulk_load_target=None,
+    id_allocator: Optional[IdAllocator] = None,
+    use_ingest_ledger: bool = False,
+    incremental: bool = False,
+    noc_cache: Optional[NocCache] = None,
 ):
+    data_source = key.split("/")[0]
+    content_hash = None
+
+    if use_ingest_ledger:
+        content_hash = get_content_hash(s3, bucket, key)
+        with db_connection.cursor() as cursor:
+            already_ingested = has_content_been_ingested(
+                cursor, data_source, content_hash, key
+            )
+        # the lookup only reads, so its transaction is ended here rather than being
+        # left open while the file is downloaded and parsed
+        db_connection.rollback()
+
+        if already_ingested:
+            logger.info(
+                f"Skipping '{key}', the same content has already been written to the database"
+            )
+            put_metric_data_by_data_source(
+                cloudwatch, data_source, "UnchangedFileSkipped", 1
+            )
+            return
+
     s3.download_file(bucket, key, file_path)
     logger.info(f"Downloaded S3 file, '{key}' to '{file_path}'")
 
-    tree = eT.parse(file_path)
-    xml_data = tree.getroot()
-    xml_string = eT.tostring(xml_data, encoding="utf-8", method="xml")
-    xmltodict_namespaces = {"http://www.transxchange.org.uk/": None}
-    data_dict = xmltodict.parse(
-        xml_string, process_namespaces=True, namespaces=xmltodict_namespaces
-    )
+    file_size = os.path.getsize(file_path)
+    vehicle_journey_stream = None
+
+    if file_size >= streaming_threshold_bytes:
+        logger.info(
+            f"File size {file_size} bytes is over the streaming threshold, streaming vehicle journeys in chunks of {streaming_chunk_size}"
+        )
+        data_dict = parse_txc_reference_sections(file_path)
+        vehicle_journey_stream = StreamedVehicleJourneys(
+            file_path, streaming_chunk_size, data_dict
+        )
+    else:
+        data_dict = parse_txc_file(file_path)
 
-    data_source = key.split("/")[0]
     region_code = key.split("/")[1] if data_source == "tnds" else None
 
     logger.info("Starting write to database...")
     written_success = write_to_database(
-        data_dict, region_code, data_source, key, db_connection, logger, cloudwatch
+        data_dict,
+        region_code,
+        data_source,
+        key,
+        db_connection,
+        logger,
+        cloudwatch,
+        vehicle_journey_stream=vehicle_journey_stream,
+        stop_cache=stop_cache,
+        bulk_insert_limits=bulk_insert_limits,
+        bulk_load_target=bulk_load_target,
+        id_allocator=id_allocator,
+        content_hash=content_hash,
+        incremental=incremental,
+        noc_cache=noc_cache,
     )
 
     if written_success:
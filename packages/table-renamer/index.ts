@@ -104,6 +104,8 @@ const tables = [
     "vehicle_journeys",
     "tracks",
     "nptg_admin_areas",
+    "txc_ingest_ledger",
+    "service_file_fingerprints",
 ];
 
 export const deleteAndRenameTables = async (db: Kysely<Database>): Promise<void> => {
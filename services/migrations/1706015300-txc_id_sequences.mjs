@@ -0,0 +1,17 @@
+/**
+ * @param db {Kysely<any>}
+ */
+export async function up(db) {
+    await db.schema
+        .createTable("txc_id_sequences")
+        .addColumn("tableName", "varchar(255)", (col) => col.primaryKey())
+        .addColumn("nextId", "bigint", (col) => col.notNull())
+        .execute();
+}
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function down(db) {
+    await db.schema.dropTable("txc_id_sequences").execute();
+}
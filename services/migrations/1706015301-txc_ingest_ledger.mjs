@@ -0,0 +1,25 @@
+import { sql } from "kysely";
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function up(db) {
+    await db.schema
+        .createTable("txc_ingest_ledger")
+        .addColumn("id", "integer", (col) => col.primaryKey().autoIncrement())
+        .addColumn("dataSource", sql`enum('bods', 'tnds')`, (col) => col.notNull())
+        .addColumn("contentHash", "varchar(255)", (col) => col.notNull())
+        .addColumn("filePath", "varchar(1000)", (col) => col.notNull())
+        .addColumn("ingestedAt", "timestamp", (col) => col.defaultTo(sql`CURRENT_TIMESTAMP`))
+        .execute();
+
+    // the same content at another path is written again, as its rows carry the path
+    await sql`CREATE UNIQUE INDEX uniq_file ON txc_ingest_ledger (dataSource, contentHash, filePath(255))`.execute(db);
+}
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function down(db) {
+    await db.schema.dropTable("txc_ingest_ledger").execute();
+}
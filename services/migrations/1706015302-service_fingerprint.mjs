@@ -0,0 +1,21 @@
+import { sql } from "kysely";
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function up(db) {
+    await db.schema
+        .alterTable("services")
+        .addColumn("fingerprint", "varchar(64)", (col) => col.defaultTo(null))
+        .execute();
+
+    await sql`CREATE INDEX idx_filePath ON services (filePath(255))`.execute(db);
+}
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function down(db) {
+    await db.schema.dropIndex("idx_filePath").on("services").execute();
+    await db.schema.alterTable("services").dropColumn("fingerprint").execute();
+}
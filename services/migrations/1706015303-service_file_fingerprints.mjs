@@ -0,0 +1,28 @@
+import { sql } from "kysely";
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function up(db) {
+    await db.schema
+        .createTable("service_file_fingerprints")
+        .addColumn("id", "integer", (col) => col.primaryKey().autoIncrement())
+        .addColumn("operatorServiceId", "integer", (col) => col.notNull())
+        .addColumn("filePath", "varchar(1000)", (col) => col.notNull())
+        .addColumn("fingerprint", "varchar(64)", (col) => col.defaultTo(null))
+        .execute();
+
+    await sql`CREATE INDEX idx_filePath ON service_file_fingerprints (filePath(255))`.execute(db);
+    await db.schema
+        .createIndex("idx_service_file_fingerprints_operatorServiceId")
+        .on("service_file_fingerprints")
+        .column("operatorServiceId")
+        .execute();
+}
+
+/**
+ * @param db {Kysely<any>}
+ */
+export async function down(db) {
+    await db.schema.dropTable("service_file_fingerprints").execute();
+}
@@ -258,7 +258,6 @@ export function RetrieversStack({ stack }: StackContext) {
         runtime: "python3.12",
         timeout: 600,
         memorySize: 2560,
-        diskSize: "3072 MB",
         retryAttempts: 0,
         environment: {
             BUCKET_NAME: txcBucket.bucketName,
@@ -271,7 +270,11 @@ export function RetrieversStack({ stack }: StackContext) {
             }),
             new PolicyStatement({
                 actions: ["s3:GetObject"],
-                resources: [`${txcZippedBucket.bucketArn}/*`],
+                resources: [`${txcBucket.bucketArn}/*`, `${txcZippedBucket.bucketArn}/*`],
+            }),
+            new PolicyStatement({
+                actions: ["s3:ListBucket"],
+                resources: [txcBucket.bucketArn, txcZippedBucket.bucketArn],
             }),
             new PolicyStatement({
                 actions: ["cloudwatch:PutMetricData"],